@@ -0,0 +1,208 @@
+"""
+Benchmark the folder creation backends against local stand-ins
+
+Runs each backend function against the fake WebDAV server (webdav_server.py) and the
+fake ssh/occ (bin/ssh) at several concurrency levels, and reports throughput and
+p50/p95/p99 latency. Nothing leaves the machine.
+
+Needs a Frappe site for the app context (Redis, logger) - use a development site,
+the run also feeds the app's latency metrics. From the bench directory:
+
+	./env/bin/python apps/nextcloud_integration/benchmarks/run.py --site dev.localhost
+	./env/bin/python apps/nextcloud_integration/benchmarks/run.py --site dev.localhost \
+		--backends webdav_optimized,ssh_occ_batch --concurrency 1,8,32 --latency-ms 40 --output baseline.json
+	./env/bin/python apps/nextcloud_integration/benchmarks/run.py --site dev.localhost --compare baseline.json
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import frappe
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARK_DIR)
+
+from webdav_server import start_server  # noqa: E402
+
+# Fake target so the benchmark never shares an SSH master with a real server
+SSH_HOST = "fake-nextcloud.invalid"
+SSH_USER = "bench"
+NEXTCLOUD_USER = "admin"
+
+BACKENDS = ("create_nextcloud_folder", "ssh_occ", "ssh_occ_batch", "webdav_optimized", "rest_api")
+
+BATCH_SIZE = 50
+
+
+def _percentile(sorted_values, q):
+	"""Nearest-rank percentile"""
+	if not sorted_values:
+		return None
+	return sorted_values[max(int(math.ceil(q * len(sorted_values))) - 1, 0)]
+
+
+def _init_thread(site, sites_path):
+	frappe.init(site=site, sites_path=sites_path)
+	frappe.connect()
+
+
+def _make_call(backend, url):
+	"""Get a callable creating a list of folders with one backend, returning one result per folder"""
+	from nextcloud_integration.nextcloud_integration import nextcloud_api
+	
+	ssh_kwargs = {
+		"ssh_host": SSH_HOST,
+		"ssh_user": SSH_USER,
+		"nextcloud_user": NEXTCLOUD_USER,
+		"nextcloud_url": url
+	}
+	
+	if backend == "create_nextcloud_folder":
+		return lambda paths: [nextcloud_api.create_nextcloud_folder(url, NEXTCLOUD_USER, "secret", paths[0])]
+	if backend == "ssh_occ":
+		return lambda paths: [nextcloud_api._create_via_ssh_occ(folder_path=paths[0], **ssh_kwargs)]
+	if backend == "ssh_occ_batch":
+		return lambda paths: list(nextcloud_api._create_via_ssh_occ_batch(folder_paths=paths, **ssh_kwargs)["results"].values())
+	if backend == "webdav_optimized":
+		return lambda paths: [nextcloud_api._create_via_webdav_optimized(url, NEXTCLOUD_USER, "secret", paths[0])]
+	if backend == "rest_api":
+		return lambda paths: [nextcloud_api._create_via_rest_api(url, NEXTCLOUD_USER, "secret", paths[0])]
+	raise ValueError(f"Unknown backend {backend}")
+
+
+def run_case(backend, concurrency, operations, url, run_id, site, sites_path):
+	"""
+	Create `operations` folders with one backend at one concurrency level
+	
+	Returns:
+		dict: backend, concurrency, operations, errors, seconds, throughput, p50/p95/p99 (ms per call)
+	"""
+	call = _make_call(backend, url)
+	base = f"Benchmark/{run_id}/{backend}-c{concurrency}"
+	paths = [f"{base}/Opportunity-{i:06d}" for i in range(operations)]
+	
+	# Batches for the batched backend, one folder per call otherwise
+	size = BATCH_SIZE if backend == "ssh_occ_batch" else 1
+	chunks = [paths[i:i + size] for i in range(0, len(paths), size)]
+	
+	latencies = []
+	errors = 0
+	
+	def timed(chunk):
+		start = time.perf_counter()
+		results = call(chunk)
+		return time.perf_counter() - start, results
+	
+	start_time = time.perf_counter()
+	with ThreadPoolExecutor(max_workers=concurrency, initializer=_init_thread, initargs=(site, sites_path)) as executor:
+		for seconds, results in executor.map(timed, chunks):
+			latencies.append(seconds)
+			errors += sum(1 for r in results if not r.get("success"))
+	elapsed = time.perf_counter() - start_time
+	
+	latencies.sort()
+	return {
+		"backend": backend,
+		"concurrency": concurrency,
+		"operations": operations,
+		"errors": errors,
+		"seconds": round(elapsed, 3),
+		"throughput": round(operations / elapsed, 1) if elapsed else None,
+		"p50_ms": round(_percentile(latencies, 0.50) * 1000, 1),
+		"p95_ms": round(_percentile(latencies, 0.95) * 1000, 1),
+		"p99_ms": round(_percentile(latencies, 0.99) * 1000, 1)
+	}
+
+
+def print_results(results, baseline=None):
+	baseline = {(r["backend"], r["concurrency"]): r for r in (baseline or [])}
+	
+	header = f"{'backend':<26}{'conc':>6}{'ops':>7}{'errors':>8}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+	if baseline:
+		header += f"{'ops/s vs base':>16}{'p99 vs base':>14}"
+	print(header)
+	
+	for r in results:
+		line = (
+			f"{r['backend']:<26}{r['concurrency']:>6}{r['operations']:>7}{r['errors']:>8}"
+			f"{r['throughput']:>10}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}"
+		)
+		base = baseline.get((r["backend"], r["concurrency"]))
+		if base:
+			line += f"{(r['throughput'] / base['throughput'] - 1) * 100:>+15.1f}%{(r['p99_ms'] / base['p99_ms'] - 1) * 100:>+13.1f}%"
+		print(line)
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark Nextcloud folder creation backends against local stand-ins")
+	parser.add_argument("--site", required=True, help="Frappe site providing the app context (use a development site)")
+	parser.add_argument("--sites-path", default="sites", help="Path to the bench sites directory")
+	parser.add_argument("--backends", default=",".join(BACKENDS), help=f"Comma separated subset of: {', '.join(BACKENDS)}")
+	parser.add_argument("--concurrency", default="1,4,16", help="Comma separated concurrency levels")
+	parser.add_argument("--operations", type=int, default=200, help="Folders created per backend and concurrency level")
+	parser.add_argument("--latency-ms", type=float, default=20, help="WebDAV server latency per request")
+	parser.add_argument("--jitter-ms", type=float, default=5, help="Random extra WebDAV latency per request")
+	parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of WebDAV requests answered with 503")
+	parser.add_argument("--ssh-connect-ms", type=float, default=150, help="Fake SSH handshake without a master connection")
+	parser.add_argument("--ssh-rtt-ms", type=float, default=20, help="Fake SSH round trip per command")
+	parser.add_argument("--occ-bootstrap-ms", type=float, default=300, help="Fake Nextcloud PHP bootstrap per occ call")
+	parser.add_argument("--ssh-error-rate", type=float, default=0.0, help="Fraction of fake occ calls that fail")
+	parser.add_argument("--output", help="Write the results as JSON (e.g. a baseline)")
+	parser.add_argument("--compare", help="Baseline JSON from an earlier --output run to compare against")
+	args = parser.parse_args()
+	
+	# Fake ssh first on PATH for this process and everything it spawns
+	os.environ["PATH"] = os.path.join(BENCHMARK_DIR, "bin") + os.pathsep + os.environ.get("PATH", "")
+	os.environ.update({
+		"FAKE_SSH_CONNECT_MS": str(args.ssh_connect_ms),
+		"FAKE_SSH_RTT_MS": str(args.ssh_rtt_ms),
+		"FAKE_OCC_BOOTSTRAP_MS": str(args.occ_bootstrap_ms),
+		"FAKE_SSH_ERROR_RATE": str(args.ssh_error_rate)
+	})
+	
+	_init_thread(args.site, args.sites_path)
+	
+	from nextcloud_integration.nextcloud_integration.nextcloud_api import close_webdav_sessions
+	from nextcloud_integration.nextcloud_integration.ssh_pool import close_ssh_master, get_ssh_options
+	
+	server, state, url = start_server(args.latency_ms, args.jitter_ms, args.error_rate)
+	run_id = time.strftime("%Y%m%d-%H%M%S")
+	print(f"Fake Nextcloud at {url}, run {run_id}\n")
+	
+	results = []
+	try:
+		for backend in [b.strip() for b in args.backends.split(",") if b.strip()]:
+			for concurrency in [int(c) for c in args.concurrency.split(",")]:
+				# Every case starts cold: no pooled HTTP connection, no SSH master
+				close_webdav_sessions()
+				close_ssh_master(f"{SSH_USER}@{SSH_HOST}", get_ssh_options())
+				results.append(run_case(backend, concurrency, args.operations, url, run_id, args.site, args.sites_path))
+	finally:
+		close_ssh_master(f"{SSH_USER}@{SSH_HOST}", get_ssh_options())
+		server.shutdown()
+		frappe.destroy()
+	
+	baseline = None
+	if args.compare:
+		with open(args.compare) as f:
+			baseline = json.load(f)["results"]
+	
+	print_results(results, baseline)
+	print(f"\n{state.requests} WebDAV/OCS requests served")
+	
+	if args.output:
+		with open(args.output, "w") as f:
+			json.dump({
+				"run_id": run_id,
+				"settings": {k: v for k, v in vars(args).items() if k not in ("output", "compare", "site", "sites_path")},
+				"results": results
+			}, f, indent=2)
+		print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+	main()
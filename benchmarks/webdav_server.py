@@ -0,0 +1,181 @@
+"""
+Local stand-in for the Nextcloud WebDAV / OCS endpoints used by the benchmarks
+
+Keeps the folder tree in memory and answers like Nextcloud does:
+	MKCOL     201 created, 405 exists, 409 parent missing
+	PROPFIND  207 for existing folders, 404 otherwise
+	MOVE      201 moved, 404 source missing, 412 destination exists (Overwrite: F)
+	POST      201 on the OCS files endpoint
+
+Every request is delayed by the configured latency (plus jitter) and fails with
+503 at the configured error rate. Authentication is not checked.
+
+Standalone:
+	python benchmarks/webdav_server.py --port 8080 --latency-ms 20 --error-rate 0.01
+"""
+import argparse
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+
+DAV_PREFIX = "/remote.php/dav/files/"
+OCS_PREFIX = "/ocs/v2.php/apps/files/api/v1/files/"
+
+
+class FakeNextcloud:
+	"""In-memory folder tree shared by all request threads"""
+	
+	def __init__(self, latency_ms=0, jitter_ms=0, error_rate=0.0):
+		self.latency_ms = latency_ms
+		self.jitter_ms = jitter_ms
+		self.error_rate = error_rate
+		self.folders = set()
+		self.next_id = 1
+		self.lock = threading.Lock()
+		self.requests = 0
+	
+	def delay(self):
+		latency = self.latency_ms + (random.uniform(0, self.jitter_ms) if self.jitter_ms else 0)
+		if latency:
+			time.sleep(latency / 1000.0)
+	
+	def should_fail(self):
+		return self.error_rate and random.random() < self.error_rate
+	
+	def exists(self, path):
+		return not path or path in self.folders
+	
+	def create(self, path):
+		"""Returns (status, file id)"""
+		with self.lock:
+			parent = path.rsplit("/", 1)[0] if "/" in path else ""
+			if path in self.folders:
+				return 405, None
+			if not self.exists(parent):
+				return 409, None
+			self.folders.add(path)
+			self.next_id += 1
+			return 201, self.next_id
+	
+	def move(self, source, destination, overwrite):
+		with self.lock:
+			if source not in self.folders:
+				return 404
+			if destination in self.folders and not overwrite:
+				return 412
+			parent = destination.rsplit("/", 1)[0] if "/" in destination else ""
+			if not self.exists(parent):
+				return 409
+			for path in [p for p in self.folders if p == source or p.startswith(source + "/")]:
+				self.folders.discard(path)
+				self.folders.add(destination + path[len(source):])
+			return 201
+
+
+def _user_path(url_path, prefix):
+	"""Strip the endpoint prefix and user name, returns the folder path relative to the user root"""
+	rest = unquote(urlparse(url_path).path)[len(prefix):]
+	parts = [p for p in rest.split("/") if p]
+	return "/".join(parts[1:])
+
+
+def make_handler(state):
+	class Handler(BaseHTTPRequestHandler):
+		protocol_version = "HTTP/1.1"  # Keep-alive, like Nextcloud behind nginx
+		
+		def log_message(self, format, *args):
+			pass
+		
+		def _reply(self, status, body=b"", headers=None):
+			self.send_response(status)
+			for name, value in (headers or {}).items():
+				self.send_header(name, str(value))
+			self.send_header("Content-Length", str(len(body)))
+			self.end_headers()
+			if body:
+				self.wfile.write(body)
+		
+		def _start(self):
+			"""Read the request body, apply latency and injected errors; returns False if the request failed"""
+			length = int(self.headers.get("Content-Length") or 0)
+			if length:
+				self.rfile.read(length)
+			
+			with state.lock:
+				state.requests += 1
+			state.delay()
+			
+			if state.should_fail():
+				self._reply(503, b"Service Unavailable (injected)")
+				return False
+			return True
+		
+		def do_MKCOL(self):
+			if not self._start():
+				return
+			status, file_id = state.create(_user_path(self.path, DAV_PREFIX))
+			self._reply(status, headers={"OC-FileId": file_id} if file_id else None)
+		
+		def do_PROPFIND(self):
+			if not self._start():
+				return
+			path = _user_path(self.path, DAV_PREFIX)
+			if not state.exists(path):
+				self._reply(404)
+				return
+			body = (
+				'<?xml version="1.0"?><d:multistatus xmlns:d="DAV:"><d:response>'
+				f'<d:href>{self.path}</d:href><d:propstat><d:prop><d:resourcetype><d:collection/></d:resourcetype>'
+				'</d:prop><d:status>HTTP/1.1 200 OK</d:status></d:propstat></d:response></d:multistatus>'
+			).encode("utf-8")
+			self._reply(207, body, {"Content-Type": "application/xml; charset=utf-8"})
+		
+		def do_MOVE(self):
+			if not self._start():
+				return
+			destination = _user_path(self.headers.get("Destination", ""), DAV_PREFIX)
+			overwrite = self.headers.get("Overwrite", "T").upper() != "F"
+			self._reply(state.move(_user_path(self.path, DAV_PREFIX), destination, overwrite))
+		
+		def do_POST(self):
+			if not self._start():
+				return
+			if not urlparse(self.path).path.startswith(OCS_PREFIX):
+				self._reply(404)
+				return
+			status, _ = state.create(_user_path(self.path, OCS_PREFIX))
+			self._reply({405: 200}.get(status, status), b"{}", {"Content-Type": "application/json"})
+	
+	return Handler
+
+
+def start_server(latency_ms=0, jitter_ms=0, error_rate=0.0, port=0):
+	"""
+	Start the server in a background thread
+	
+	Returns:
+		tuple: (server, state, base url)
+	"""
+	state = FakeNextcloud(latency_ms=latency_ms, jitter_ms=jitter_ms, error_rate=error_rate)
+	server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+	server.daemon_threads = True
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return server, state, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Local Nextcloud WebDAV stand-in")
+	parser.add_argument("--port", type=int, default=8080)
+	parser.add_argument("--latency-ms", type=float, default=0)
+	parser.add_argument("--jitter-ms", type=float, default=0)
+	parser.add_argument("--error-rate", type=float, default=0.0)
+	args = parser.parse_args()
+	
+	server, _, url = start_server(args.latency_ms, args.jitter_ms, args.error_rate, args.port)
+	print(f"Fake Nextcloud listening on {url}")
+	try:
+		threading.Event().wait()
+	except KeyboardInterrupt:
+		server.shutdown()
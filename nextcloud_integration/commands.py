@@ -0,0 +1,119 @@
+import click
+import frappe
+from frappe.commands import get_site, pass_context
+
+
+@click.command("nextcloud-backfill")
+@click.option("--concurrency", default=8, type=int, help="Maximum number of Nextcloud requests in flight")
+@click.option("--page-size", default=500, type=int, help="Number of Opportunities loaded per page")
+@click.option("--reset", is_flag=True, default=False, help="Ignore the saved checkpoint and start from the beginning")
+@pass_context
+def nextcloud_backfill(context, concurrency, page_size, reset):
+	"""Create Nextcloud folders for existing Opportunities that do not have one"""
+	from nextcloud_integration.nextcloud_integration.backfill import RUNNING_KEY, RUNNING_TTL, run_backfill
+	
+	site = get_site(context)
+	frappe.init(site=site)
+	frappe.connect()
+	
+	cache = frappe.cache()
+	try:
+		if not cache.set(cache.make_key(RUNNING_KEY), 1, nx=True, ex=RUNNING_TTL):
+			click.secho("A Nextcloud backfill is already running for this site.", fg="red")
+			return
+		
+		def report(progress):
+			click.echo(
+				f"{progress['processed']}/{progress['total']} processed, "
+				f"{progress['created']} created, {progress['failed']} failed, "
+				f"{progress['rate']}/s, ETA {progress['eta_seconds']}s (checkpoint: {progress['checkpoint']})"
+			)
+		
+		result = run_backfill(concurrency=concurrency, page_size=page_size, reset=reset, progress_callback=report)
+		if result.get("success"):
+			click.secho(
+				f"Done: {result['processed']} processed, {result['created']} created, "
+				f"{result['failed']} failed in {result['elapsed']}s ({result['rate']}/s)",
+				fg="green"
+			)
+		else:
+			click.secho(result.get("error"), fg="red")
+	finally:
+		cache.delete(cache.make_key(RUNNING_KEY))
+		frappe.destroy()
+
+
+@click.command("nextcloud-metrics")
+@click.option("--reset", is_flag=True, default=False, help="Clear the recorded timings after printing them")
+@pass_context
+def nextcloud_metrics(context, reset):
+	"""Print the per-stage latency of Nextcloud folder jobs"""
+	from nextcloud_integration.nextcloud_integration.metrics import get_summary, reset_metrics
+	
+	site = get_site(context)
+	frappe.init(site=site)
+	frappe.connect()
+	
+	try:
+		summary = get_summary()
+		if not summary:
+			click.echo("No timings recorded yet.")
+			return
+		
+		def fmt(value):
+			return "-" if value is None else f"{value * 1000:.1f}ms"
+		
+		click.echo(f"{'stage':<16}{'backend':<16}{'count':>8}{'mean':>12}{'p50':>12}{'p95':>12}{'p99':>12}")
+		for row in summary:
+			click.echo(
+				f"{row['stage']:<16}{row['backend'] or '-':<16}{row['count']:>8}"
+				f"{fmt(row['mean']):>12}{fmt(row['p50']):>12}{fmt(row['p95']):>12}{fmt(row['p99']):>12}"
+			)
+		
+		if reset:
+			reset_metrics()
+			click.secho("Timings cleared.", fg="green")
+	finally:
+		frappe.destroy()
+
+
+@click.command("nextcloud-migrate-layout")
+@click.option("--batch-size", default=100, type=int, help="Number of folders read and moved per batch")
+@click.option("--concurrency", default=4, type=int, help="Maximum number of MOVE requests in flight")
+@click.option("--dry-run", is_flag=True, default=False, help="Only list the folders that would be moved")
+@pass_context
+def nextcloud_migrate_layout(context, batch_size, concurrency, dry_run):
+	"""Move existing Nextcloud folders to the paths of the current Folder Layout"""
+	from nextcloud_integration.nextcloud_integration.layout_migration import run_layout_migration
+	
+	site = get_site(context)
+	frappe.init(site=site)
+	frappe.connect()
+	
+	try:
+		def report(progress):
+			click.echo(
+				f"{progress['scanned']} scanned, {progress['moved']} moved, {progress['failed']} failed"
+				f"{', ' + str(progress['planned']) + ' to move' if dry_run else ''} (checkpoint: {progress['checkpoint']})"
+			)
+		
+		result = run_layout_migration(batch_size=batch_size, concurrency=concurrency, dry_run=dry_run, progress_callback=report)
+		if not result.get("success"):
+			click.secho(result.get("error"), fg="red")
+			return
+		
+		if dry_run:
+			for name, old_path, new_path in result["planned"]:
+				click.echo(f"{name}: {old_path} -> {new_path}")
+			click.secho(f"{len(result['planned'])} of {result['scanned']} folders would be moved.", fg="green")
+		else:
+			click.secho(
+				f"Done: {result['scanned']} scanned, {result['moved']} moved, "
+				f"{result['failed']} failed in {result['elapsed']}s",
+				fg="green"
+			)
+	finally:
+		frappe.destroy()
+
+
+commands = [nextcloud_backfill, nextcloud_metrics, nextcloud_migrate_layout]
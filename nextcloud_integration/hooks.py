@@ -1,7 +1,22 @@
 from frappe import _
 import frappe
 from datetime import datetime
-from nextcloud_integration.nextcloud_integration.nextcloud_api import create_nextcloud_folder, test_nextcloud_connection
+from frappe.utils import cint, get_datetime
+from nextcloud_integration.nextcloud_integration.nextcloud_api import test_nextcloud_connection
+from nextcloud_integration.nextcloud_integration.attachment_sync import enqueue_attachment_sync
+from nextcloud_integration.nextcloud_integration.backend_router import BACKEND_SSH, get_preferred_backend
+from nextcloud_integration.nextcloud_integration.folder_batcher import queue_new_opportunities
+from nextcloud_integration.nextcloud_integration.folder_layout import ensure_parent_paths, get_folder_path, get_parent_paths
+from nextcloud_integration.nextcloud_integration.folder_links import delete_folder_link, get_folder_link, save_folder_link
+from nextcloud_integration.nextcloud_integration.folder_renames import apply_rename, prepare_rename, queue_renames
+from nextcloud_integration.nextcloud_integration.circuit_breaker import get_open_remaining, is_open as circuit_is_open, record_failure, record_success
+from nextcloud_integration.nextcloud_integration.health_monitor import DOWN_RETRY_DELAY, get_outage
+from nextcloud_integration.nextcloud_integration.targets import DEFAULT_TARGET, TARGET_BUSY_DELAY, get_target_name, get_targets, resolve_target, target_slot
+from nextcloud_integration.nextcloud_integration.metrics import finish_trace, stage_timer, start_trace
+from nextcloud_integration.nextcloud_integration.queues import enqueue_folder_job
+from nextcloud_integration.nextcloud_integration.retry_queue import clear_give_up, get_retry_delay, record_give_up, schedule_retry
+from nextcloud_integration.nextcloud_integration.settings_cache import get_secret, get_settings_name
+from nextcloud_integration.nextcloud_integration.share_links import queue_share_links
 
 app_name = "nextcloud_integration"
 app_title = "Nextcloud Integration"
@@ -13,7 +28,33 @@ app_license = "MIT"
 # Hooks
 doc_events = {
 	"Opportunity": {
-		"after_insert": "nextcloud_integration.hooks.create_opportunity_folder"
+		"after_insert": "nextcloud_integration.hooks.create_opportunity_folder",
+		"before_rename": "nextcloud_integration.hooks.prepare_opportunity_folder_rename",
+		"after_rename": "nextcloud_integration.hooks.rename_opportunity_folder",
+		"on_trash": "nextcloud_integration.hooks.delete_opportunity_folder_link",
+		"onload": "nextcloud_integration.hooks.load_folder_link"
+	},
+	"File": {
+		"after_insert": "nextcloud_integration.nextcloud_integration.attachment_sync.on_file_insert"
+	}
+}
+
+# The Nextcloud Folder record is removed with its Opportunity, it never blocks the delete
+ignore_links_on_delete = ["Nextcloud Folder"]
+
+scheduler_events = {
+	"daily": [
+		"nextcloud_integration.hooks.prewarm_year_folders"
+	],
+	"hourly_long": [
+		"nextcloud_integration.nextcloud_integration.reconciliation.run_reconciliation"
+	],
+	"cron": {
+		"* * * * *": [
+			"nextcloud_integration.nextcloud_integration.retry_queue.enqueue_due_retries",
+			"nextcloud_integration.nextcloud_integration.health_monitor.run_health_checks",
+			"nextcloud_integration.nextcloud_integration.folder_batcher.resume_interrupted_flush"
+		]
 	}
 }
 
@@ -21,54 +62,263 @@ doc_events = {
 def create_opportunity_folder(doc, method):
 	"""
 	Create a folder in Nextcloud when a new Opportunity is created
-	Runs in background to avoid blocking the opportunity creation
+	
+	Does no database work inside the insert transaction: the name (and the creation date
+	the Folder Layout dates the folder by) is collected in the request and queued after
+	commit, so the job never runs before the Opportunity is visible. With batched SSH +
+	OCC, all Opportunities inserted in one transaction (or one import) share a single
+	batched job.
 	"""
+	pending = getattr(frappe.local, "nextcloud_new_opportunities", None)
+	if pending is None:
+		pending = frappe.local.nextcloud_new_opportunities = {}
+		frappe.db.after_commit.add(_queue_new_opportunities)
+		frappe.db.after_rollback.add(_discard_new_opportunities)
+	pending[doc.name] = str(doc.creation)
+
+def _queue_new_opportunities():
+	"""after_commit callback: queue the Opportunities inserted in the committed transaction"""
+	created = getattr(frappe.local, "nextcloud_new_opportunities", None) or {}
+	frappe.local.nextcloud_new_opportunities = None
+	opportunity_names = list(created)
 	try:
-		# Check if auto-create is enabled
-		settings_name = _get_settings_name()
-		if settings_name:
-			nextcloud_config = frappe.get_doc("Nextcloud Settings", settings_name)
-			if not nextcloud_config.enabled or not nextcloud_config.is_feature_enabled("auto_create"):
-				frappe.logger().info(f"Auto-create folders is disabled. Skipping folder creation for Opportunity {doc.name}")
-				return
-		
-		# Enqueue the folder creation to run in background
-		frappe.enqueue(
-			method=_create_nextcloud_folder_background,
-			queue="default",
-			timeout=None,  # No timeout
-			job_name=f"create_nextcloud_folder_{doc.name}",
-			opportunity_name=doc.name,
-			is_async=True
+		queue_new_opportunities(opportunity_names, created=created)
+		frappe.logger().info(f"Queued Nextcloud folder creation for {len(opportunity_names)} Opportunities")
+	except Exception as e:
+		frappe.log_error(
+			title="Nextcloud Integration Error",
+			message=f"Error queueing Nextcloud folder creation for Opportunities {', '.join(opportunity_names)}: {str(e)}"
 		)
-		frappe.logger().info(f"Enqueued Nextcloud folder creation for Opportunity {doc.name}")
+
+def _discard_new_opportunities():
+	"""after_rollback callback: the inserts were rolled back, so are their folders"""
+	frappe.local.nextcloud_new_opportunities = None
+
+def prepare_opportunity_folder_rename(doc, method, old_name, new_name, merge=False):
+	"""
+	Work out the folder move of a renamed or merged Opportunity, before ERPNext relinks the old name
+	
+	The move is kept for rename_opportunity_folder, which runs after the rename.
+	"""
+	if getattr(frappe.local, "nextcloud_prepared_renames", None) is None:
+		frappe.local.nextcloud_prepared_renames = {}
+	# Also stored when None, replacing what a failed earlier rename of the same name left behind
+	frappe.local.nextcloud_prepared_renames[old_name] = prepare_rename(old_name, new_name, merge=cint(merge))
+
+def rename_opportunity_folder(doc, method, old_name, new_name, merge=False):
+	"""
+	Move the Nextcloud folder of a renamed or merged Opportunity
+	
+	The Nextcloud Folder record is carried over to the new name in the rename's
+	transaction. The server-side MOVE itself runs after commit: all renames of one
+	transaction (or one bulk rename) share a single batched job.
+	"""
+	move = (getattr(frappe.local, "nextcloud_prepared_renames", None) or {}).pop(old_name, None)
+	if not move:
+		return
+	
+	apply_rename(move)
+	pending = getattr(frappe.local, "nextcloud_renames", None)
+	if pending is None:
+		pending = frappe.local.nextcloud_renames = []
+		frappe.db.after_commit.add(_queue_renames)
+		frappe.db.after_rollback.add(_discard_renames)
+	pending.append(move)
+
+def _queue_renames():
+	"""after_commit callback: queue the folder moves of the committed renames"""
+	moves = getattr(frappe.local, "nextcloud_renames", None) or []
+	frappe.local.nextcloud_renames = None
+	try:
+		queue_renames(moves)
+		frappe.logger().info(f"Queued Nextcloud folder moves for {len(moves)} renamed Opportunities")
 	except Exception as e:
 		frappe.log_error(
 			title="Nextcloud Integration Error",
-			message=f"Error enqueueing Nextcloud folder creation for Opportunity {doc.name}: {str(e)}"
+			message=f"Error queueing Nextcloud folder moves for Opportunities {', '.join(m['new_name'] for m in moves)}: {str(e)}"
 		)
 
+def _discard_renames():
+	"""after_rollback callback: the renames were rolled back, so the folders stay where they are"""
+	frappe.local.nextcloud_renames = None
+	frappe.local.nextcloud_prepared_renames = None
+
+def delete_opportunity_folder_link(doc, method):
+	"""Delete the Nextcloud Folder record of a deleted Opportunity (the folder and its files stay on Nextcloud)"""
+	delete_folder_link(doc.name)
+
+def _enqueue_attachment_sync(opportunity_name):
+	"""after_commit callback: upload the attachments of an Opportunity whose folder was just created"""
+	try:
+		enqueue_attachment_sync(opportunity_name)
+	except Exception as e:
+		frappe.logger().error(f"Failed to enqueue attachment upload for {opportunity_name}: {str(e)}")
+
+def load_folder_link(doc, method):
+	"""Send the stored folder link with the Opportunity form, so it can show it without another request"""
+	folder_link = get_folder_link(doc.name)
+	if folder_link:
+		doc.set_onload("nextcloud_folder", {
+			"folder_url": folder_link.folder_url,
+			"folder_path": folder_link.folder_path,
+			"share_url": folder_link.share_url
+		})
+
 def _get_settings_name():
-	"""Helper function to get Nextcloud Settings document name"""
-	settings_name = None
-	# Method 1: Try known document name first (most reliable)
-	if frappe.db.exists("Nextcloud Settings", "ck82qg4l2r"):
-		settings_name = "ck82qg4l2r"
-	# Method 2: Try Single DocType name
-	elif frappe.db.exists("Nextcloud Settings", "Nextcloud Settings"):
-		settings_name = "Nextcloud Settings"
-	# Method 3: Try to get any existing document
+	"""Helper function to get Nextcloud Settings document name (cached)"""
+	return get_settings_name()
+
+def _use_ssh(nextcloud_config):
+	"""Check if SSH is enabled and configured"""
+	return bool(
+		getattr(nextcloud_config, 'use_ssh', False) and
+		getattr(nextcloud_config, 'ssh_host', None) and
+		getattr(nextcloud_config, 'ssh_user', None)
+	)
+
+def _create_folder(nextcloud_config, folder_path, opportunity_name=None, year=None):
+	"""
+	Create an Opportunity folder on the best backend, failing over to the others (SSH + OCC, WebDAV, OCS)
+	With a folder template, the folder and its template subfolders are created in one operation
+	"""
+	from nextcloud_integration.nextcloud_integration.backend_router import create_folder
+	from nextcloud_integration.nextcloud_integration.folder_templates import create_folder_tree, get_template_paths
+	
+	subfolder_paths = get_template_paths(nextcloud_config, opportunity_name, folder_path, year=year) if opportunity_name else []
+	if subfolder_paths:
+		return create_folder_tree(nextcloud_config, folder_path, subfolder_paths)
+	return create_folder(nextcloud_config, folder_path)
+
+def _get_ssh_kwargs(nextcloud_config):
+	"""Connection arguments for the SSH + OCC backend from Nextcloud Settings"""
+	# Check if Service Token is enabled
+	use_service_token = getattr(nextcloud_config, 'use_service_token', False)
+	cf_client_id = getattr(nextcloud_config, 'cf_client_id', None) or None
+	cf_client_secret = None
+	if use_service_token and cf_client_id:
+		cf_client_secret = get_secret(nextcloud_config, "cf_client_secret") if hasattr(nextcloud_config, 'cf_client_secret') else None
+	
+	return {
+		"ssh_host": nextcloud_config.ssh_host,
+		"ssh_user": nextcloud_config.ssh_user,
+		"nextcloud_user": nextcloud_config.username,
+		"nextcloud_url": nextcloud_config.nextcloud_url,
+		"nextcloud_path": getattr(nextcloud_config, 'nextcloud_path', None) or None,
+		"ssh_key_path": getattr(nextcloud_config, 'ssh_key_path', None) or None,
+		"occ_user": getattr(nextcloud_config, 'occ_user', None) or "www-data",  # Default to www-data
+		"use_service_token": use_service_token,
+		"cf_client_id": cf_client_id,
+		"cf_client_secret": cf_client_secret
+	}
+
+def _publish_folder_event(opportunity_name, message):
+	"""
+	Notify the open forms of an Opportunity about its folder
+	
+	Sent to the document's room, so only forms showing this Opportunity receive it,
+	whoever started the job. Sent after commit, so the form never sees uncommitted data.
+	"""
+	frappe.publish_realtime(
+		event="nextcloud_folder_created",
+		message=dict(message, opportunity=opportunity_name),
+		doctype="Opportunity",
+		docname=opportunity_name,
+		after_commit=True
+	)
+
+def _handle_folder_result(nextcloud_config, opportunity_name, result, retry_count=0, created=None):
+	"""
+	Post-process the result of a folder creation: comment, notification, logging and retry
+	Shared by the single-folder job and the batched OCC flush
+	"""
+	if result.get("success"):
+		record_success(nextcloud_config)
+		
+		# Remember the folder so later clicks, retries and backfills skip the network call
+		try:
+			target = get_target_name(nextcloud_config)
+			save_folder_link(opportunity_name, result, target=None if target == DEFAULT_TARGET else target)
+			clear_give_up(opportunity_name)
+		except Exception as e:
+			frappe.logger().error(f"Failed to save Nextcloud folder link for {opportunity_name}: {str(e)}")
+		
+		# Share links are created by one background job for all new folders, in parallel,
+		# once the Nextcloud Folder record is committed
+		if getattr(nextcloud_config, "create_share_links", False):
+			frappe.db.after_commit.add(lambda: queue_share_links([opportunity_name]))
+		
+		# Upload the attachments added before the folder existed, once the Nextcloud
+		# Folder record is committed (the upload job needs it to find the folder)
+		if getattr(nextcloud_config, "sync_attachments", False):
+			frappe.db.after_commit.add(lambda: _enqueue_attachment_sync(opportunity_name))
+		
+		# Add comment if feature is enabled
+		if nextcloud_config.is_feature_enabled("add_comments"):
+			try:
+				with stage_timer("comment"):
+					opportunity_doc = frappe.get_doc("Opportunity", opportunity_name)
+					opportunity_doc.add_comment(
+						comment_type="Info",
+						text=f"Nextcloud folder created: {result.get('folder_path')}"
+					)
+			except Exception as e:
+				if nextcloud_config.is_feature_enabled("log_events"):
+					frappe.logger().error(f"Failed to add comment to opportunity: {str(e)}")
+		
+		# Send notification if feature is enabled
+		if nextcloud_config.is_feature_enabled("send_notifications"):
+			with stage_timer("publish"):
+				_publish_folder_event(opportunity_name, {
+					"success": True,
+					"message": f"Nextcloud folder created successfully for {opportunity_name}",
+					"folder_path": result.get("folder_path")
+				})
+		
+		# Log event if feature is enabled
+		if nextcloud_config.is_feature_enabled("log_events"):
+			frappe.logger().info(f"Successfully created Nextcloud folder: {result.get('folder_path')} for Opportunity: {opportunity_name}")
 	else:
-		existing = frappe.get_all("Nextcloud Settings", limit=1)
-		if existing:
-			settings_name = existing[0].name
-	return settings_name
+		error_msg = result.get("error", "Failed to create folder")
+		
+		# Log error if feature is enabled
+		if nextcloud_config.is_feature_enabled("log_events"):
+			frappe.log_error(
+				title="Nextcloud Folder Creation Error",
+				message=f"Failed to create folder for {opportunity_name}: {error_msg}"
+			)
+		
+		# Count towards the target's circuit breaker (opens after repeated failures)
+		record_failure(nextcloud_config)
+		
+		# Try auto-retry if enabled (exponential backoff with jitter instead of an immediate re-enqueue)
+		max_retries = nextcloud_config.get_max_retries()
+		if nextcloud_config.is_feature_enabled("auto_retry") and retry_count < max_retries:
+			delay = get_retry_delay(retry_count)
+			frappe.logger().info(f"Retrying folder creation for {opportunity_name} in {delay:.0f}s (attempt {retry_count + 1}/{max_retries})")
+			schedule_retry(opportunity_name, retry_count + 1, delay, created=created)
+			return  # Don't send error notification yet, wait for retry
+		
+		# No retry left: reconciliation backs off before queueing this Opportunity again
+		record_give_up(opportunity_name)
+		
+		# Send error notification if feature is enabled
+		if nextcloud_config.is_feature_enabled("send_notifications"):
+			_publish_folder_event(opportunity_name, {
+				"success": False,
+				"error": f"Failed to create Nextcloud folder: {error_msg}"
+			})
 
-def _create_nextcloud_folder_background(opportunity_name, retry_count=0):
+def _create_nextcloud_folder_background(opportunity_name, retry_count=0, manual=False, created=None):
 	"""
 	Background job function to create Nextcloud folder
 	This runs in the background without blocking the user
+	Manual jobs (priority lane) create their folder inline instead of joining the OCC batch
+	`created` is the Opportunity's creation date, passed along so dated layouts need no query
 	"""
+	# Stage timings of this job are written to the metrics histograms in one go at the end
+	start_trace()
+	backend = None
+	
 	try:
 		# Validate that the opportunity exists
 		if not frappe.db.exists("Opportunity", opportunity_name):
@@ -90,7 +340,8 @@ def _create_nextcloud_folder_background(opportunity_name, retry_count=0):
 			)
 			return
 		
-		nextcloud_config = frappe.get_doc("Nextcloud Settings", settings_name)
+		with stage_timer("settings_load"):
+			nextcloud_config = frappe.get_cached_doc("Nextcloud Settings", settings_name)
 		frappe.local.nextcloud_config = nextcloud_config  # Store for helper functions
 		
 		if not nextcloud_config.enabled:
@@ -98,134 +349,64 @@ def _create_nextcloud_folder_background(opportunity_name, retry_count=0):
 				frappe.logger().info("Nextcloud integration is disabled")
 			return
 		
-		# Generate folder path: /ALKHORA/استيرادية {YEAR}/Opportunity-{name}
-		current_year = datetime.now().year
-		folder_prefix = nextcloud_config.folder_prefix or "Opportunity-"
+		# Nextcloud server the folder goes to (the settings themselves without additional targets)
+		nextcloud_config = resolve_target(nextcloud_config, opportunity_name)
+		
+		# The target's Nextcloud known to be down: park the job until its circuit breaker has probed it
+		if circuit_is_open(nextcloud_config):
+			schedule_retry(opportunity_name, retry_count, get_open_remaining(nextcloud_config) + get_retry_delay(0), created=created)
+			return
+		
+		# Every backend failed its last health check: defer instead of waiting out the timeouts
+		outage = get_outage(nextcloud_config)
+		if outage:
+			frappe.logger().info(f"Nextcloud unreachable, deferring folder creation for {opportunity_name}: {outage}")
+			schedule_retry(opportunity_name, retry_count, DOWN_RETRY_DELAY + get_retry_delay(0), created=created)
+			return
+		
+		# Folder already created (manual click, retry or backfill raced us): nothing to do on Nextcloud
+		folder_link = get_folder_link(opportunity_name)
+		if folder_link:
+			frappe.logger().info(f"Nextcloud folder for Opportunity {opportunity_name} already exists: {folder_link.folder_path}")
+			if nextcloud_config.is_feature_enabled("send_notifications"):
+				_publish_folder_event(opportunity_name, {
+					"success": True,
+					"message": f"Nextcloud folder already exists for {opportunity_name}",
+					"folder_path": folder_link.folder_url
+				})
+			return
 		
-		# Build the full path
-		base_path = f"ALKHORA/استيرادية {current_year}"
-		folder_name = f"{folder_prefix}{opportunity_name}"
-		full_path = f"{base_path}/{folder_name}"
+		# Folder path from the configured layout, e.g. ALKHORA/استيرادية {YEAR}/Opportunity-{name}
+		full_path = get_folder_path(nextcloud_config, opportunity_name, created=created)
 		
 		# Create folder in Nextcloud using fastest available method
 		frappe.logger().info(f"Creating Nextcloud folder for opportunity {opportunity_name}: {full_path}")
 		
-		# Check if SSH is enabled and configured
-		use_ssh = getattr(nextcloud_config, 'use_ssh', False) and \
-		          getattr(nextcloud_config, 'ssh_host', None) and \
-		          getattr(nextcloud_config, 'ssh_user', None)
-		
-		if use_ssh:
-			# Use SSH + OCC (fastest method)
-			ssh_host = nextcloud_config.ssh_host
-			ssh_user = nextcloud_config.ssh_user
-			ssh_key_path = getattr(nextcloud_config, 'ssh_key_path', None) or None
-			nextcloud_path = getattr(nextcloud_config, 'nextcloud_path', None) or None
-			occ_user = getattr(nextcloud_config, 'occ_user', None) or "www-data"  # Default to www-data
-			
-			# Check if Service Token is enabled
-			use_service_token = getattr(nextcloud_config, 'use_service_token', False)
-			cf_client_id = getattr(nextcloud_config, 'cf_client_id', None) or None
-			cf_client_secret = None
-			if use_service_token and cf_client_id:
-				cf_client_secret = nextcloud_config.get_password("cf_client_secret") if hasattr(nextcloud_config, 'cf_client_secret') else None
-			
-			from nextcloud_integration.nextcloud_integration.nextcloud_api import _create_via_ssh_occ
-			result = _create_via_ssh_occ(
-				ssh_host=ssh_host,
-				ssh_user=ssh_user,
-				nextcloud_user=nextcloud_config.username,
-				folder_path=full_path,
-				nextcloud_url=nextcloud_config.nextcloud_url,
-				nextcloud_path=nextcloud_path,
-				ssh_key_path=ssh_key_path,
-				occ_user=occ_user,
-				use_service_token=use_service_token,
-				cf_client_id=cf_client_id,
-				cf_client_secret=cf_client_secret
-			)
-		else:
-			# Use optimized WebDAV
-			result = create_nextcloud_folder(
-				nextcloud_url=nextcloud_config.nextcloud_url,
-				username=nextcloud_config.username,
-				password=nextcloud_config.get_password("password"),
-				folder_path=full_path,
-				use_rest_api=False  # Use optimized WebDAV
-			)
+		if not manual and getattr(nextcloud_config, 'batch_occ_operations', False) and get_preferred_backend(nextcloud_config) == BACKEND_SSH:
+			# Hand over to the micro-batcher: one SSH round trip and PHP bootstrap per batch
+			# (a user waiting on a click does not wait for the batch window and the queue ahead)
+			from nextcloud_integration.nextcloud_integration.folder_batcher import add_to_batch
+			add_to_batch(opportunity_name, full_path, retry_count=retry_count, created=created)
+			return
 		
-		if result.get("success"):
-			# Add comment if feature is enabled
-			if nextcloud_config.is_feature_enabled("add_comments"):
-				try:
-					opportunity_doc = frappe.get_doc("Opportunity", opportunity_name)
-					opportunity_doc.add_comment(
-						comment_type="Info",
-						text=f"Nextcloud folder created: {result.get('folder_path')}"
-					)
-				except Exception as e:
-					if nextcloud_config.is_feature_enabled("log_events"):
-						frappe.logger().error(f"Failed to add comment to opportunity: {str(e)}")
-			
-			# Send notification if feature is enabled
-			if nextcloud_config.is_feature_enabled("send_notifications"):
-				frappe.publish_realtime(
-					event="nextcloud_folder_created",
-					message={
-						"success": True,
-						"message": f"Nextcloud folder created successfully for {opportunity_name}",
-						"folder_path": result.get("folder_path")
-					},
-					user=frappe.session.user
-				)
-			
-			# Log event if feature is enabled
-			if nextcloud_config.is_feature_enabled("log_events"):
-				frappe.logger().info(f"Successfully created Nextcloud folder: {result.get('folder_path')} for Opportunity: {opportunity_name}")
-		else:
-			error_msg = result.get("error", "Failed to create folder")
-			
-			# Log error if feature is enabled
-			if nextcloud_config.is_feature_enabled("log_events"):
-				frappe.log_error(
-					title="Nextcloud Folder Creation Error",
-					message=f"Failed to create folder for {opportunity_name}: {error_msg}"
-				)
-			
-			# Try auto-retry if enabled
-			max_retries = nextcloud_config.get_max_retries()
-			if nextcloud_config.is_feature_enabled("auto_retry") and retry_count < max_retries:
-				frappe.logger().info(f"Retrying folder creation for {opportunity_name} (attempt {retry_count + 1}/{max_retries})")
-				frappe.enqueue(
-					method=_create_nextcloud_folder_background,
-					queue="default",
-					timeout=None,
-					job_name=f"create_nextcloud_folder_{opportunity_name}_retry_{retry_count + 1}",
-					opportunity_name=opportunity_name,
-					retry_count=retry_count + 1,
-					is_async=True,
-					at_front=True
-				)
-				return  # Don't send error notification yet, wait for retry
-			
-			# Send error notification if feature is enabled
-			if nextcloud_config.is_feature_enabled("send_notifications"):
-				frappe.publish_realtime(
-					event="nextcloud_folder_created",
-					message={
-						"success": False,
-						"error": f"Failed to create Nextcloud folder: {error_msg}"
-					},
-					user=frappe.session.user
-				)
-			
+		# Bound the operations in flight per target, so one slow server does not take all workers
+		with target_slot(nextcloud_config) as acquired:
+			if not acquired:
+				frappe.logger().info(f"Nextcloud target {get_target_name(nextcloud_config)} busy, deferring folder creation for {opportunity_name}")
+				schedule_retry(opportunity_name, retry_count, TARGET_BUSY_DELAY + get_retry_delay(0), created=created)
+				return
+			result = _create_folder(nextcloud_config, full_path, opportunity_name, year=get_datetime(created).year if created else None)
+		backend = result.get("backend") or "failed"
+		
+		_handle_folder_result(nextcloud_config, opportunity_name, result, retry_count, created=created)
+	
 	except Exception as e:
 		# Get config for feature checks
 		nextcloud_config = getattr(frappe.local, "nextcloud_config", None)
 		if not nextcloud_config:
 			settings_name = _get_settings_name()
 			if settings_name:
-				nextcloud_config = frappe.get_doc("Nextcloud Settings", settings_name)
+				nextcloud_config = frappe.get_cached_doc("Nextcloud Settings", settings_name)
 		
 		# Log error if feature is enabled
 		if not nextcloud_config or nextcloud_config.is_feature_enabled("log_events"):
@@ -238,29 +419,26 @@ def _create_nextcloud_folder_background(opportunity_name, retry_count=0):
 		if nextcloud_config and nextcloud_config.is_feature_enabled("auto_retry"):
 			max_retries = nextcloud_config.get_max_retries()
 			if retry_count < max_retries:
-				frappe.logger().info(f"Retrying folder creation for {opportunity_name} after exception (attempt {retry_count + 1}/{max_retries})")
-				frappe.enqueue(
-					method=_create_nextcloud_folder_background,
-					queue="default",
-					timeout=None,
-					job_name=f"create_nextcloud_folder_{opportunity_name}_retry_{retry_count + 1}",
-					opportunity_name=opportunity_name,
-					retry_count=retry_count + 1,
-					is_async=True,
-					at_front=True
-				)
+				delay = get_retry_delay(retry_count)
+				frappe.logger().info(f"Retrying folder creation for {opportunity_name} after exception in {delay:.0f}s (attempt {retry_count + 1}/{max_retries})")
+				schedule_retry(opportunity_name, retry_count + 1, delay, created=created)
 				return  # Don't send error notification yet, wait for retry
 		
+		# No retry left: reconciliation backs off before queueing this Opportunity again
+		try:
+			record_give_up(opportunity_name)
+		except Exception as e:
+			frappe.logger().error(f"Failed to record Nextcloud give-up for {opportunity_name}: {str(e)}")
+		
 		# Send error notification if feature is enabled
 		if not nextcloud_config or nextcloud_config.is_feature_enabled("send_notifications"):
-			frappe.publish_realtime(
-				event="nextcloud_folder_created",
-				message={
-					"success": False,
-					"error": f"An error occurred: {str(e)}"
-				},
-				user=frappe.session.user
-			)
+			_publish_folder_event(opportunity_name, {
+				"success": False,
+				"error": f"An error occurred: {str(e)}"
+			})
+	finally:
+		# The total is only recorded for jobs that actually contacted Nextcloud
+		finish_trace(backend)
 
 
 @frappe.whitelist()
@@ -270,8 +448,9 @@ def create_nextcloud_folder_manual(opportunity_name):
 	This enqueues the job in the background and returns immediately
 	"""
 	try:
-		# Quick validation
-		if not frappe.db.exists("Opportunity", opportunity_name):
+		# Quick validation (the creation date goes to the job, for the Folder Layout)
+		created = frappe.db.get_value("Opportunity", opportunity_name, "creation")
+		if not created:
 			return {
 				"success": False,
 				"error": f"Opportunity {opportunity_name} not found"
@@ -286,7 +465,7 @@ def create_nextcloud_folder_manual(opportunity_name):
 				"error": "Nextcloud Settings not configured."
 			}
 		
-		nextcloud_config = frappe.get_doc("Nextcloud Settings", settings_name)
+		nextcloud_config = frappe.get_cached_doc("Nextcloud Settings", settings_name)
 		
 		if not nextcloud_config.enabled:
 			return {
@@ -294,17 +473,34 @@ def create_nextcloud_folder_manual(opportunity_name):
 				"error": "Nextcloud integration is disabled."
 			}
 		
+		# Folder already created: return its link without touching Nextcloud
+		folder_link = get_folder_link(opportunity_name)
+		if folder_link:
+			return {
+				"success": True,
+				"message": "Nextcloud folder already exists.",
+				"folder_path": folder_link.folder_url
+			}
+		
+		# Known outage: tell the user now instead of after the job's timeouts
+		outage = get_outage(resolve_target(nextcloud_config, opportunity_name))
+		if outage:
+			return {
+				"success": False,
+				"error": f"Nextcloud is currently unreachable: {outage}. Please try again later."
+			}
+		
 		# Enqueue immediately and return - don't wait
-		# Use at_front=True to prioritize this job
-		frappe.enqueue(
-			method=_create_nextcloud_folder_background,
-			queue="default",
-			timeout=None,
+		# Manual clicks use the priority lane (and at_front=True) so they never wait behind imports,
+		# and create the folder in that job rather than handing it to the OCC batch
+		enqueue_folder_job(
+			_create_nextcloud_folder_background,
 			job_name=f"create_nextcloud_folder_{opportunity_name}",
+			nextcloud_config=nextcloud_config,
+			priority=True,
 			opportunity_name=opportunity_name,
-			is_async=True,
-			now=False,  # Don't wait, just enqueue
-			at_front=True  # Process this job first
+			manual=True,
+			created=str(created)
 		)
 		
 		# Return immediately - don't wait for job
@@ -313,7 +509,7 @@ def create_nextcloud_folder_manual(opportunity_name):
 			"success": True,
 			"message": "Folder creation started in background."
 		}
-		
+	
 	except Exception as e:
 		frappe.log_error(
 			title="Nextcloud Manual Folder Creation Error",
@@ -340,7 +536,7 @@ def test_nextcloud_connection_manual():
 				"error": "Nextcloud Settings not configured. Please configure it first."
 			}
 		
-		nextcloud_config = frappe.get_doc("Nextcloud Settings", settings_name)
+		nextcloud_config = frappe.get_cached_doc("Nextcloud Settings", settings_name)
 		
 		# Validate required fields
 		if not nextcloud_config.nextcloud_url:
@@ -355,7 +551,7 @@ def test_nextcloud_connection_manual():
 				"error": "Username is required. Please enter a Nextcloud username."
 			}
 		
-		if not nextcloud_config.get_password("password"):
+		if not get_secret(nextcloud_config, "password"):
 			return {
 				"success": False,
 				"error": "Password is required. Please enter a Nextcloud password or app password."
@@ -366,13 +562,13 @@ def test_nextcloud_connection_manual():
 		result = test_nextcloud_connection(
 			nextcloud_url=nextcloud_config.nextcloud_url,
 			username=nextcloud_config.username,
-			password=nextcloud_config.get_password("password")
+			password=get_secret(nextcloud_config, "password")
 		)
 		
 		frappe.logger().info(f"Nextcloud connection test result: {result}")
 		
 		return result
-		
+	
 	except Exception as e:
 		frappe.log_error(
 			title="Nextcloud Connection Test Error",
@@ -385,10 +581,12 @@ def test_nextcloud_connection_manual():
 
 
 @frappe.whitelist()
-def ensure_parent_folders_exist():
+def ensure_parent_folders_exist(year=None):
 	"""
-	Pre-create parent folders (ALKHORA/استيرادية {YEAR}) to make folder creation instant
-	This should be run once per year or when setting up
+	Pre-create the parent folders of a year (ALKHORA/استيرادية {YEAR} and its month/bucket
+	shards, as far as the Folder Layout allows) to make folder creation instant
+	Folder jobs also create missing parents on demand and the daily scheduler pre-creates
+	next year's folders, so this is only needed when setting up or after changing the layout
 	"""
 	try:
 		# Get Nextcloud configuration
@@ -400,7 +598,7 @@ def ensure_parent_folders_exist():
 				"error": "Nextcloud Settings not configured."
 			}
 		
-		nextcloud_config = frappe.get_doc("Nextcloud Settings", settings_name)
+		nextcloud_config = frappe.get_cached_doc("Nextcloud Settings", settings_name)
 		
 		if not nextcloud_config.enabled:
 			return {
@@ -408,29 +606,28 @@ def ensure_parent_folders_exist():
 				"error": "Nextcloud integration is disabled."
 			}
 		
-		# Create parent folders
-		current_year = datetime.now().year
-		base_path = f"ALKHORA/استيرادية {current_year}"
+		# Create parent folders on every target
+		parent_paths = get_parent_paths(nextcloud_config, cint(year) or None)
 		
-		frappe.logger().info(f"Pre-creating parent folders: {base_path}")
-		result = create_nextcloud_folder(
-			nextcloud_url=nextcloud_config.nextcloud_url,
-			username=nextcloud_config.username,
-			password=nextcloud_config.get_password("password"),
-			folder_path=base_path
-		)
+		frappe.logger().info(f"Pre-creating {len(parent_paths)} parent folders: {parent_paths[:3]}")
+		errors = []
+		for target_config in get_targets(nextcloud_config):
+			# Explicit request: verify every level on the server
+			result = ensure_parent_paths(target_config, parent_paths, force=True)
+			if not result.get("success"):
+				errors.append(f"{get_target_name(target_config)}: {result.get('error') or 'Failed to create parent folders'}")
 		
-		if result.get("success"):
+		if not errors:
 			return {
 				"success": True,
-				"message": f"Parent folders created/verified: {base_path}"
+				"message": f"Parent folders created/verified: {', '.join(parent_paths[:3])}" + (f" and {len(parent_paths) - 3} more" if len(parent_paths) > 3 else "")
 			}
 		else:
 			return {
 				"success": False,
-				"error": result.get("error", "Failed to create parent folders")
+				"error": "; ".join(errors)
 			}
-		
+	
 	except Exception as e:
 		frappe.log_error(
 			title="Nextcloud Parent Folders Error",
@@ -440,3 +637,34 @@ def ensure_parent_folders_exist():
 			"success": False,
 			"error": f"Error: {str(e)}"
 		}
+
+
+def prewarm_year_folders():
+	"""
+	Scheduler job (daily): make sure this year's and next year's parent folders (and shards) exist
+	Folders already in the registry cost no request, so this is a no-op on most days
+	and the first Opportunity on 1 January does not hit a missing parent
+	"""
+	try:
+		settings_name = _get_settings_name()
+		if not settings_name:
+			return
+		
+		nextcloud_config = frappe.get_cached_doc("Nextcloud Settings", settings_name)
+		if not nextcloud_config.enabled:
+			return
+		
+		current_year = datetime.now().year
+		for target_config in get_targets(nextcloud_config):
+			for year in (current_year, current_year + 1):
+				result = ensure_parent_paths(target_config, get_parent_paths(nextcloud_config, year))
+				if result.get("folders"):
+					frappe.logger().info(f"Pre-created Nextcloud folders on {get_target_name(target_config)}: {result.get('folders')}")
+				elif not result.get("success"):
+					frappe.logger().error(f"Failed to pre-create Nextcloud folders for {year} on {get_target_name(target_config)}: {result.get('error')}")
+	
+	except Exception as e:
+		frappe.log_error(
+			title="Nextcloud Parent Folders Error",
+			message=f"Error pre-creating year folders: {str(e)}"
+		)
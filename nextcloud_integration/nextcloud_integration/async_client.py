@@ -0,0 +1,268 @@
+import asyncio
+import time
+from urllib.parse import quote
+
+import aiohttp
+import frappe
+
+from nextcloud_integration.nextcloud_integration.folder_registry import get_ancestor_paths, mark_known_folders
+
+# Default number of requests kept in flight by one client
+DEFAULT_CONCURRENCY = 20
+
+# Default timeout for a single request (seconds)
+DEFAULT_TIMEOUT = 30
+
+
+class AsyncNextcloudClient:
+	"""
+	asyncio WebDAV client for bulk folder operations
+	
+	Offers the same operations as the sync API (MKCOL, PROPFIND, MOVE, test connection)
+	with at most `concurrency` requests in flight over one keep-alive connection pool.
+	Every method returns the same result dicts as the sync functions in nextcloud_api.
+	
+	Usage:
+		async with AsyncNextcloudClient(url, user, password) as client:
+			results = await client.create_folders(paths)
+	"""
+	
+	def __init__(self, nextcloud_url, username, password, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT):
+		self.nextcloud_url = nextcloud_url.rstrip('/')
+		self.username = username
+		self.password = password
+		self.concurrency = max(int(concurrency), 1)
+		self.timeout = timeout
+		self._semaphore = None
+		self._session = None
+	
+	async def __aenter__(self):
+		self._semaphore = asyncio.Semaphore(self.concurrency)
+		self._session = aiohttp.ClientSession(
+			auth=aiohttp.BasicAuth(self.username, self.password),
+			connector=aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60),
+			timeout=aiohttp.ClientTimeout(total=self.timeout)
+		)
+		return self
+	
+	async def __aexit__(self, exc_type, exc, tb):
+		await self._session.close()
+	
+	def _dav_url(self, folder_path):
+		path_parts = [p for p in folder_path.split('/') if p]
+		encoded_path = "/".join(quote(part, safe='') for part in path_parts)
+		return f"{self.nextcloud_url}/remote.php/dav/files/{self.username}/{encoded_path}/" if encoded_path \
+			else f"{self.nextcloud_url}/remote.php/dav/files/{self.username}/"
+	
+	def _display_result(self, folder_path, message, **extra):
+		path_parts = [p for p in folder_path.split('/') if p]
+		display_path = "/" + "/".join(path_parts)
+		encoded_display_path = quote(display_path, safe='')
+		return dict({
+			"success": True,
+			"folder_path": f"{self.nextcloud_url}/apps/files/?dir={encoded_display_path}",
+			"webdav_path": display_path,
+			"message": message
+		}, **extra)
+	
+	async def _request(self, method, url, headers=None, data=None):
+		"""Send one request within the concurrency limit, returns (status, headers, body)"""
+		async with self._semaphore:
+			async with self._session.request(method, url, headers=headers or {}, data=data) as response:
+				return response.status, response.headers, await response.text()
+	
+	async def mkcol(self, folder_path, create_parents=True):
+		"""
+		Create a folder (MKCOL); on 409 the missing ancestors are created and the MKCOL retried
+		
+		Returns:
+			dict: {"success": bool, "folder_path": str, "webdav_path": str, "error": str}
+		"""
+		start_time = time.time()
+		try:
+			status, headers, body = await self._request("MKCOL", self._dav_url(folder_path))
+			
+			if status == 409 and create_parents:
+				for ancestor in get_ancestor_paths(folder_path):
+					ancestor_status, _, _ = await self._request("MKCOL", self._dav_url(ancestor))
+					if ancestor_status not in [201, 405]:
+						break
+				status, headers, body = await self._request("MKCOL", self._dav_url(folder_path))
+			
+			if status not in [201, 405]:
+				return {
+					"success": False,
+					"error": f"HTTP {status}: {body[:200]}",
+					"status_code": status
+				}
+			
+			ancestors = get_ancestor_paths(folder_path)
+			if ancestors:
+				mark_known_folders(self.nextcloud_url, self.username, ancestors[-1])
+			
+			return self._display_result(
+				folder_path,
+				f"Folder created successfully via async WebDAV in {time.time() - start_time:.2f}s",
+				file_id=headers.get("OC-FileId"),
+				backend="WebDAV"
+			)
+		
+		except asyncio.TimeoutError:
+			return {
+				"success": False,
+				"error": "Request timeout while creating folder. Nextcloud server may be slow."
+			}
+		except aiohttp.ClientError as e:
+			return {
+				"success": False,
+				"error": f"Connection error: Unable to reach Nextcloud server. Error: {str(e)}"
+			}
+	
+	async def propfind(self, folder_path, depth=0, body=None):
+		"""
+		Get properties of a folder (PROPFIND)
+		
+		Returns:
+			dict: {"success": bool, "status_code": int, "body": str, "error": str}
+		"""
+		try:
+			status, _, text = await self._request(
+				"PROPFIND",
+				self._dav_url(folder_path),
+				headers={"Depth": str(depth), "Content-Type": "application/xml"},
+				data=body
+			)
+			if status == 207:  # Multi-status (success for PROPFIND)
+				return {"success": True, "status_code": status, "body": text}
+			return {
+				"success": False,
+				"status_code": status,
+				"error": f"HTTP {status}: {text[:200]}"
+			}
+		except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+			return {"success": False, "error": f"Network error: {str(e) or 'timeout'}"}
+	
+	async def move(self, source_path, destination_path, overwrite=False):
+		"""
+		Move/rename a folder on the server (MOVE)
+		
+		Returns:
+			dict: {"success": bool, "status_code": int, "error": str}
+		"""
+		try:
+			status, _, text = await self._request(
+				"MOVE",
+				self._dav_url(source_path),
+				headers={
+					"Destination": self._dav_url(destination_path),
+					"Overwrite": "T" if overwrite else "F"
+				}
+			)
+			if status in [201, 204]:
+				return {"success": True, "status_code": status}
+			return {
+				"success": False,
+				"status_code": status,
+				"error": f"HTTP {status}: {text[:200]}"
+			}
+		except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+			return {"success": False, "error": f"Network error: {str(e) or 'timeout'}"}
+	
+	async def test_connection(self):
+		"""Test authentication and connectivity with a Depth:0 PROPFIND on the user root"""
+		result = await self.propfind("", depth=0)
+		if result.get("success"):
+			return {
+				"success": True,
+				"message": f"Connection successful! Successfully authenticated to Nextcloud at {self.nextcloud_url}",
+				"status_code": result["status_code"]
+			}
+		if result.get("status_code") == 401:
+			result["error"] = "Authentication failed. Please check your username and password."
+		return result
+	
+	async def create_folders(self, folder_paths):
+		"""
+		Create many folders concurrently
+		
+		Returns:
+			dict: {folder_path: result dict}
+		"""
+		folder_paths = list(dict.fromkeys(folder_paths))
+		results = await asyncio.gather(*[self.mkcol(path) for path in folder_paths])
+		return dict(zip(folder_paths, results))
+	
+	async def create_tree(self, folder_paths):
+		"""
+		Create a folder tree level by level, all folders of a level concurrently
+		
+		Parents are always created before their children, so the wall time grows with
+		the depth of the tree, not with the number of folders.
+		
+		Returns:
+			dict: {folder_path: result dict}
+		"""
+		levels = {}
+		for path in dict.fromkeys(folder_paths):
+			levels.setdefault(len([p for p in path.split('/') if p]), []).append(path)
+		
+		results = {}
+		for depth in sorted(levels):
+			results.update(await self.create_folders(levels[depth]))
+		return results
+	
+	async def move_folders(self, moves, overwrite=False):
+		"""
+		Move many folders concurrently
+		
+		Args:
+			moves: List of (source_path, destination_path)
+		
+		Returns:
+			dict: {source_path: result dict}
+		"""
+		results = await asyncio.gather(*[self.move(src, dst, overwrite=overwrite) for src, dst in moves])
+		return dict(zip([src for src, _ in moves], results))
+
+
+def create_folders(nextcloud_url, username, password, folder_paths, concurrency=DEFAULT_CONCURRENCY):
+	"""
+	Create many folders with the async client from synchronous code
+	
+	Returns:
+		dict: {folder_path: result dict}
+	"""
+	async def _run():
+		async with AsyncNextcloudClient(nextcloud_url, username, password, concurrency=concurrency) as client:
+			return await client.create_folders(folder_paths)
+	
+	frappe.logger().info(f"Creating {len(folder_paths)} folders via async WebDAV (concurrency {concurrency})")
+	return asyncio.run(_run())
+
+
+def create_tree(nextcloud_url, username, password, folder_paths, concurrency=DEFAULT_CONCURRENCY):
+	"""
+	Create a folder tree (parents before children) with the async client from synchronous code
+	
+	Returns:
+		dict: {folder_path: result dict}
+	"""
+	async def _run():
+		async with AsyncNextcloudClient(nextcloud_url, username, password, concurrency=concurrency) as client:
+			return await client.create_tree(folder_paths)
+	
+	return asyncio.run(_run())
+
+
+def move_folders(nextcloud_url, username, password, moves, concurrency=DEFAULT_CONCURRENCY, overwrite=False):
+	"""
+	Move many folders with the async client from synchronous code
+	
+	Returns:
+		dict: {source_path: result dict}
+	"""
+	async def _run():
+		async with AsyncNextcloudClient(nextcloud_url, username, password, concurrency=concurrency) as client:
+			return await client.move_folders(moves, overwrite=overwrite)
+	
+	return asyncio.run(_run())
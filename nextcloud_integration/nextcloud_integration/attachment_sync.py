@@ -0,0 +1,359 @@
+import frappe
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from nextcloud_integration.nextcloud_integration.nextcloud_api import WEBDAV_TIMEOUT, _propfind, get_webdav_session, parse_propfind
+
+# Chunk size of the Nextcloud chunked upload (v2 needs at least 5 MB per chunk except the last)
+CHUNK_SIZE = 10 * 1024 * 1024
+
+# Chunks uploaded in parallel per file
+PARALLEL_CHUNKS = 4
+
+# Files up to this size are sent with a single streamed PUT
+SINGLE_PUT_LIMIT = CHUNK_SIZE
+
+# Read buffer used while streaming a chunk from disk
+READ_BUFFER = 1024 * 1024
+
+# Queue for upload jobs: long running, so they never hold up folder creation workers
+UPLOAD_QUEUE = "long"
+
+
+class _FileSlice:
+	"""
+	Read-only view of a byte range of a file, streamed by requests without loading it into memory
+	
+	requests sends a file-like body with a known length as Content-Length and reads
+	it in blocks, so at most one read buffer per upload thread is held in memory.
+	"""
+	
+	def __init__(self, path, offset, length):
+		self._file = open(path, "rb")
+		self._file.seek(offset)
+		self._remaining = length
+		self.len = length
+	
+	def __len__(self):
+		return self.len
+	
+	def read(self, size=-1):
+		if self._remaining <= 0:
+			return b""
+		if size is None or size < 0 or size > self._remaining:
+			size = self._remaining
+		data = self._file.read(min(size, READ_BUFFER))
+		self._remaining -= len(data)
+		return data
+	
+	def close(self):
+		self._file.close()
+
+
+def _dav_files_url(nextcloud_url, username, path):
+	encoded = "/".join(quote(part, safe='') for part in path.split('/') if part)
+	return f"{nextcloud_url.rstrip('/')}/remote.php/dav/files/{username}/{encoded}"
+
+
+def _dav_uploads_url(nextcloud_url, username, upload_id):
+	return f"{nextcloud_url.rstrip('/')}/remote.php/dav/uploads/{username}/{upload_id}"
+
+
+def _upload_id(file_doc, size):
+	"""
+	Stable id of the upload of one file version
+	
+	The same file (same size and modification time) always maps to the same upload
+	folder on Nextcloud, so an interrupted upload is found again and resumed.
+	"""
+	digest = hashlib.sha1(f"{frappe.local.site}:{file_doc.name}:{size}:{file_doc.modified}".encode("utf-8")).hexdigest()
+	return f"erpnext-{digest[:32]}"
+
+
+def _propfind_sizes(session, url, depth):
+	"""
+	Get the sizes of a resource (depth 0) or of its children (depth 1)
+	
+	Returns:
+		dict: {name: size} (name is "" for the resource itself), None if it does not exist
+	"""
+	response = _propfind(session, url, depth, props=("getcontentlength", "resourcetype"))
+	if response.status_code == 404:
+		return None
+	if response.status_code != 207:
+		raise Exception(f"PROPFIND HTTP {response.status_code}: {response.text[:200]}")
+	
+	return {
+		name: int(entry["getcontentlength"]) if entry.get("getcontentlength") else None
+		for name, entry in parse_propfind(response.content, url).items()
+	}
+
+
+def _put_stream(session, url, path, offset, length, headers=None):
+	body = _FileSlice(path, offset, length)
+	try:
+		response = session.put(
+			url,
+			data=body,
+			headers=dict(headers or {}, **{"Content-Length": str(length)}),
+			timeout=(WEBDAV_TIMEOUT, max(WEBDAV_TIMEOUT, length // (256 * 1024)))  # Read timeout: >= 256 KB/s
+		)
+	finally:
+		body.close()
+	if response.status_code not in [200, 201, 204]:
+		raise Exception(f"PUT HTTP {response.status_code}: {response.text[:200]}")
+
+
+def upload_file(nextcloud_url, username, password, local_path, remote_path, file_doc):
+	"""
+	Upload a local file to Nextcloud, streamed and (for large files) chunked and resumable
+	
+	Large files use Nextcloud's chunked upload (v2): chunks are PUT in parallel into an
+	upload folder, then assembled with a MOVE. Chunks that are already on the server
+	from an interrupted run are not sent again.
+	
+	Returns:
+		dict: {"success": bool, "remote_path": str, "skipped": bool, "chunks_sent": int, "error": str}
+	"""
+	session = get_webdav_session(nextcloud_url, username, password)
+	size = os.path.getsize(local_path)
+	destination = _dav_files_url(nextcloud_url, username, remote_path)
+	start_time = time.time()
+	
+	# Already uploaded (same size): nothing to do
+	existing = _propfind_sizes(session, destination, 0)
+	if existing and existing.get("") == size:
+		return {"success": True, "remote_path": remote_path, "skipped": True, "chunks_sent": 0}
+	
+	if size <= SINGLE_PUT_LIMIT:
+		_put_stream(session, destination, local_path, 0, size)
+		return {"success": True, "remote_path": remote_path, "skipped": False, "chunks_sent": 1}
+	
+	upload_url = _dav_uploads_url(nextcloud_url, username, _upload_id(file_doc, size))
+	chunk_headers = {"Destination": destination, "OC-Total-Length": str(size)}
+	
+	# Resume: keep the chunks that are complete, (re)create the upload folder otherwise
+	uploaded = _propfind_sizes(session, upload_url, 1)
+	if uploaded is None:
+		response = session.request("MKCOL", upload_url, headers={"Destination": destination}, timeout=WEBDAV_TIMEOUT)
+		if response.status_code not in [201, 405]:
+			raise Exception(f"MKCOL upload folder HTTP {response.status_code}: {response.text[:200]}")
+		uploaded = {}
+	
+	chunks = []
+	for index, offset in enumerate(range(0, size, CHUNK_SIZE), start=1):
+		length = min(CHUNK_SIZE, size - offset)
+		if uploaded.get(str(index)) != length:
+			chunks.append((index, offset, length))
+	
+	if chunks:
+		frappe.logger().info(
+			f"Uploading {remote_path}: {len(chunks)} of {-(-size // CHUNK_SIZE)} chunks "
+			f"({size / 1048576:.1f} MB, {PARALLEL_CHUNKS} in parallel)"
+		)
+		with ThreadPoolExecutor(max_workers=PARALLEL_CHUNKS) as executor:
+			futures = [
+				executor.submit(_put_stream, session, f"{upload_url}/{index}", local_path, offset, length, chunk_headers)
+				for index, offset, length in chunks
+			]
+			for future in futures:
+				future.result()  # Raises the first failed chunk; completed chunks stay for the next attempt
+	
+	# Assemble the file on the server (can take a while for large files)
+	response = session.request(
+		"MOVE",
+		f"{upload_url}/.file",
+		headers=dict(chunk_headers, Overwrite="T"),
+		timeout=(WEBDAV_TIMEOUT, max(WEBDAV_TIMEOUT * 4, size // (4 * 1024 * 1024)))
+	)
+	if response.status_code not in [201, 204]:
+		raise Exception(f"MOVE assemble HTTP {response.status_code}: {response.text[:200]}")
+	
+	frappe.logger().info(f"Uploaded {remote_path} ({size / 1048576:.1f} MB) in {time.time() - start_time:.2f}s")
+	return {"success": True, "remote_path": remote_path, "skipped": False, "chunks_sent": len(chunks)}
+
+
+def _get_attachments(opportunity_name, file_name=None):
+	"""Attachments of an Opportunity stored on this server (links to external files are skipped)"""
+	filters = {
+		"attached_to_doctype": "Opportunity",
+		"attached_to_name": opportunity_name,
+		"is_folder": 0
+	}
+	if file_name:
+		filters["name"] = file_name
+	return [
+		attachment for attachment in frappe.get_all(
+			"File", filters=filters, fields=["name", "file_name", "file_url", "is_private", "creation", "modified"]
+		)
+		if attachment.file_url and not attachment.file_url.startswith(("http://", "https://"))
+	]
+
+
+def _remote_file_names(attachments):
+	"""
+	Name of each attachment in the Nextcloud folder
+	
+	Attachments keep their file name; one whose name is already used by an earlier
+	attachment of the Opportunity gets its File name appended, so it never overwrites
+	(or is skipped as) the other file.
+	
+	Returns:
+		dict: {File name: file name in the folder}
+	"""
+	names = {}
+	taken = set()
+	for attachment in sorted(attachments, key=lambda a: (a.creation, a.name)):
+		remote_name = attachment.file_name or os.path.basename(attachment.file_url)
+		if remote_name in taken:
+			stem, extension = os.path.splitext(remote_name)
+			remote_name = f"{stem} ({attachment.name}){extension}"
+		taken.add(remote_name)
+		names[attachment.name] = remote_name
+	return names
+
+
+def sync_attachments(opportunity_name, file_name=None):
+	"""
+	Upload the File attachments of an Opportunity into its Nextcloud folder
+	
+	Args:
+		opportunity_name: Opportunity whose attachments are uploaded
+		file_name: Only sync this File document (default: all attachments)
+	
+	Returns:
+		dict: {"success": bool, "results": {file name: result dict}, "error": str}
+	"""
+	from nextcloud_integration.hooks import _get_settings_name
+	from nextcloud_integration.nextcloud_integration.folder_links import get_folder_link
+	from nextcloud_integration.nextcloud_integration.folder_listing import invalidate_folder_listing
+	from nextcloud_integration.nextcloud_integration.settings_cache import get_secret
+	from nextcloud_integration.nextcloud_integration.targets import get_target_config
+	
+	settings_name = _get_settings_name()
+	if not settings_name:
+		return {"success": False, "error": "Nextcloud Settings not configured."}
+	
+	settings = frappe.get_cached_doc("Nextcloud Settings", settings_name)
+	folder_link = get_folder_link(opportunity_name)
+	if not folder_link or not folder_link.folder_path:
+		return {"success": False, "error": f"No Nextcloud folder for Opportunity {opportunity_name} yet."}
+	
+	# Uploads go to the server the folder was created on
+	nextcloud_config = get_target_config(settings, folder_link.target)
+	password = get_secret(nextcloud_config, "password")
+	
+	# Names are resolved over all attachments, so a single file gets the same name as in a full sync
+	attachments = _get_attachments(opportunity_name)
+	remote_names = _remote_file_names(attachments)
+	results = {}
+	for attachment in attachments:
+		if file_name and attachment.name != file_name:
+			continue
+		
+		file_doc = frappe.get_doc("File", attachment.name)
+		remote_path = f"{folder_link.folder_path}/{remote_names[attachment.name]}"
+		try:
+			results[attachment.name] = upload_file(
+				nextcloud_config.nextcloud_url,
+				nextcloud_config.username,
+				password,
+				file_doc.get_full_path(),
+				remote_path,
+				file_doc
+			)
+		except Exception as e:
+			results[attachment.name] = {"success": False, "remote_path": remote_path, "error": str(e)}
+			frappe.log_error(
+				title="Nextcloud Attachment Upload Error",
+				message=f"Failed to upload {attachment.name} of Opportunity {opportunity_name}: {str(e)}"
+			)
+	
+	# The folder changed: list it again on the next form load instead of revalidating
+	if any(r.get("success") and not r.get("skipped") for r in results.values()):
+		invalidate_folder_listing(folder_link.folder_path, folder_link.target)
+	
+	return {
+		"success": all(r.get("success") for r in results.values()),
+		"results": results
+	}
+
+
+def _sync_attachments_job(opportunity_name, file_name=None):
+	"""Background job wrapper for sync_attachments"""
+	result = sync_attachments(opportunity_name, file_name)
+	frappe.logger().info(f"Nextcloud attachment sync for {opportunity_name}: {result}")
+
+
+def enqueue_attachment_sync(opportunity_name, file_name=None):
+	"""
+	Enqueue an attachment upload on the long queue, with a timeout based on the file sizes
+	
+	Call it after commit (see on_file_insert): the job reads the File rows, and the
+	sizes are read here rather than in the caller's transaction.
+	"""
+	total_size = 0
+	for attachment in _get_attachments(opportunity_name, file_name):
+		try:
+			total_size += os.path.getsize(frappe.get_doc("File", attachment.name).get_full_path())
+		except OSError:
+			pass
+	
+	frappe.enqueue(
+		method=_sync_attachments_job,
+		queue=UPLOAD_QUEUE,
+		timeout=300 + total_size // (256 * 1024),  # At least 256 KB/s
+		job_name=f"nextcloud_attachments_{opportunity_name}_{file_name or 'all'}",
+		opportunity_name=opportunity_name,
+		file_name=file_name,
+		is_async=True
+	)
+
+
+def _enqueue_after_commit(opportunity_name, file_name):
+	"""after_commit callback: enqueue the upload of a new attachment once its File row is committed"""
+	try:
+		enqueue_attachment_sync(opportunity_name, file_name)
+	except Exception as e:
+		frappe.log_error(
+			title="Nextcloud Attachment Upload Error",
+			message=f"Error enqueueing upload of {file_name}: {str(e)}"
+		)
+
+
+def on_file_insert(doc, method):
+	"""File after_insert hook: upload new Opportunity attachments to the Opportunity folder"""
+	if doc.attached_to_doctype != "Opportunity" or not doc.attached_to_name or doc.is_folder:
+		return
+	
+	try:
+		from nextcloud_integration.hooks import _get_settings_name
+		settings_name = _get_settings_name()
+		if not settings_name:
+			return
+		nextcloud_config = frappe.get_cached_doc("Nextcloud Settings", settings_name)
+		if not nextcloud_config.enabled or not getattr(nextcloud_config, "sync_attachments", False):
+			return
+		
+		opportunity_name, file_name = doc.attached_to_name, doc.name
+		frappe.db.after_commit.add(lambda: _enqueue_after_commit(opportunity_name, file_name))
+	except Exception as e:
+		frappe.log_error(
+			title="Nextcloud Attachment Upload Error",
+			message=f"Error enqueueing upload of {doc.name}: {str(e)}"
+		)
+
+
+@frappe.whitelist()
+def sync_opportunity_attachments(opportunity_name):
+	"""Upload all attachments of an Opportunity to its Nextcloud folder in the background"""
+	frappe.has_permission("Opportunity", "write", opportunity_name, throw=True)
+	
+	enqueue_attachment_sync(opportunity_name)
+	return {
+		"success": True,
+		"message": "Attachment upload started in background."
+	}
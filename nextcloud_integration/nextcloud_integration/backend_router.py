@@ -0,0 +1,202 @@
+import frappe
+import time
+
+# Backends, named as in the "backend" key of successful create results
+BACKEND_SSH = "SSH+OCC"
+BACKEND_WEBDAV = "WebDAV"
+BACKEND_OCS = "OCS"
+
+# Redis list of recent outcomes per target and backend, newest first, as "ok:seconds:timestamp"
+OUTCOMES_KEY = "nextcloud_integration:backend_outcomes"
+
+# Outcomes kept per backend, and how old an outcome may be to count (seconds)
+MAX_SAMPLES = 50
+SAMPLE_WINDOW = 600
+
+# Floor for the success rate, so a failing backend gets a large but finite score
+MIN_SUCCESS_RATE = 0.05
+
+
+def _outcomes_key(backend, nextcloud_config=None):
+	from nextcloud_integration.nextcloud_integration.targets import DEFAULT_TARGET, get_target_name
+	
+	# Outcomes of the default target keep their original key
+	target = get_target_name(nextcloud_config) if nextcloud_config is not None else DEFAULT_TARGET
+	suffix = backend if target == DEFAULT_TARGET else f"{target}:{backend}"
+	return frappe.cache().make_key(f"{OUTCOMES_KEY}:{suffix}")
+
+
+def get_available_backends(nextcloud_config):
+	"""Backends configured in Nextcloud Settings, in configured preference order"""
+	from nextcloud_integration.hooks import _use_ssh
+	
+	backends = []
+	if _use_ssh(nextcloud_config):
+		backends.append(BACKEND_SSH)
+	backends.append(BACKEND_WEBDAV)
+	if getattr(nextcloud_config, "use_rest_api", False):
+		backends.append(BACKEND_OCS)
+	return backends
+
+
+def record_outcome(backend, success, seconds, nextcloud_config=None):
+	"""Add the outcome of one folder operation to the rolling stats of a backend (of the config's target)"""
+	try:
+		key = _outcomes_key(backend, nextcloud_config)
+		pipe = frappe.cache().pipeline()
+		pipe.lpush(key, f"{int(bool(success))}:{seconds:.4f}:{time.time():.0f}")
+		pipe.ltrim(key, 0, MAX_SAMPLES - 1)
+		pipe.expire(key, SAMPLE_WINDOW)
+		pipe.execute()
+	except Exception as e:
+		frappe.logger().warning(f"Could not record outcome for backend {backend}: {str(e)}")
+
+
+def get_backend_stats(backends, nextcloud_config=None):
+	"""
+	Get the rolling stats of backends (of the config's target) from their outcomes within the sample window
+	
+	Score is the expected time per successful operation (mean latency / success rate),
+	lower is better. Backends without recent outcomes have no score.
+	
+	Returns:
+		dict: {backend: {"samples", "success_rate", "mean_latency", "score"}}
+	"""
+	pipe = frappe.cache().pipeline()
+	for backend in backends:
+		pipe.lrange(_outcomes_key(backend, nextcloud_config), 0, MAX_SAMPLES - 1)
+	
+	now = time.time()
+	stats = {}
+	for backend, raw_outcomes in zip(backends, pipe.execute()):
+		outcomes = []
+		for raw in raw_outcomes:
+			ok, seconds, timestamp = (raw.decode() if isinstance(raw, bytes) else raw).split(":")
+			if now - float(timestamp) <= SAMPLE_WINDOW:
+				outcomes.append((ok == "1", float(seconds)))
+		
+		if not outcomes:
+			stats[backend] = {"samples": 0, "success_rate": None, "mean_latency": None, "score": None}
+			continue
+		
+		success_rate = sum(1 for ok, _ in outcomes if ok) / len(outcomes)
+		mean_latency = sum(seconds for _, seconds in outcomes) / len(outcomes)
+		stats[backend] = {
+			"samples": len(outcomes),
+			"success_rate": round(success_rate, 3),
+			"mean_latency": round(mean_latency, 4),
+			"score": round(mean_latency / max(success_rate, MIN_SUCCESS_RATE), 4)
+		}
+	return stats
+
+
+def rank_backends(nextcloud_config):
+	"""
+	Get the available backends in the order they should be tried
+	
+	With adaptive selection the backend with the best score comes first. A backend
+	without recent outcomes is tried before scored ones, so a backend that was avoided
+	gets re-measured once its old outcomes have left the window. Backends the health
+	monitor found down are moved to the end, so jobs do not wait out their timeouts.
+	"""
+	from nextcloud_integration.nextcloud_integration.health_monitor import get_down_backends
+	
+	backends = get_available_backends(nextcloud_config)
+	if len(backends) == 1:
+		return backends
+	
+	down = get_down_backends(nextcloud_config, backends)
+	if down:
+		backends = [b for b in backends if b not in down] + down
+	if not getattr(nextcloud_config, "adaptive_backend", True):
+		return backends
+	
+	try:
+		stats = get_backend_stats(backends, nextcloud_config)
+	except Exception as e:
+		frappe.logger().warning(f"Could not load backend stats, using configured order: {str(e)}")
+		return backends
+	
+	# sorted() is stable: ties and unscored backends keep the configured order
+	return sorted(backends, key=lambda b: (b in down, -1 if stats[b]["score"] is None else stats[b]["score"]))
+
+
+def get_preferred_backend(nextcloud_config):
+	"""The backend the next folder operation will go to first"""
+	return rank_backends(nextcloud_config)[0]
+
+
+def _run_backend(backend, nextcloud_config, folder_path):
+	from nextcloud_integration.hooks import _get_ssh_kwargs
+	from nextcloud_integration.nextcloud_integration.nextcloud_api import (
+		_create_via_rest_api,
+		_create_via_ssh_occ,
+		_create_via_webdav_optimized
+	)
+	from nextcloud_integration.nextcloud_integration.settings_cache import get_secret
+	
+	if backend == BACKEND_SSH:
+		return _create_via_ssh_occ(folder_path=folder_path, **_get_ssh_kwargs(nextcloud_config))
+	
+	password = get_secret(nextcloud_config, "password")
+	if backend == BACKEND_OCS:
+		return _create_via_rest_api(nextcloud_config.nextcloud_url, nextcloud_config.username, password, folder_path)
+	return _create_via_webdav_optimized(nextcloud_config.nextcloud_url, nextcloud_config.username, password, folder_path)
+
+
+def create_folder(nextcloud_config, folder_path):
+	"""
+	Create a folder on the best backend, failing over to the next one within the same call
+	
+	Returns:
+		dict: Result of the first successful backend, or the last failure with all errors
+	"""
+	backends = rank_backends(nextcloud_config)
+	errors = []
+	result = {"success": False, "error": "No Nextcloud backend available"}
+	
+	for backend in backends:
+		start_time = time.time()
+		try:
+			result = _run_backend(backend, nextcloud_config, folder_path)
+		except Exception as e:
+			result = {"success": False, "error": f"{backend} error: {str(e)}"}
+		record_outcome(backend, result.get("success"), time.time() - start_time, nextcloud_config)
+		
+		if result.get("success"):
+			result.setdefault("backend", backend)
+			if errors:
+				frappe.logger().info(f"Folder {folder_path} created via {backend} after failover: {'; '.join(errors)}")
+			return result
+		
+		errors.append(f"{backend}: {result.get('error')}")
+		frappe.logger().warning(f"Backend {backend} failed for {folder_path}: {result.get('error')}")
+	
+	if len(errors) > 1:
+		result = dict(result, error=" | ".join(errors))
+	return result
+
+
+@frappe.whitelist()
+def get_backend_status():
+	"""Current backend order and rolling stats per target (for diagnostics)"""
+	frappe.only_for("System Manager")
+	
+	from nextcloud_integration.hooks import _get_settings_name
+	from nextcloud_integration.nextcloud_integration.targets import get_target_name, get_targets
+	
+	settings_name = _get_settings_name()
+	if not settings_name:
+		return {"success": False, "error": "Nextcloud Settings not configured."}
+	
+	settings = frappe.get_cached_doc("Nextcloud Settings", settings_name)
+	targets = {}
+	for nextcloud_config in get_targets(settings):
+		targets[get_target_name(nextcloud_config)] = {
+			"order": rank_backends(nextcloud_config),
+			"stats": get_backend_stats(get_available_backends(nextcloud_config), nextcloud_config)
+		}
+	return {
+		"success": True,
+		"targets": targets
+	}
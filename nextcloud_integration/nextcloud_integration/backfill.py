@@ -0,0 +1,364 @@
+import frappe
+import threading
+import time
+from frappe.utils import cint
+from concurrent.futures import ThreadPoolExecutor
+
+# Global default holding the name of the last Opportunity of the last finished page
+CHECKPOINT_KEY = "nextcloud_backfill_checkpoint"
+
+# Cache keys for the running flag and the latest progress report
+RUNNING_KEY = "nextcloud_integration:backfill_running"
+PROGRESS_KEY = "nextcloud_integration:backfill_progress"
+
+# Expiry of the running flag, refreshed by a heartbeat while the backfill runs (seconds)
+RUNNING_TTL = 900
+RUNNING_HEARTBEAT = 60
+
+DEFAULT_PAGE_SIZE = 500
+DEFAULT_CONCURRENCY = 8
+
+
+def get_opportunities_without_folder(after=None, limit=DEFAULT_PAGE_SIZE):
+	"""
+	Get the next page of Opportunities that have no Nextcloud folder yet
+	
+	Keyset pagination on name, so every page is a cheap index range scan.
+	
+	Returns:
+		list: frappe._dict rows with name and creation
+	"""
+	return frappe.db.sql("""
+		select opp.name, opp.creation
+		from `tabOpportunity` opp
+		where opp.name > %(after)s
+			and not exists (
+				select 1 from `tabNextcloud Folder` f
+				where f.name = opp.name
+			)
+		order by opp.name
+		limit %(limit)s
+	""", {
+		"after": after or "",
+		"limit": limit
+	}, as_dict=True)
+
+
+def count_opportunities_without_folder(after=None):
+	"""Count the Opportunities still to be processed (for progress and ETA)"""
+	return frappe.db.sql("""
+		select count(*)
+		from `tabOpportunity` opp
+		where opp.name > %(after)s
+			and not exists (
+				select 1 from `tabNextcloud Folder` f
+				where f.name = opp.name
+			)
+	""", {
+		"after": after or ""
+	})[0][0]
+
+
+def get_checkpoint():
+	return frappe.db.get_default(CHECKPOINT_KEY) or None
+
+
+def set_checkpoint(opportunity_name):
+	frappe.db.set_default(CHECKPOINT_KEY, opportunity_name or "")
+	frappe.db.commit()
+
+
+def _init_worker_thread(site, connections):
+	"""Give each pool thread its own site context and DB connection (collected for teardown)"""
+	frappe.init(site=site)
+	frappe.connect()
+	connections.append(frappe.local.db)
+
+
+def _close_worker_connections(connections):
+	"""Close the DB connections of the pool threads once the executor has shut down"""
+	for db in connections:
+		try:
+			db.close()
+		except Exception as e:
+			frappe.logger().warning(f"Could not close backfill worker DB connection: {str(e)}")
+	connections.clear()
+
+
+def _chunks(items, size):
+	for i in range(0, len(items), size):
+		yield items[i:i + size]
+
+
+def _create_page(executor, nextcloud_config, folder_paths, concurrency=DEFAULT_CONCURRENCY):
+	"""
+	Create all folders of one page with bounded parallelism
+	
+	Uses the preferred backend: SSH + OCC sends batches of batch_max_size folders per call in the thread pool
+	(at most `concurrency` calls at a time), WebDAV sends one MKCOL per folder through the async client,
+	parents before children.
+	
+	Returns:
+		dict: {folder_path: result dict}
+	"""
+	from nextcloud_integration.hooks import _get_ssh_kwargs
+	from nextcloud_integration.nextcloud_integration.backend_router import BACKEND_SSH, get_preferred_backend
+	from nextcloud_integration.nextcloud_integration.settings_cache import get_secret
+	from nextcloud_integration.nextcloud_integration.async_client import create_tree
+	from nextcloud_integration.nextcloud_integration.nextcloud_api import _create_via_ssh_occ_batch
+	
+	if get_preferred_backend(nextcloud_config) == BACKEND_SSH:
+		ssh_kwargs = _get_ssh_kwargs(nextcloud_config)
+		batch_size = nextcloud_config.batch_max_size or 50
+		results = {}
+		for wave in _chunks(list(_chunks(folder_paths, batch_size)), concurrency):
+			for batch_result in executor.map(
+				lambda paths: _create_via_ssh_occ_batch(folder_paths=paths, **ssh_kwargs),
+				wave
+			):
+				results.update(batch_result["results"])
+		
+		# A folder tree split over two parallel batches can race on its shared parent: retry those once
+		failed_paths = [path for path, result in results.items() if not result.get("success")]
+		if failed_paths and len(failed_paths) < len(folder_paths):
+			results.update(_create_via_ssh_occ_batch(folder_paths=failed_paths, **ssh_kwargs)["results"])
+		return results
+	
+	# WebDAV: keep up to `concurrency` MKCOLs in flight from a single thread
+	return create_tree(
+		nextcloud_config.nextcloud_url,
+		nextcloud_config.username,
+		get_secret(nextcloud_config, "password"),
+		folder_paths,
+		concurrency=concurrency
+	)
+
+
+def _keep_running_flag(cache, key, stop):
+	"""
+	Heartbeat thread: refresh the running flag until `stop` is set
+	
+	Runs independently of the pages, so a page that takes longer than RUNNING_TTL
+	(slow Nextcloud, huge batches) never lets the flag expire and a second backfill start.
+	"""
+	while not stop.wait(RUNNING_HEARTBEAT):
+		try:
+			# xx: never re-create a flag that was cleared, or set one for a run started without it
+			cache.set(key, 1, ex=RUNNING_TTL, xx=True)
+		except Exception:
+			pass
+
+
+def run_backfill(concurrency=DEFAULT_CONCURRENCY, page_size=DEFAULT_PAGE_SIZE, reset=False, progress_callback=None):
+	"""
+	Create folders for all existing Opportunities that do not have one
+	
+	Opportunities are streamed in pages; after each page the checkpoint is saved, so an
+	interrupted run continues where it stopped. Folder paths follow the Folder Layout with
+	the Opportunity's creation date, on the target it is routed to. When a run completes the checkpoint is
+	cleared, so the next run retries anything that failed.
+	
+	Args:
+		concurrency: Maximum number of requests in flight (lowered to a target's max_concurrency)
+		page_size: Number of Opportunities loaded per page
+		reset: Ignore the saved checkpoint and start from the beginning
+		progress_callback: Optional callable receiving the progress dict after each page
+	
+	Returns:
+		dict: Summary with processed, created, failed, elapsed and rate
+	"""
+	from nextcloud_integration.hooks import _get_settings_name
+	from nextcloud_integration.nextcloud_integration.folder_layout import get_folder_path
+	from nextcloud_integration.nextcloud_integration.folder_links import save_folder_link
+	from nextcloud_integration.nextcloud_integration.folder_templates import combine_tree_results, get_template_paths
+	from nextcloud_integration.nextcloud_integration.circuit_breaker import get_open_remaining, is_open as circuit_is_open
+	from nextcloud_integration.nextcloud_integration.health_monitor import get_outage
+	from nextcloud_integration.nextcloud_integration.targets import DEFAULT_TARGET, get_target_name, resolve_targets
+	
+	settings_name = _get_settings_name()
+	if not settings_name:
+		return {"success": False, "error": "Nextcloud Settings not configured."}
+	
+	nextcloud_config = frappe.get_cached_doc("Nextcloud Settings", settings_name)
+	if not nextcloud_config.enabled:
+		return {"success": False, "error": "Nextcloud integration is disabled."}
+	
+	if reset:
+		set_checkpoint(None)
+	
+	after = get_checkpoint()
+	total = count_opportunities_without_folder(after)
+	frappe.logger().info(f"Nextcloud backfill starting after {after or 'the beginning'}: {total} Opportunities without folder")
+	
+	processed = created = failed = 0
+	paused = None
+	start_time = time.time()
+	cache = frappe.cache()
+	connections = []
+	stop_heartbeat = threading.Event()
+	threading.Thread(target=_keep_running_flag, args=(cache, cache.make_key(RUNNING_KEY), stop_heartbeat), daemon=True).start()
+	
+	try:
+		with ThreadPoolExecutor(max_workers=max(int(concurrency), 1), initializer=_init_worker_thread, initargs=(frappe.local.site, connections)) as executor:
+			while True:
+				page = get_opportunities_without_folder(after, page_size)
+				if not page:
+					break
+				
+				folder_paths = {
+					row.name: get_folder_path(nextcloud_config, row.name, created=row.creation)
+					for row in page
+				}
+				subfolder_paths = {
+					row.name: get_template_paths(nextcloud_config, row.name, folder_paths[row.name], year=row.creation.year)
+					for row in page
+				}
+				
+				# One round of requests per target the page's Opportunities are routed to
+				targets = resolve_targets(nextcloud_config, list(folder_paths))
+				groups = {}
+				for name in folder_paths:
+					groups.setdefault(get_target_name(targets[name]), (targets[name], []))[1].append(name)
+				
+				# Stop while a target is failing, as the folder jobs do; the checkpoint keeps the position
+				outages = {
+					target: (
+						f"circuit breaker open for another {int(get_open_remaining(target_config))}s"
+						if circuit_is_open(target_config) else get_outage(target_config)
+					)
+					for target, (target_config, _) in groups.items()
+				}
+				outages = {target: outage for target, outage in outages.items() if outage}
+				if outages:
+					paused = "Nextcloud unreachable: " + "; ".join(f"{target}: {outage}" for target, outage in outages.items())
+					break
+				
+				results = {}
+				for target, (target_config, names) in groups.items():
+					page_paths = [path for name in names for path in [folder_paths[name]] + subfolder_paths[name]]
+					target_concurrency = min(int(concurrency), cint(target_config.max_concurrency) or int(concurrency))
+					results[target] = _create_page(executor, target_config, list(dict.fromkeys(page_paths)), concurrency=target_concurrency)
+				
+				for opportunity_name, folder_path in folder_paths.items():
+					target = get_target_name(targets[opportunity_name])
+					result = combine_tree_results(folder_path, subfolder_paths[opportunity_name], results[target])
+					if result.get("success"):
+						created += 1
+						save_folder_link(opportunity_name, result, target=None if target == DEFAULT_TARGET else target)
+					else:
+						failed += 1
+						frappe.logger().error(f"Nextcloud backfill failed for {opportunity_name}: {result.get('error')}")
+				
+				processed += len(page)
+				after = page[-1].name
+				set_checkpoint(after)
+				
+				elapsed = time.time() - start_time
+				rate = processed / elapsed if elapsed else 0
+				progress = {
+					"processed": processed,
+					"total": total,
+					"created": created,
+					"failed": failed,
+					"checkpoint": after,
+					"rate": round(rate, 2),
+					"eta_seconds": int((total - processed) / rate) if rate and total > processed else 0
+				}
+				cache.set_value(PROGRESS_KEY, progress)
+				frappe.logger().info(f"Nextcloud backfill progress: {progress}")
+				if progress_callback:
+					progress_callback(progress)
+	finally:
+		stop_heartbeat.set()
+		_close_worker_connections(connections)
+	
+	elapsed = time.time() - start_time
+	if paused:
+		frappe.logger().warning(f"Nextcloud backfill paused at {after or 'the beginning'}: {paused}")
+		return {
+			"success": False,
+			"error": f"Backfill paused, {paused}. Run it again to continue from {after or 'the beginning'}.",
+			"processed": processed,
+			"created": created,
+			"failed": failed,
+			"elapsed": round(elapsed, 2)
+		}
+	
+	# Completed: next run starts over and picks up the failures
+	set_checkpoint(None)
+	
+	return {
+		"success": True,
+		"processed": processed,
+		"created": created,
+		"failed": failed,
+		"elapsed": round(elapsed, 2),
+		"rate": round(processed / elapsed, 2) if elapsed else 0
+	}
+
+
+def _run_backfill_job(concurrency=DEFAULT_CONCURRENCY, page_size=DEFAULT_PAGE_SIZE, reset=False):
+	"""Background job wrapper for run_backfill with realtime progress"""
+	def publish(progress):
+		percent = (progress["processed"] / progress["total"] * 100) if progress["total"] else 100
+		frappe.publish_progress(
+			percent,
+			title="Nextcloud Backfill",
+			description=f"{progress['processed']}/{progress['total']} ({progress['rate']}/s, ETA {progress['eta_seconds']}s)"
+		)
+	
+	cache = frappe.cache()
+	try:
+		result = run_backfill(concurrency=concurrency, page_size=page_size, reset=reset, progress_callback=publish)
+		frappe.logger().info(f"Nextcloud backfill finished: {result}")
+	except Exception as e:
+		frappe.log_error(
+			title="Nextcloud Backfill Error",
+			message=f"Error running Nextcloud backfill: {str(e)}"
+		)
+	finally:
+		cache.delete(cache.make_key(RUNNING_KEY))
+
+
+@frappe.whitelist()
+def start_backfill(concurrency=DEFAULT_CONCURRENCY, page_size=DEFAULT_PAGE_SIZE, reset=0):
+	"""
+	Start the folder backfill for existing Opportunities as a single background job
+	"""
+	frappe.only_for("System Manager")
+	
+	cache = frappe.cache()
+	if not cache.set(cache.make_key(RUNNING_KEY), 1, nx=True, ex=RUNNING_TTL):
+		return {
+			"success": False,
+			"error": "A Nextcloud backfill is already running."
+		}
+	
+	frappe.enqueue(
+		method=_run_backfill_job,
+		queue="long",
+		timeout=4 * 3600,  # Interrupted runs resume from the checkpoint
+		job_name="nextcloud_backfill",
+		concurrency=cint(concurrency) or DEFAULT_CONCURRENCY,
+		page_size=cint(page_size) or DEFAULT_PAGE_SIZE,
+		reset=bool(cint(reset)),
+		is_async=True
+	)
+	
+	return {
+		"success": True,
+		"message": "Nextcloud backfill started in background."
+	}
+
+
+@frappe.whitelist()
+def get_backfill_status():
+	"""Get the checkpoint and latest progress of the folder backfill"""
+	frappe.only_for("System Manager")
+	
+	cache = frappe.cache()
+	return {
+		"running": bool(cache.get(cache.make_key(RUNNING_KEY))),
+		"checkpoint": get_checkpoint(),
+		"progress": cache.get_value(PROGRESS_KEY)
+	}
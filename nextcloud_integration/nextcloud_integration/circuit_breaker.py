@@ -0,0 +1,136 @@
+import frappe
+import time
+
+from nextcloud_integration.nextcloud_integration.targets import get_target_name
+
+# Circuit breaker state in Redis, per site and target (key suffix = target name)
+FAILURES_KEY = "nextcloud_integration:circuit_failures"
+OPEN_UNTIL_KEY = "nextcloud_integration:circuit_open_until"
+OPEN_COUNT_KEY = "nextcloud_integration:circuit_open_count"
+
+# Consecutive failures (within FAILURE_WINDOW seconds) that open the circuit
+FAILURE_THRESHOLD = 5
+FAILURE_WINDOW = 120
+
+# How long the circuit stays open before the first probe, doubled after every failed probe (seconds)
+OPEN_SECONDS = 60
+MAX_OPEN_SECONDS = 1800
+
+
+def _key(name, nextcloud_config):
+	# One circuit per target, so a failing server does not stop folders going to the others
+	return frappe.cache().make_key(f"{name}:{get_target_name(nextcloud_config)}")
+
+
+def is_open(nextcloud_config):
+	"""
+	Check if the circuit of the config's target is open (that Nextcloud considered down)
+	
+	The circuit stays open until a probe from the scheduler succeeds, even after the
+	open period elapsed, so jobs never hammer a server that has not recovered.
+	"""
+	return frappe.cache().get(_key(OPEN_UNTIL_KEY, nextcloud_config)) is not None
+
+
+def get_open_remaining(nextcloud_config):
+	"""Seconds until the next probe of the target is due (0 if closed or due now)"""
+	open_until = frappe.cache().get(_key(OPEN_UNTIL_KEY, nextcloud_config))
+	if open_until is None:
+		return 0
+	return max(float(open_until) - time.time(), 0)
+
+
+def record_success(nextcloud_config):
+	"""Reset the target's failure counter after a successful Nextcloud operation"""
+	frappe.cache().delete(_key(FAILURES_KEY, nextcloud_config))
+
+
+def record_failure(nextcloud_config):
+	"""
+	Count a failed Nextcloud operation and open the target's circuit when the threshold is reached
+	
+	Returns:
+		bool: True if this failure opened the circuit
+	"""
+	cache = frappe.cache()
+	key = _key(FAILURES_KEY, nextcloud_config)
+	pipe = cache.pipeline()
+	pipe.incr(key)
+	pipe.expire(key, FAILURE_WINDOW)
+	failures, _ = pipe.execute()
+	
+	if failures >= FAILURE_THRESHOLD and not is_open(nextcloud_config):
+		_open(nextcloud_config)
+		return True
+	return False
+
+
+def _open(nextcloud_config):
+	cache = frappe.cache()
+	open_count = cache.incr(_key(OPEN_COUNT_KEY, nextcloud_config))
+	open_seconds = min(OPEN_SECONDS * 2 ** (open_count - 1), MAX_OPEN_SECONDS)
+	cache.set(_key(OPEN_UNTIL_KEY, nextcloud_config), time.time() + open_seconds)
+	cache.delete(_key(FAILURES_KEY, nextcloud_config))
+	frappe.logger().warning(f"Nextcloud circuit breaker of {get_target_name(nextcloud_config)} opened for {open_seconds}s")
+
+
+def _close(nextcloud_config):
+	cache = frappe.cache()
+	cache.delete(*[_key(name, nextcloud_config) for name in (OPEN_UNTIL_KEY, OPEN_COUNT_KEY, FAILURES_KEY)])
+	frappe.logger().info(f"Nextcloud circuit breaker of {get_target_name(nextcloud_config)} closed")
+
+
+def probe(nextcloud_config):
+	"""
+	Check if the target's configured backend answers again (cheap request, no folder created)
+	
+	Returns:
+		bool: True if the target's Nextcloud is reachable
+	"""
+	from nextcloud_integration.hooks import _use_ssh, _get_ssh_kwargs
+	from nextcloud_integration.nextcloud_integration.nextcloud_api import _get_ssh_connection, _get_ssh_reconnect, test_nextcloud_connection
+	from nextcloud_integration.nextcloud_integration.settings_cache import get_secret
+	from nextcloud_integration.nextcloud_integration.ssh_pool import run_ssh_command
+	
+	try:
+		if _use_ssh(nextcloud_config):
+			ssh_kwargs = _get_ssh_kwargs(nextcloud_config)
+			connection_args = (
+				ssh_kwargs["ssh_host"], ssh_kwargs["ssh_user"], ssh_kwargs["nextcloud_user"],
+				ssh_kwargs["ssh_key_path"], ssh_kwargs["use_service_token"],
+				ssh_kwargs["cf_client_id"], ssh_kwargs["cf_client_secret"]
+			)
+			ssh_target, ssh_options, error = _get_ssh_connection(*connection_args)
+			if error:
+				return False
+			return run_ssh_command(ssh_target, "true", ssh_options, timeout=10, reconnect=_get_ssh_reconnect(*connection_args)).returncode == 0
+		
+		return test_nextcloud_connection(
+			nextcloud_url=nextcloud_config.nextcloud_url,
+			username=nextcloud_config.username,
+			password=get_secret(nextcloud_config, "password")
+		).get("success", False)
+	except Exception as e:
+		frappe.logger().warning(f"Nextcloud circuit breaker probe failed: {str(e)}")
+		return False
+
+
+def probe_if_due(nextcloud_config):
+	"""
+	Probe the target when its open period has elapsed; close the circuit on success,
+	otherwise keep it open for a longer period
+	
+	Returns:
+		bool: True if the target's circuit is closed after the call
+	"""
+	if not is_open(nextcloud_config):
+		return True
+	if get_open_remaining(nextcloud_config) > 0:
+		return False
+	
+	if probe(nextcloud_config):
+		_close(nextcloud_config)
+		return True
+	
+	_open(nextcloud_config)
+	return False
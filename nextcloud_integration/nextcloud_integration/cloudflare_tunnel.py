@@ -0,0 +1,280 @@
+import frappe
+import hashlib
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import tempfile
+import time
+import fcntl
+
+# Directory holding the state, lock and log files of the tunnels shared by all workers on this host
+TUNNEL_DIR = os.path.join(tempfile.gettempdir(), "nextcloud_integration_tunnels")
+
+# Local interface the tunnels listen on
+TUNNEL_HOST = "127.0.0.1"
+
+# Local ports are picked from this range (stable per SSH host, so the SSH ControlMaster socket is reused)
+TUNNEL_PORT_BASE = 42000
+TUNNEL_PORT_RANGE = 2000
+
+# How long a new tunnel may take to accept connections (seconds)
+TUNNEL_START_TIMEOUT = 15
+
+# Timeout of the local health check connect (seconds)
+TUNNEL_CHECK_TIMEOUT = 1
+
+# How often a worker process connects to a tunnel's local port to check it (seconds)
+TUNNEL_PORT_CHECK_INTERVAL = 60
+
+# Path of the cloudflared binary, looked up once per process
+_cloudflared_path = None
+
+# When this process last found a tunnel's port open: {(ssh_host, pid, port): time}
+_port_checked_at = {}
+
+
+def _get_cloudflared():
+	global _cloudflared_path
+	if _cloudflared_path is None:
+		_cloudflared_path = shutil.which("cloudflared") or ""
+	return _cloudflared_path
+
+
+def _tunnel_id(ssh_host):
+	return hashlib.sha1(ssh_host.encode("utf-8")).hexdigest()[:16]
+
+
+def _fingerprint(ssh_host, cf_client_id, cf_client_secret):
+	"""Hash of the tunnel's credentials, so a rotated service token restarts the tunnel"""
+	return hashlib.sha256("\0".join([ssh_host, cf_client_id, cf_client_secret]).encode("utf-8")).hexdigest()
+
+
+def _state_path(ssh_host):
+	return os.path.join(TUNNEL_DIR, f"{_tunnel_id(ssh_host)}.json")
+
+
+def _read_state(ssh_host):
+	try:
+		with open(_state_path(ssh_host)) as state_file:
+			return json.load(state_file)
+	except (OSError, ValueError):
+		return None
+
+
+def _write_state(ssh_host, state):
+	path = _state_path(ssh_host)
+	with open(f"{path}.tmp", "w") as state_file:
+		json.dump(state, state_file)
+	os.replace(f"{path}.tmp", path)
+
+
+def _process_alive(pid):
+	try:
+		# Reap the process if it is our own exited child, so it does not linger as a zombie
+		if os.waitpid(pid, os.WNOHANG)[0] == pid:
+			return False
+	except ChildProcessError:
+		pass
+	
+	try:
+		os.kill(pid, 0)
+	except ProcessLookupError:
+		return False
+	except PermissionError:
+		return True
+	return True
+
+
+def _is_tunnel_process(pid, ssh_host):
+	"""
+	Check that a pid is still this host's cloudflared tunnel
+	
+	The pid comes from a state file shared in the temp directory and may have been
+	reused by an unrelated process since, so it is never signalled on trust.
+	"""
+	try:
+		with open(f"/proc/{pid}/cmdline", "rb") as cmdline_file:
+			args = [arg.decode("utf-8", "replace") for arg in cmdline_file.read().split(b"\0") if arg]
+	except OSError:
+		return False
+	# argv[0] is the interpreter when cloudflared is a wrapper script
+	return ssh_host in args and any(
+		os.path.basename(arg) == "cloudflared" and args[i + 1:i + 3] == ["access", "tcp"]
+		for i, arg in enumerate(args[:2])
+	)
+
+
+def _port_open(port, timeout=TUNNEL_CHECK_TIMEOUT):
+	try:
+		with socket.create_connection((TUNNEL_HOST, port), timeout=timeout):
+			return True
+	except OSError:
+		return False
+
+
+def _port_free(port):
+	with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+		try:
+			probe.bind((TUNNEL_HOST, port))
+			return True
+		except OSError:
+			return False
+
+
+def _pick_port(ssh_host, previous_port=None):
+	"""Prefer the previous (or the host's default) port, fall back to any free one"""
+	default_port = TUNNEL_PORT_BASE + int(_tunnel_id(ssh_host), 16) % TUNNEL_PORT_RANGE
+	for port in (previous_port, default_port):
+		if port and _port_free(port):
+			return port
+	
+	with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+		probe.bind((TUNNEL_HOST, 0))
+		return probe.getsockname()[1]
+
+
+def is_tunnel_healthy(ssh_host, state, fingerprint=None, check_port=False):
+	"""
+	Check that a tunnel's cloudflared is running, is ours and uses the current credentials
+	
+	The local port is only connected to with check_port, or when this process has not
+	checked it for TUNNEL_PORT_CHECK_INTERVAL seconds. A running cloudflared keeps
+	listening, and a broken tunnel shows up as an SSH connection error, after which
+	the caller checks again with check_port.
+	"""
+	if not state or (fingerprint and state.get("fingerprint") != fingerprint):
+		return False
+	if not (_process_alive(state["pid"]) and _is_tunnel_process(state["pid"], ssh_host)):
+		return False
+	
+	check_key = (ssh_host, state["pid"], state["port"])
+	if not check_port and time.time() - _port_checked_at.get(check_key, 0) < TUNNEL_PORT_CHECK_INTERVAL:
+		return True
+	if not _port_open(state["port"]):
+		_port_checked_at.pop(check_key, None)
+		return False
+	_port_checked_at[check_key] = time.time()
+	return True
+
+
+def _stop_process(pid, ssh_host):
+	"""Stop a tunnel's cloudflared, only if the pid still belongs to it"""
+	if not _process_alive(pid) or not _is_tunnel_process(pid, ssh_host):
+		return
+	try:
+		os.killpg(pid, signal.SIGTERM)
+	except OSError:
+		return
+	for _ in range(20):
+		if not _process_alive(pid):
+			return
+		time.sleep(0.1)
+	if not _is_tunnel_process(pid, ssh_host):
+		return
+	try:
+		os.killpg(pid, signal.SIGKILL)
+	except OSError:
+		pass
+
+
+def _start_tunnel(ssh_host, cf_client_id, cf_client_secret, port):
+	"""
+	Start a detached `cloudflared access tcp` process forwarding a local port to the SSH host
+	
+	The process gets its own session, so it outlives the worker that started it and is
+	shared by every worker on this host. The service token is passed in the environment,
+	not on the command line.
+	
+	Returns:
+		tuple: (pid, error) - error is None once the tunnel accepts connections
+	"""
+	env = dict(os.environ, TUNNEL_SERVICE_TOKEN_ID=cf_client_id, TUNNEL_SERVICE_TOKEN_SECRET=cf_client_secret)
+	log_path = os.path.join(TUNNEL_DIR, f"{_tunnel_id(ssh_host)}.log")
+	with open(log_path, "ab") as log_file:
+		process = subprocess.Popen(
+			[_get_cloudflared(), "access", "tcp", "--hostname", ssh_host, "--url", f"{TUNNEL_HOST}:{port}"],
+			stdin=subprocess.DEVNULL,
+			stdout=log_file,
+			stderr=log_file,
+			env=env,
+			start_new_session=True
+		)
+	
+	deadline = time.time() + TUNNEL_START_TIMEOUT
+	while time.time() < deadline:
+		if process.poll() is not None:
+			return None, f"cloudflared exited with code {process.returncode}, see {log_path}"
+		if _port_open(port):
+			return process.pid, None
+		time.sleep(0.1)
+	
+	process.kill()
+	process.wait()
+	return None, f"cloudflared did not open {TUNNEL_HOST}:{port} within {TUNNEL_START_TIMEOUT} seconds"
+
+
+def ensure_tunnel(ssh_host, cf_client_id, cf_client_secret, verify=False):
+	"""
+	Get the local port of the Cloudflare Access tunnel to an SSH host, starting it if needed
+	
+	One tunnel runs per SSH host on each worker host. A healthy tunnel costs a state file
+	read and a process check (see is_tunnel_healthy); a dead or stale one (cloudflared
+	exited, port closed, service token changed) is restarted under a host-wide lock, on the
+	same port when it is still free.
+	
+	Args:
+		verify: Also connect to the local port, e.g. after SSH failed to connect through the tunnel
+	
+	Returns:
+		tuple: (port, error) - error is None when the tunnel is usable
+	"""
+	fingerprint = _fingerprint(ssh_host, cf_client_id, cf_client_secret)
+	state = _read_state(ssh_host)
+	if is_tunnel_healthy(ssh_host, state, fingerprint, check_port=verify):
+		return state["port"], None
+	
+	if not _get_cloudflared():
+		frappe.logger().error("cloudflared not found in PATH. Service Token authentication requires cloudflared to be installed.")
+		return None, "cloudflared is not installed. Please install cloudflared or use IP-based bypass instead."
+	
+	os.makedirs(TUNNEL_DIR, mode=0o700, exist_ok=True)
+	
+	# Serialize tunnel starts between worker processes on this host
+	with open(f"{_state_path(ssh_host)}.lock", "w") as lock_file:
+		fcntl.flock(lock_file, fcntl.LOCK_EX)
+		try:
+			state = _read_state(ssh_host)
+			if is_tunnel_healthy(ssh_host, state, fingerprint, check_port=verify):
+				return state["port"], None
+			
+			if state:
+				frappe.logger().warning(f"Cloudflare tunnel to {ssh_host} is not healthy, restarting it")
+				_stop_process(state["pid"], ssh_host)
+			
+			port = _pick_port(ssh_host, state and state.get("port"))
+			frappe.logger().info(f"Starting Cloudflare tunnel to {ssh_host} on {TUNNEL_HOST}:{port}")
+			pid, error = _start_tunnel(ssh_host, cf_client_id, cf_client_secret, port)
+			if error:
+				return None, error
+			
+			_write_state(ssh_host, {"pid": pid, "port": port, "fingerprint": fingerprint, "started_at": time.time()})
+			_port_checked_at[(ssh_host, pid, port)] = time.time()
+			return port, None
+		finally:
+			fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def stop_tunnel(ssh_host):
+	"""Stop the tunnel to an SSH host on this worker host (the next SSH command starts a new one)"""
+	state = _read_state(ssh_host)
+	if not state:
+		return
+	
+	_stop_process(state["pid"], ssh_host)
+	try:
+		os.unlink(_state_path(ssh_host))
+	except OSError:
+		pass
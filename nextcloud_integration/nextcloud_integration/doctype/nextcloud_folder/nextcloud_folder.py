@@ -0,0 +1,6 @@
+import frappe
+from frappe.model.document import Document
+
+class NextcloudFolder(Document):
+	"""Nextcloud folder created for an Opportunity (named after the Opportunity)"""
+	pass
@@ -14,6 +14,42 @@ class NextcloudSettings(Document):
 			elif self.max_retry_attempts > 10:
 				frappe.throw(_("Maximum retry attempts cannot exceed 10"))
 		
+		# Validate OCC batching limits
+		if self.batch_occ_operations:
+			if not self.batch_max_size or self.batch_max_size < 1:
+				self.batch_max_size = 50
+			elif self.batch_max_size > 500:
+				frappe.throw(_("Maximum batch size cannot exceed 500"))
+			if not self.batch_window_ms or self.batch_window_ms < 0:
+				self.batch_window_ms = 500
+			elif self.batch_window_ms > 10000:
+				frappe.throw(_("Batch window cannot exceed 10000 ms"))
+		
+		# Validate the subfolder template
+		if self.folder_template:
+			from nextcloud_integration.nextcloud_integration.folder_templates import validate_template
+			validate_template(self.folder_template)
+		
+		# Validate the folder layout
+		if self.folder_layout:
+			from nextcloud_integration.nextcloud_integration.folder_layout import validate_layout
+			validate_layout(self.folder_layout)
+		if not self.layout_hash_buckets or self.layout_hash_buckets < 1:
+			self.layout_hash_buckets = 16
+		elif self.layout_hash_buckets > 4096:
+			frappe.throw(_("Hash Buckets cannot exceed 4096"))
+		
+		# Validate additional targets (folders remember their target by name)
+		target_names = set()
+		for target in self.get("targets") or []:
+			if target.target_name == "Default":
+				frappe.throw(_("Target name 'Default' is reserved for the server configured above"))
+			if target.target_name in target_names:
+				frappe.throw(_("Target name {0} is used more than once").format(target.target_name))
+			target_names.add(target.target_name)
+			if target.routing in ("Company", "Opportunity Type") and not target.routing_value:
+				frappe.throw(_("Target {0} needs a Routing Value for {1} routing").format(target.target_name, target.routing))
+		
 		# Validate required fields when enabled
 		if self.enabled:
 			if not self.nextcloud_url:
@@ -23,6 +59,13 @@ class NextcloudSettings(Document):
 			if not self.get_password("password"):
 				frappe.throw(_("Password is required when integration is enabled"))
 	
+	def on_update(self):
+		"""Invalidate cached settings/secrets and drop pooled connections so the new values are used immediately"""
+		from nextcloud_integration.nextcloud_integration.nextcloud_api import close_webdav_sessions
+		from nextcloud_integration.nextcloud_integration.settings_cache import clear_settings_cache
+		clear_settings_cache()
+		close_webdav_sessions()
+	
 	def is_feature_enabled(self, feature_name):
 		"""Check if a specific feature is enabled"""
 		if not self.enabled:
@@ -0,0 +1,6 @@
+import frappe
+from frappe.model.document import Document
+
+class NextcloudTarget(Document):
+	"""Additional Nextcloud account or server that folders can be routed to (child of Nextcloud Settings)"""
+	pass
@@ -0,0 +1,309 @@
+import frappe
+import json
+import time
+
+from nextcloud_integration.nextcloud_integration.metrics import finish_trace, start_trace
+from nextcloud_integration.nextcloud_integration.queues import get_folder_queue, get_job_timeout
+
+# Redis list holding folders waiting for the next batched OCC call
+PENDING_FOLDERS_KEY = "nextcloud_integration:pending_folders"
+
+# Redis list holding the folders of the batch being created, until the flush job acknowledges them
+PROCESSING_FOLDERS_KEY = "nextcloud_integration:processing_folders"
+
+# Set while a flush job is queued or running, so only one is scheduled at a time
+FLUSH_SCHEDULED_KEY = "nextcloud_integration:batch_flush_scheduled"
+
+# Safety expiry for the flush flag in case a flush job dies without clearing it (seconds)
+FLUSH_SCHEDULED_TTL = 600
+
+DEFAULT_BATCH_WINDOW_MS = 500
+DEFAULT_BATCH_MAX_SIZE = 50
+
+
+def add_to_batch(opportunity_name, folder_path, retry_count=0, created=None):
+	"""
+	Queue a folder for the next batched SSH+OCC call
+	
+	Folders from all workers are collected in Redis and created by a single flush job,
+	which pays the SSH round trip and the Nextcloud PHP bootstrap once per batch.
+	"""
+	cache = frappe.cache()
+	cache.rpush(PENDING_FOLDERS_KEY, json.dumps({
+		"opportunity_name": opportunity_name,
+		"folder_path": folder_path,
+		"retry_count": retry_count,
+		"created": created
+	}))
+	frappe.logger().info(f"Added folder {folder_path} for Opportunity {opportunity_name} to OCC batch")
+	
+	_schedule_flush()
+
+
+def queue_new_opportunities(opportunity_names, created=None):
+	"""
+	Queue folder creation for the Opportunities inserted in one transaction
+	
+	Called after commit, so the jobs always find the Opportunities. With batched SSH + OCC
+	the names go to the next batch (existing folders and the folder paths are resolved by
+	the flush job, once per batch); otherwise every Opportunity gets its own folder job.
+	
+	Args:
+		created: {name: creation date} of the Opportunities, when known, so the jobs do not
+			query it for dated layouts
+	"""
+	from nextcloud_integration.hooks import _create_nextcloud_folder_background, _get_settings_name, _use_ssh
+	from nextcloud_integration.nextcloud_integration.queues import enqueue_folder_job
+	
+	if not opportunity_names:
+		return
+	created = {name: str(value) for name, value in (created or {}).items() if value}
+	
+	settings_name = _get_settings_name()
+	if not settings_name:
+		return
+	
+	nextcloud_config = frappe.get_cached_doc("Nextcloud Settings", settings_name)
+	if not nextcloud_config.is_feature_enabled("auto_create"):
+		frappe.logger().info(f"Auto-create folders is disabled. Skipping folder creation for {len(opportunity_names)} Opportunities")
+		return
+	
+	if not (_use_ssh(nextcloud_config) and getattr(nextcloud_config, "batch_occ_operations", False)):
+		for name in opportunity_names:
+			enqueue_folder_job(
+				_create_nextcloud_folder_background,
+				job_name=f"create_nextcloud_folder_{name}",
+				nextcloud_config=nextcloud_config,
+				opportunity_name=name,
+				created=created.get(name)
+			)
+		return
+	
+	cache = frappe.cache()
+	cache.pipeline().rpush(cache.make_key(PENDING_FOLDERS_KEY), *[
+		json.dumps({"opportunity_name": name, "folder_path": None, "retry_count": 0, "created": created.get(name), "auto": True})
+		for name in opportunity_names
+	]).execute()
+	
+	_schedule_flush()
+
+
+def _prepare_items(nextcloud_config, items):
+	"""
+	Drop queued items that need no folder and fill in the folder paths of new Opportunities
+	
+	Items from the insert hook only carry the Opportunity name: the auto-create switch and
+	existing folders are checked here for the whole batch (one query).
+	"""
+	from nextcloud_integration.nextcloud_integration.folder_layout import get_folder_paths
+	from nextcloud_integration.nextcloud_integration.folder_links import get_opportunities_with_folder
+	
+	if not nextcloud_config.is_feature_enabled("auto_create"):
+		items = [item for item in items if not item.get("auto")]
+	
+	existing = get_opportunities_with_folder([item["opportunity_name"] for item in items])
+	prepared = {}
+	for item in items:
+		if item["opportunity_name"] in existing or item["opportunity_name"] in prepared:
+			continue
+		prepared[item["opportunity_name"]] = item
+	
+	# Paths of the whole batch from the Folder Layout (one query for the creation dates)
+	folder_paths = get_folder_paths(
+		nextcloud_config,
+		[name for name, item in prepared.items() if not item.get("folder_path")],
+		created={name: item["created"] for name, item in prepared.items() if item.get("created")}
+	)
+	for name, folder_path in folder_paths.items():
+		prepared[name]["folder_path"] = folder_path
+	return list(prepared.values())
+
+
+def _schedule_flush():
+	"""Enqueue a flush job unless one is already queued or running"""
+	cache = frappe.cache()
+	if not cache.set(cache.make_key(FLUSH_SCHEDULED_KEY), 1, nx=True, ex=FLUSH_SCHEDULED_TTL):
+		return
+	
+	frappe.enqueue(
+		method=flush_folder_batch,
+		queue=get_folder_queue(),
+		timeout=FLUSH_SCHEDULED_TTL,
+		job_name="nextcloud_occ_batch_flush",
+		is_async=True
+	)
+
+
+def _pop_batch(max_size):
+	"""
+	Move up to max_size pending folders to the processing list
+	
+	The items stay there until _ack_batch, so a flush job that dies mid-batch loses
+	nothing: the next flush puts them back in the queue (_requeue_processing).
+	
+	Returns:
+		list: The raw items (as stored, for _ack_batch)
+	"""
+	cache = frappe.cache()
+	pipe = cache.pipeline()
+	for _ in range(max_size):
+		pipe.lmove(cache.make_key(PENDING_FOLDERS_KEY), cache.make_key(PROCESSING_FOLDERS_KEY), "LEFT", "RIGHT")
+	return [item for item in pipe.execute() if item is not None]
+
+
+def _ack_batch(raw_items):
+	"""Drop the items of a finished batch from the processing list"""
+	if not raw_items:
+		return
+	
+	cache = frappe.cache()
+	pipe = cache.pipeline()
+	for item in raw_items:
+		pipe.lrem(cache.make_key(PROCESSING_FOLDERS_KEY), 1, item)
+	pipe.execute()
+
+
+def _requeue_processing():
+	"""Put the items left in the processing list by a flush job that died back at the head of the queue"""
+	cache = frappe.cache()
+	requeued = 0
+	while cache.lmove(cache.make_key(PROCESSING_FOLDERS_KEY), cache.make_key(PENDING_FOLDERS_KEY), "RIGHT", "LEFT") is not None:
+		requeued += 1
+	if requeued:
+		frappe.logger().warning(f"Requeued {requeued} folders of an interrupted OCC batch flush")
+
+
+def resume_interrupted_flush():
+	"""
+	Scheduler job (every minute): restart the flush of a batch whose job died
+	
+	Only looks at Redis: schedules a flush when folders are left in the processing list
+	and no flush job is queued or running.
+	"""
+	cache = frappe.cache()
+	if cache.llen(PROCESSING_FOLDERS_KEY) and cache.get(cache.make_key(FLUSH_SCHEDULED_KEY)) is None:
+		_schedule_flush()
+
+
+def _flush_target_items(nextcloud_config, items):
+	"""Create the folders of one batch that are routed to the same target"""
+	from frappe.utils import get_datetime
+	from nextcloud_integration.hooks import _handle_folder_result
+	from nextcloud_integration.nextcloud_integration.circuit_breaker import get_open_remaining, is_open as circuit_is_open
+	from nextcloud_integration.nextcloud_integration.folder_templates import combine_tree_results, create_folder_paths, get_template_paths
+	from nextcloud_integration.nextcloud_integration.health_monitor import DOWN_RETRY_DELAY, get_outage
+	from nextcloud_integration.nextcloud_integration.retry_queue import get_retry_delay, schedule_retry
+	from nextcloud_integration.nextcloud_integration.targets import TARGET_BUSY_DELAY, target_slot
+	
+	# The target's Nextcloud known to be down: park its items until its circuit breaker has probed it
+	if circuit_is_open(nextcloud_config):
+		for item in items:
+			schedule_retry(item["opportunity_name"], item.get("retry_count", 0), get_open_remaining(nextcloud_config) + get_retry_delay(0), created=item.get("created"))
+		return
+	
+	# Every backend of the target failed its last health check: park its items
+	if get_outage(nextcloud_config):
+		for item in items:
+			schedule_retry(item["opportunity_name"], item.get("retry_count", 0), DOWN_RETRY_DELAY + get_retry_delay(0), created=item.get("created"))
+		return
+	
+	# Template subfolders go into the same batch as their Opportunity folder
+	subfolder_paths = {
+		item["folder_path"]: get_template_paths(
+			nextcloud_config, item["opportunity_name"], item["folder_path"],
+			year=get_datetime(item["created"]).year if item.get("created") else None
+		)
+		for item in items
+	}
+	folder_paths = [path for root in subfolder_paths for path in [root] + subfolder_paths[root]]
+	
+	# A batch takes one of the target's slots, like a single folder job
+	with target_slot(nextcloud_config) as acquired:
+		if not acquired:
+			for item in items:
+				schedule_retry(item["opportunity_name"], item.get("retry_count", 0), TARGET_BUSY_DELAY + get_retry_delay(0), created=item.get("created"))
+			return
+		
+		# One batched OCC call; folders it could not create fail over to WebDAV within this job
+		results = create_folder_paths(nextcloud_config, folder_paths)
+	
+	for item in items:
+		result = combine_tree_results(item["folder_path"], subfolder_paths[item["folder_path"]], results)
+		try:
+			_handle_folder_result(nextcloud_config, item["opportunity_name"], result, item.get("retry_count", 0), created=item.get("created"))
+		except Exception as e:
+			frappe.logger().error(f"Error handling batched folder result for {item['opportunity_name']}: {str(e)}")
+
+
+def flush_folder_batch():
+	"""
+	Background job: create all pending folders in batches of up to batch_max_size
+	
+	Waits batch_window_ms first so folders enqueued in the same burst share a batch.
+	"""
+	from nextcloud_integration.hooks import _get_settings_name
+	from nextcloud_integration.nextcloud_integration.targets import get_target_name, resolve_targets
+	
+	cache = frappe.cache()
+	start_trace()
+	try:
+		settings_name = _get_settings_name()
+		if not settings_name:
+			frappe.log_error(
+				title="Nextcloud Folder Creation Error",
+				message="Nextcloud Settings not configured"
+			)
+			cache.delete(cache.make_key(PENDING_FOLDERS_KEY), cache.make_key(PROCESSING_FOLDERS_KEY))
+			return
+		
+		nextcloud_config = frappe.get_cached_doc("Nextcloud Settings", settings_name)
+		frappe.local.nextcloud_config = nextcloud_config  # Store for helper functions
+		
+		# The insert hook queues without looking at the settings: drop the queue while disabled
+		if not nextcloud_config.enabled:
+			cache.delete(cache.make_key(PENDING_FOLDERS_KEY), cache.make_key(PROCESSING_FOLDERS_KEY))
+			return
+		
+		# Only one flush runs at a time: anything still being processed belongs to a dead one
+		_requeue_processing()
+		
+		window_ms = nextcloud_config.batch_window_ms or DEFAULT_BATCH_WINDOW_MS
+		max_size = nextcloud_config.batch_max_size or DEFAULT_BATCH_MAX_SIZE
+		
+		# Stop taking new batches in time to finish the current one before the job timeout
+		deadline = time.time() + FLUSH_SCHEDULED_TTL - get_job_timeout(nextcloud_config, batch=True)
+		
+		# Let the rest of the burst arrive
+		time.sleep(window_ms / 1000.0)
+		
+		while time.time() < deadline:
+			raw_items = _pop_batch(max_size)
+			if not raw_items:
+				break
+			
+			items = _prepare_items(nextcloud_config, [json.loads(item) for item in raw_items])
+			if not items:
+				_ack_batch(raw_items)
+				continue
+			
+			# One batched call per target the Opportunities are routed to
+			targets = resolve_targets(nextcloud_config, [item["opportunity_name"] for item in items])
+			groups = {}
+			for item in items:
+				target_config = targets[item["opportunity_name"]]
+				groups.setdefault(get_target_name(target_config), (target_config, []))[1].append(item)
+			
+			for target_config, target_items in groups.values():
+				_flush_target_items(target_config, target_items)
+			
+			frappe.db.commit()
+			_ack_batch(raw_items)
+	finally:
+		finish_trace("SSH+OCC batch")
+		cache.delete(cache.make_key(FLUSH_SCHEDULED_KEY))
+		
+		# Folders added after the last pop but before the flag was cleared saw a
+		# scheduled flush and did not enqueue one - pick them up now, along with
+		# the unacknowledged batch of a flush that failed
+		if cache.llen(PENDING_FOLDERS_KEY) or cache.llen(PROCESSING_FOLDERS_KEY):
+			_schedule_flush()
@@ -0,0 +1,218 @@
+import frappe
+import hashlib
+import itertools
+import re
+from frappe.utils import cint, get_datetime, now_datetime
+
+from nextcloud_integration.nextcloud_integration.folder_templates import clean_segment
+
+# Layout of the Opportunity folders before layouts were configurable
+DEFAULT_LAYOUT = "ALKHORA/استيرادية {year}/{prefix}{name}"
+
+DEFAULT_HASH_BUCKETS = 16
+
+# {token} placeholders in a layout
+TOKEN_RE = re.compile(r"\{([a-z_]+)\}")
+
+LAYOUT_TOKENS = ("year", "month", "quarter", "series", "bucket", "prefix", "name")
+
+# Tokens taken from the Opportunity's creation date (loaded only when the layout uses them)
+DATE_TOKENS = ("year", "month", "quarter")
+
+# Tokens with a known set of values, so their folders can be pre-created
+ENUMERABLE_TOKENS = ("year", "month", "quarter", "bucket", "prefix")
+
+# Upper bound on the parent folders pre-created per year
+MAX_PREWARM_FOLDERS = 1000
+
+
+def get_layout(nextcloud_config):
+	"""Folder layout of the settings, without surrounding slashes"""
+	return (getattr(nextcloud_config, "folder_layout", None) or DEFAULT_LAYOUT).strip().strip("/")
+
+
+def _get_buckets(nextcloud_config):
+	return cint(getattr(nextcloud_config, "layout_hash_buckets", 0)) or DEFAULT_HASH_BUCKETS
+
+
+def validate_layout(layout):
+	"""Throw if a layout uses unknown tokens or does not give every Opportunity its own folder"""
+	segments = [s.strip() for s in (layout or "").strip().strip("/").split("/")]
+	if not segments or not all(segments):
+		frappe.throw("Folder Layout must not contain empty segments")
+	
+	for segment in segments:
+		if segment in (".", ".."):
+			frappe.throw("Folder Layout must not contain '.' or '..' segments")
+		unknown = [t for t in TOKEN_RE.findall(segment) if t not in LAYOUT_TOKENS]
+		if unknown:
+			frappe.throw(f"Unknown Folder Layout token {{{unknown[0]}}}, use one of: " + ", ".join(f"{{{t}}}" for t in LAYOUT_TOKENS))
+	
+	if "{name}" not in segments[-1]:
+		frappe.throw("The last segment of the Folder Layout must contain {name}")
+
+
+def get_series(opportunity_name):
+	"""Naming series of an Opportunity name: CRM-OPP-2026-00042 -> CRM-OPP-2026"""
+	return re.sub(r"[-./_]*\d+$", "", opportunity_name) or opportunity_name
+
+
+def get_bucket_label(bucket, buckets):
+	"""Folder name of a hash bucket, zero-padded to the width of the largest bucket"""
+	return str(bucket).zfill(len(str(buckets - 1)))
+
+
+def get_bucket(opportunity_name, buckets):
+	"""Stable hash bucket folder of an Opportunity"""
+	return get_bucket_label(int(hashlib.md5(opportunity_name.encode("utf-8")).hexdigest(), 16) % buckets, buckets)
+
+
+def _render(layout, values):
+	segments = []
+	for segment in layout.split("/"):
+		rendered = TOKEN_RE.sub(lambda m: clean_segment(values.get(m.group(1))), segment).strip()
+		if rendered:
+			segments.append(rendered)
+	return "/".join(segments)
+
+
+def _uses_dates(layout):
+	return any(t in DATE_TOKENS for t in TOKEN_RE.findall(layout))
+
+
+def render_folder_path(nextcloud_config, opportunity_name, created):
+	"""Render the layout for one Opportunity created at `created`"""
+	created = get_datetime(created)
+	return _render(get_layout(nextcloud_config), {
+		"year": created.year,
+		"month": f"{created.month:02d}",
+		"quarter": f"Q{(created.month - 1) // 3 + 1}",
+		"series": get_series(opportunity_name),
+		"bucket": get_bucket(opportunity_name, _get_buckets(nextcloud_config)),
+		"prefix": nextcloud_config.folder_prefix or "Opportunity-",
+		"name": opportunity_name
+	})
+
+
+def get_folder_path(nextcloud_config, opportunity_name, created=None):
+	"""
+	Resolve the Nextcloud folder path of an Opportunity from the Folder Layout
+	
+	The single resolver for every place that needs a folder path. Date tokens use the
+	Opportunity's creation date, loaded only when the layout has one and `created` is not given.
+	
+	Returns:
+		str: Path relative to the user's root, e.g. ALKHORA/استيرادية 2026/03/Opportunity-OPP-00001
+	"""
+	if created is None and _uses_dates(get_layout(nextcloud_config)):
+		created = frappe.db.get_value("Opportunity", opportunity_name, "creation")
+	return render_folder_path(nextcloud_config, opportunity_name, created or now_datetime())
+
+
+def get_folder_paths(nextcloud_config, opportunity_names, created=None):
+	"""
+	Resolve the folder paths of many Opportunities (at most one query for the creation dates)
+	
+	Args:
+		created: {opportunity_name: creation date} already known, only the others are queried
+	
+	Returns:
+		dict: {opportunity_name: folder path}
+	"""
+	created = dict(created or {})
+	missing = [name for name in opportunity_names if name not in created]
+	if missing and _uses_dates(get_layout(nextcloud_config)):
+		created.update(frappe.get_all(
+			"Opportunity",
+			filters={"name": ["in", missing]},
+			fields=["name", "creation"],
+			as_list=True
+		))
+	return {
+		name: render_folder_path(nextcloud_config, name, created.get(name) or now_datetime())
+		for name in opportunity_names
+	}
+
+
+def get_layout_depth(nextcloud_config):
+	"""Number of folder levels down to an Opportunity folder"""
+	return len(get_layout(nextcloud_config).split("/"))
+
+
+def _expand_segment(nextcloud_config, segment, year):
+	tokens = list(dict.fromkeys(TOKEN_RE.findall(segment)))
+	options = {
+		"year": [year],
+		"month": [f"{m:02d}" for m in range(1, 13)],
+		"quarter": [f"Q{q}" for q in range(1, 5)],
+		"bucket": [get_bucket_label(b, _get_buckets(nextcloud_config)) for b in range(_get_buckets(nextcloud_config))],
+		"prefix": [nextcloud_config.folder_prefix or "Opportunity-"]
+	}
+	expanded = []
+	for combination in itertools.product(*[options[t] for t in tokens]):
+		rendered = _render(segment, dict(zip(tokens, combination)))
+		if rendered:
+			expanded.append(rendered)
+	return expanded
+
+
+def get_parent_paths(nextcloud_config, year=None):
+	"""
+	Get the shard folders of a year that can be created ahead of time
+	
+	The parent levels of the layout are expanded as long as they only use tokens with a
+	known set of values (month, quarter, bucket); the first per-Opportunity token ({series},
+	{name}) ends the expansion.
+	
+	Returns:
+		list: Deepest pre-creatable folders (their ancestors are created on the way)
+	"""
+	year = year or now_datetime().year
+	paths = [""]
+	for segment in get_layout(nextcloud_config).split("/")[:-1]:
+		if any(t not in ENUMERABLE_TOKENS for t in TOKEN_RE.findall(segment)):
+			break
+		options = _expand_segment(nextcloud_config, segment, year)
+		if not options:
+			continue
+		if len(paths) * len(options) > MAX_PREWARM_FOLDERS:
+			break
+		paths = [f"{path}/{option}" if path else option for path in paths for option in options]
+	return [path for path in paths if path]
+
+
+def ensure_parent_paths(nextcloud_config, folder_paths, force=False):
+	"""
+	Create shard folders and their ancestors that are not known to exist
+	
+	All missing levels go through the async client, one concurrent round of MKCOLs per
+	level, and are remembered in the folder registry.
+	
+	Args:
+		force: Ignore the registry and verify every level on the server
+	
+	Returns:
+		dict: {"success": bool, "folders": list (created or verified), "error": str}
+	"""
+	from nextcloud_integration.nextcloud_integration.async_client import create_tree
+	from nextcloud_integration.nextcloud_integration.folder_registry import forget_known_folders, get_ancestor_paths, is_known_folder, mark_known_folders
+	from nextcloud_integration.nextcloud_integration.settings_cache import get_secret
+	
+	nextcloud_url, username = nextcloud_config.nextcloud_url, nextcloud_config.username
+	levels = list(dict.fromkeys(level for path in folder_paths for level in get_ancestor_paths(path) + [path]))
+	if force:
+		forget_known_folders(nextcloud_url, username, *levels)
+	
+	pending = [level for level in levels if not is_known_folder(nextcloud_url, username, level)]
+	if not pending:
+		return {"success": True, "folders": []}
+	
+	results = create_tree(nextcloud_url, username, get_secret(nextcloud_config, "password"), pending)
+	done = [path for path, result in results.items() if result.get("success")]
+	failed = [path for path, result in results.items() if not result.get("success")]
+	mark_known_folders(nextcloud_url, username, *done)
+	return {
+		"success": not failed,
+		"folders": done,
+		"error": "; ".join(f"{path}: {results[path].get('error')}" for path in failed) or None
+	}
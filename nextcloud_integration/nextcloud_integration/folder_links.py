@@ -0,0 +1,64 @@
+import frappe
+from frappe.utils import now_datetime
+
+FOLDER_DOCTYPE = "Nextcloud Folder"
+
+
+def get_folder_link(opportunity_name):
+	"""
+	Get the stored folder of an Opportunity (single primary key lookup)
+	
+	Returns:
+		frappe._dict: folder_path, folder_url, file_id, backend, target, created_on, share_url - or None
+	"""
+	return frappe.db.get_value(
+		FOLDER_DOCTYPE,
+		opportunity_name,
+		["opportunity", "folder_path", "folder_url", "file_id", "backend", "target", "created_on", "share_url"],
+		as_dict=True
+	)
+
+
+def get_opportunities_with_folder(opportunity_names):
+	"""Get the subset of Opportunities that already have a folder (one query)"""
+	if not opportunity_names:
+		return set()
+	return set(frappe.get_all(
+		FOLDER_DOCTYPE,
+		filters={"name": ["in", list(opportunity_names)]},
+		pluck="name"
+	))
+
+
+def save_folder_link(opportunity_name, result, backend=None, target=None):
+	"""
+	Store the folder created for an Opportunity from a successful create result
+	
+	Args:
+		result: Result dict of a create function (webdav_path, folder_path, file_id, backend)
+		backend: Backend used, if not given in the result
+		target: Name of the additional target the folder was created on (None for the default target)
+	"""
+	values = {
+		"folder_path": result.get("webdav_path"),
+		"folder_url": result.get("folder_path"),
+		"file_id": str(result.get("file_id") or "") or None,
+		"backend": result.get("backend") or backend,
+		"target": target,
+		"created_on": now_datetime()
+	}
+	
+	if frappe.db.exists(FOLDER_DOCTYPE, opportunity_name):
+		frappe.db.set_value(FOLDER_DOCTYPE, opportunity_name, values)
+		return
+	
+	doc = frappe.get_doc(dict(values, doctype=FOLDER_DOCTYPE, opportunity=opportunity_name))
+	doc.insert(ignore_permissions=True, ignore_if_duplicate=True)
+
+
+def delete_folder_link(opportunity_name):
+	"""Forget the folder of a deleted Opportunity (the folder itself stays on Nextcloud)"""
+	from nextcloud_integration.nextcloud_integration.share_links import SHARE_LINKS_KEY
+	
+	frappe.db.delete(FOLDER_DOCTYPE, {"name": opportunity_name})
+	frappe.cache().hdel(SHARE_LINKS_KEY, opportunity_name)
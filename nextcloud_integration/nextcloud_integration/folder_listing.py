@@ -0,0 +1,156 @@
+import frappe
+import time
+
+from nextcloud_integration.nextcloud_integration.nextcloud_api import _get_webdav_url, _propfind, get_webdav_session, parse_propfind
+
+# Cached listing per folder: {"etag", "files", "checked_at"}
+LISTING_KEY = "nextcloud_integration:folder_listing"
+
+# A listing checked this recently is served without any request (seconds)
+LISTING_FRESH_FOR = 30
+
+# Cached listings are kept this long, revalidated with the folder ETag on use (seconds)
+LISTING_TTL = 24 * 60 * 60
+
+# Timeout of the listing requests - the form waits for them (seconds)
+LISTING_TIMEOUT = 10
+
+# Properties of the folder entries in a listing
+LISTING_PROPS = ("getetag", "getlastmodified", "getcontentlength", "getcontenttype", "resourcetype", "fileid", "size")
+
+
+def _listing_key(folder_path, target=None):
+	# Folders of additional targets are cached apart: the same path may exist on several servers
+	return f"{LISTING_KEY}:{target}:{folder_path}" if target else f"{LISTING_KEY}:{folder_path}"
+
+
+def invalidate_folder_listing(folder_path, target=None):
+	"""Drop the cached listing of a folder, e.g. after uploading into it"""
+	frappe.cache().delete_value(_listing_key(folder_path, target))
+
+
+def _build_listing(nextcloud_url, entries):
+	files = []
+	for name, entry in entries.items():
+		if not name:
+			continue
+		size = entry.get("size") or entry.get("getcontentlength")
+		files.append({
+			"name": name,
+			"is_folder": entry["is_folder"],
+			"size": int(size) if size else None,
+			"modified": entry.get("getlastmodified"),
+			"content_type": entry.get("getcontenttype"),
+			"url": f"{nextcloud_url.rstrip('/')}/f/{entry['fileid']}" if entry.get("fileid") else None
+		})
+	# Folders first, then by name
+	return sorted(files, key=lambda f: (not f["is_folder"], f["name"].lower()))
+
+
+def get_folder_listing(nextcloud_config, folder_path, password, refresh=False, cached_only=False):
+	"""
+	Get the entries of a Nextcloud folder, cached and revalidated with the folder ETag
+	
+	Nextcloud changes a folder's ETag whenever anything inside it changes. A cached
+	listing is therefore served as is while fresh, revalidated with a Depth:0 PROPFIND
+	of the ETag afterwards, and only re-listed (Depth:1) when the ETag has changed.
+	
+	Args:
+		folder_path: WebDAV path of the folder (as stored on the Nextcloud Folder record)
+		refresh: Skip the freshness window and revalidate now
+		cached_only: Never contact Nextcloud: return the cached listing however old, or files None
+	
+	Returns:
+		dict: {"success": bool, "files": list, "source": "cache"|"revalidated"|"listed"|"cold", "error": str}
+	"""
+	cache = frappe.cache()
+	key = _listing_key(folder_path, getattr(nextcloud_config, "target_name", None))
+	cached = cache.get_value(key)
+	now = time.time()
+	
+	if cached_only:
+		if not cached:
+			return {"success": True, "files": None, "source": "cold"}
+		return {"success": True, "files": cached["files"], "source": "cache"}
+	
+	if cached and not refresh and now - cached["checked_at"] < LISTING_FRESH_FOR:
+		return {"success": True, "files": cached["files"], "source": "cache"}
+	
+	session = get_webdav_session(nextcloud_config.nextcloud_url, nextcloud_config.username, password)
+	webdav_url = _get_webdav_url(nextcloud_config.nextcloud_url, nextcloud_config.username, [p for p in folder_path.split("/") if p])
+	
+	if cached:
+		response = _propfind(session, webdav_url, 0, props=("getetag",), timeout=LISTING_TIMEOUT)
+		if response.status_code == 207:
+			etag = parse_propfind(response.content, webdav_url).get("", {}).get("getetag")
+			if etag and etag == cached["etag"]:
+				cached["checked_at"] = now
+				cache.set_value(key, cached, expires_in_sec=LISTING_TTL)
+				return {"success": True, "files": cached["files"], "source": "revalidated"}
+		elif response.status_code == 404:
+			cache.delete_value(key)
+			return {"success": False, "error": "Folder not found in Nextcloud."}
+	
+	response = _propfind(session, webdav_url, 1, props=LISTING_PROPS, timeout=LISTING_TIMEOUT)
+	if response.status_code == 404:
+		cache.delete_value(key)
+		return {"success": False, "error": "Folder not found in Nextcloud."}
+	if response.status_code != 207:
+		return {"success": False, "error": f"Unexpected response from Nextcloud server: HTTP {response.status_code}"}
+	
+	entries = parse_propfind(response.content, webdav_url)
+	listing = {
+		"etag": entries.get("", {}).get("getetag"),
+		"files": _build_listing(nextcloud_config.nextcloud_url, entries),
+		"checked_at": now
+	}
+	cache.set_value(key, listing, expires_in_sec=LISTING_TTL)
+	return {"success": True, "files": listing["files"], "source": "listed"}
+
+
+@frappe.whitelist()
+def get_opportunity_folder_listing(opportunity_name, refresh=0, cached_only=0):
+	"""
+	List the files in an Opportunity's Nextcloud folder (for the Opportunity form)
+	
+	The form loads the cached listing only (Redis, no Nextcloud request) and asks for a
+	real listing when the user opens or refreshes it.
+	
+	Returns:
+		dict: {"success": bool, "folder_url": str, "files": list, "error": str}
+	"""
+	from frappe.utils import cint
+	from nextcloud_integration.hooks import _get_settings_name
+	from nextcloud_integration.nextcloud_integration.folder_links import get_folder_link
+	from nextcloud_integration.nextcloud_integration.settings_cache import get_secret
+	from nextcloud_integration.nextcloud_integration.targets import get_target_config
+	
+	frappe.has_permission("Opportunity", "read", opportunity_name, throw=True)
+	
+	folder_link = get_folder_link(opportunity_name)
+	if not folder_link or not folder_link.folder_path:
+		return {"success": False, "error": "No Nextcloud folder for this Opportunity yet."}
+	
+	settings_name = _get_settings_name()
+	if not settings_name:
+		return {"success": False, "error": "Nextcloud Settings not configured."}
+	
+	settings = frappe.get_cached_doc("Nextcloud Settings", settings_name)
+	if not settings.enabled:
+		return {"success": False, "error": "Nextcloud Integration is disabled."}
+	
+	try:
+		nextcloud_config = get_target_config(settings, folder_link.target)
+		result = get_folder_listing(
+			nextcloud_config,
+			folder_link.folder_path,
+			None if cint(cached_only) else get_secret(nextcloud_config, "password"),
+			refresh=cint(refresh),
+			cached_only=cint(cached_only)
+		)
+	except Exception as e:
+		frappe.logger().warning(f"Could not list Nextcloud folder of {opportunity_name}: {str(e)}")
+		return {"success": False, "error": f"Could not reach Nextcloud: {str(e)}"}
+	
+	result["folder_url"] = folder_link.folder_url
+	return result
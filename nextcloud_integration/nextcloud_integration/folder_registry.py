@@ -0,0 +1,41 @@
+import frappe
+
+# Redis set of folder paths known to exist, one set per Nextcloud account
+KNOWN_FOLDERS_KEY = "nextcloud_integration:known_folders"
+
+
+def _registry_key(nextcloud_url, username):
+	return f"{KNOWN_FOLDERS_KEY}:{nextcloud_url.rstrip('/')}:{username}"
+
+
+def _normalize(folder_path):
+	return "/".join(p for p in folder_path.split('/') if p)
+
+
+def is_known_folder(nextcloud_url, username, folder_path):
+	"""Check if a folder is known to exist (no network request)"""
+	return bool(frappe.cache().sismember(_registry_key(nextcloud_url, username), _normalize(folder_path)))
+
+
+def mark_known_folders(nextcloud_url, username, *folder_paths):
+	"""Remember that folders exist"""
+	paths = [_normalize(p) for p in folder_paths if _normalize(p)]
+	if paths:
+		frappe.cache().sadd(_registry_key(nextcloud_url, username), *paths)
+
+
+def forget_known_folders(nextcloud_url, username, *folder_paths):
+	"""Drop folders from the registry (e.g. after Nextcloud reported them missing)"""
+	paths = [_normalize(p) for p in folder_paths if _normalize(p)]
+	if paths:
+		frappe.cache().srem(_registry_key(nextcloud_url, username), *paths)
+
+
+def get_ancestor_paths(folder_path):
+	"""
+	Get all ancestors of a path, top-down
+	
+	Example: "A/B/C" -> ["A", "A/B"]
+	"""
+	parts = [p for p in folder_path.split('/') if p]
+	return ["/".join(parts[:i]) for i in range(1, len(parts))]
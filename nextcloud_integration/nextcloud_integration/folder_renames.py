@@ -0,0 +1,242 @@
+import frappe
+import json
+import os
+from frappe.utils import cint
+
+from nextcloud_integration.nextcloud_integration.folder_links import FOLDER_DOCTYPE
+
+# Redis list of folder moves waiting for the rename job
+PENDING_RENAMES_KEY = "nextcloud_integration:pending_renames"
+
+# Set while a rename job is queued or running, so only one is scheduled at a time
+RENAME_FLUSH_SCHEDULED_KEY = "nextcloud_integration:rename_flush_scheduled"
+RENAME_FLUSH_TTL = 1800
+
+# Moves handled per round of the rename job
+RENAME_BATCH_SIZE = 100
+
+# MOVEs in flight per target
+RENAME_CONCURRENCY = 4
+
+
+def prepare_rename(old_name, new_name, merge=False):
+	"""
+	Work out the folder move of a renamed or merged Opportunity (before_rename)
+	
+	Only reads the Nextcloud Folder records, except when merging into an Opportunity that
+	has a folder of its own: the old record is then deleted here, before ERPNext relinks
+	the old name, as relinking it to the new name would break the unique Opportunity link
+	and make the merge fail. A plain rename is carried over by apply_rename.
+	
+	Returns:
+		dict: The folder move, or None if there is no folder to move
+	"""
+	from nextcloud_integration.nextcloud_integration.share_links import SHARE_LINKS_KEY
+	
+	old_link = frappe.db.get_value(FOLDER_DOCTYPE, old_name, ["folder_path", "target"], as_dict=True)
+	if not old_link:
+		return None
+	
+	new_link = frappe.db.get_value(FOLDER_DOCTYPE, new_name, ["folder_path", "target"], as_dict=True) if merge else None
+	if not new_link:
+		# The layout path follows the creation date, as in reconciliation and the layout migration
+		created = frappe.db.get_value("Opportunity", old_name, "creation")
+		return {
+			"old_name": old_name,
+			"new_name": new_name,
+			"source": old_link.folder_path,
+			"destination": None,
+			"created": str(created) if created else None,
+			"target": old_link.target
+		}
+	
+	frappe.cache().hdel(SHARE_LINKS_KEY, old_name)
+	frappe.db.delete(FOLDER_DOCTYPE, {"name": old_name})
+	if (old_link.target or None) != (new_link.target or None):
+		frappe.logger().warning(
+			f"Opportunity {old_name} merged into {new_name}, but their Nextcloud folders are on different targets: "
+			f"{old_link.folder_path} is left in place"
+		)
+		return None
+	
+	# Merged into an Opportunity with its own folder: the old folder goes inside it
+	return {
+		"old_name": old_name,
+		"new_name": new_name,
+		"source": old_link.folder_path,
+		"destination": f"{new_link.folder_path.rstrip('/')}/{os.path.basename(old_link.folder_path.rstrip('/'))}",
+		"target": old_link.target
+	}
+
+
+def apply_rename(move):
+	"""
+	Carry the Nextcloud Folder record of a renamed Opportunity over to the new name (after_rename)
+	
+	ERPNext has already relinked the record's Opportunity field, only its name still
+	carries the old name. Records of merged Opportunities were handled by prepare_rename.
+	"""
+	from nextcloud_integration.nextcloud_integration.share_links import SHARE_LINKS_KEY
+	
+	if move["destination"]:
+		return
+	
+	frappe.cache().hdel(SHARE_LINKS_KEY, move["old_name"])
+	frappe.db.sql("""
+		update `tabNextcloud Folder`
+		set name = %(new)s, opportunity = %(new)s
+		where name = %(old)s
+	""", {"old": move["old_name"], "new": move["new_name"]})
+
+
+def queue_renames(moves):
+	"""Queue folder moves for the rename job (one job moves all of them, concurrently)"""
+	if not moves:
+		return
+	
+	cache = frappe.cache()
+	cache.pipeline().rpush(cache.make_key(PENDING_RENAMES_KEY), *[json.dumps(move) for move in moves]).execute()
+	_schedule_rename_flush()
+
+
+def _schedule_rename_flush():
+	"""Enqueue the rename job unless one is already queued or running"""
+	cache = frappe.cache()
+	if not cache.set(cache.make_key(RENAME_FLUSH_SCHEDULED_KEY), 1, nx=True, ex=RENAME_FLUSH_TTL):
+		return
+	
+	frappe.enqueue(
+		method=flush_renames,
+		queue="long",
+		timeout=RENAME_FLUSH_TTL,
+		job_name="nextcloud_folder_renames",
+		is_async=True
+	)
+
+
+def _pop_rename_batch(max_size):
+	"""Atomically take up to max_size queued moves off the list"""
+	cache = frappe.cache()
+	key = cache.make_key(PENDING_RENAMES_KEY)
+	pipe = cache.pipeline()
+	pipe.lrange(key, 0, max_size - 1)
+	pipe.ltrim(key, max_size, -1)
+	items, _ = pipe.execute()
+	return [json.loads(item) for item in items]
+
+
+def move_target_folders(settings, nextcloud_config, moves):
+	"""
+	Move the folders of renamed Opportunities on one target with server-side MOVE
+	
+	Renamed folders go to the Folder Layout path of the new name, dated by the Opportunity's
+	creation like everywhere else. Merged ones go into the folder of the Opportunity they
+	were merged into. Destination parents are created first, then all folders are moved
+	concurrently.
+	
+	Returns:
+		dict: {old Opportunity name: {"success": bool, "error": str}}
+	"""
+	from nextcloud_integration.nextcloud_integration.async_client import move_folders
+	from nextcloud_integration.nextcloud_integration.folder_layout import ensure_parent_paths, get_folder_path
+	from nextcloud_integration.nextcloud_integration.folder_listing import invalidate_folder_listing
+	from nextcloud_integration.nextcloud_integration.folder_registry import forget_known_folders
+	from nextcloud_integration.nextcloud_integration.layout_migration import _destination_exists, _normalize, _update_folder_record
+	from nextcloud_integration.nextcloud_integration.settings_cache import get_secret
+	
+	results = {}
+	pending = []
+	for move in moves:
+		destination = _normalize(move["destination"] or get_folder_path(settings, move["new_name"], created=move.get("created")))
+		if destination == _normalize(move["source"]):
+			results[move["old_name"]] = {"success": True}
+		else:
+			pending.append((move, destination))
+	if not pending:
+		return results
+	
+	parents = list(dict.fromkeys(os.path.dirname(destination) for _, destination in pending if "/" in destination))
+	parent_result = ensure_parent_paths(nextcloud_config, parents)
+	if not parent_result.get("success"):
+		results.update({
+			move["old_name"]: {"success": False, "error": f"Could not create parent folders: {parent_result.get('error')}"}
+			for move, _ in pending
+		})
+		return results
+	
+	password = get_secret(nextcloud_config, "password")
+	move_results = move_folders(
+		nextcloud_config.nextcloud_url,
+		nextcloud_config.username,
+		password,
+		[(_normalize(move["source"]), destination) for move, destination in pending],
+		concurrency=min(RENAME_CONCURRENCY, cint(nextcloud_config.max_concurrency) or RENAME_CONCURRENCY)
+	)
+	
+	for move, destination in pending:
+		result = move_results.get(_normalize(move["source"])) or {"success": False, "error": "No result for folder"}
+		if not result.get("success") and result.get("status_code") == 404 and _destination_exists(nextcloud_config, password, destination):
+			result = {"success": True}
+		
+		if not result.get("success"):
+			# 412: a folder already exists at the destination (MOVE never overwrites)
+			results[move["old_name"]] = {"success": False, "error": result.get("error")}
+			continue
+		
+		if move["destination"]:
+			# Merged: the folder now lives inside the other Opportunity's folder
+			invalidate_folder_listing(move["source"], move["target"])
+			invalidate_folder_listing(f"/{os.path.dirname(destination)}", move["target"])
+			forget_known_folders(nextcloud_config.nextcloud_url, nextcloud_config.username, move["source"])
+		else:
+			_update_folder_record(nextcloud_config, frappe._dict(name=move["new_name"], folder_path=move["source"], target=move["target"]), destination)
+		results[move["old_name"]] = {"success": True}
+	return results
+
+
+def flush_renames():
+	"""Background job: move the folders of all queued renames and merges"""
+	from nextcloud_integration.hooks import _get_settings_name
+	from nextcloud_integration.nextcloud_integration.targets import get_target_config
+	
+	cache = frappe.cache()
+	try:
+		settings_name = _get_settings_name()
+		if not settings_name:
+			return
+		
+		settings = frappe.get_cached_doc("Nextcloud Settings", settings_name)
+		if not settings.enabled:
+			return
+		
+		while True:
+			moves = _pop_rename_batch(RENAME_BATCH_SIZE)
+			if not moves:
+				break
+			
+			groups = {}
+			for move in moves:
+				groups.setdefault(move.get("target") or None, []).append(move)
+			
+			results = {}
+			for target, target_moves in groups.items():
+				try:
+					results.update(move_target_folders(settings, get_target_config(settings, target), target_moves))
+				except Exception as e:
+					results.update({move["old_name"]: {"success": False, "error": str(e)} for move in target_moves})
+			frappe.db.commit()
+			
+			# A folder that could not be moved stays where it is: its record still points at it
+			failed = [name for name, result in results.items() if not result.get("success")]
+			frappe.logger().info(f"Moved Nextcloud folders of {len(moves) - len(failed)} of {len(moves)} renamed Opportunities")
+			if failed:
+				frappe.log_error(
+					title="Nextcloud Folder Rename Error",
+					message="\n".join(f"{name}: {results[name].get('error')}" for name in failed)
+				)
+	finally:
+		cache.delete(cache.make_key(RENAME_FLUSH_SCHEDULED_KEY))
+		
+		# Renames queued after the last pop but before the flag was cleared
+		if cache.llen(PENDING_RENAMES_KEY):
+			_schedule_rename_flush()
@@ -0,0 +1,194 @@
+import frappe
+import re
+import time
+
+# {fieldname} placeholders in template lines
+PLACEHOLDER_RE = re.compile(r"\{([a-z_][a-z0-9_]*)\}")
+
+# Placeholders that are not Opportunity fields
+BUILTIN_PLACEHOLDERS = ("name", "year")
+
+
+def parse_template(template):
+	"""
+	Get the subfolder lines of a folder template
+	
+	One relative path per line; blank lines and lines starting with # are ignored.
+	
+	Returns:
+		list: Template lines, e.g. ["RFQ", "Shipping/Customs", "{customer_name}"]
+	"""
+	lines = []
+	for line in (template or "").splitlines():
+		line = line.strip().strip("/")
+		if line and not line.startswith("#"):
+			lines.append(line)
+	return lines
+
+
+def validate_template(template):
+	"""Throw if a template line could leave the Opportunity folder"""
+	for line in parse_template(template):
+		if any(segment in (".", "..") for segment in line.split("/")):
+			frappe.throw(f"Folder Template line '{line}' must not contain '.' or '..' segments")
+
+
+def get_template_fields(template):
+	"""Opportunity fields used as placeholders in a template"""
+	fields = set()
+	for line in parse_template(template):
+		fields.update(f for f in PLACEHOLDER_RE.findall(line) if f not in BUILTIN_PLACEHOLDERS)
+	return sorted(fields)
+
+
+def clean_segment(value):
+	"""Make a field value usable as a folder name: no path separators, no surrounding whitespace"""
+	return re.sub(r"[\\/]+", "-", str(value if value is not None else "")).strip()
+
+
+def render_template(template, values):
+	"""
+	Render template lines with placeholder values
+	
+	Empty segments (e.g. an unset field) are dropped, so "{territory}/Docs" with no
+	territory becomes "Docs".
+	
+	Returns:
+		list: Relative subfolder paths
+	"""
+	paths = []
+	for line in parse_template(template):
+		rendered = PLACEHOLDER_RE.sub(lambda m: clean_segment(values.get(m.group(1))), line)
+		segments = [s.strip() for s in rendered.split("/") if s.strip()]
+		if segments:
+			paths.append("/".join(segments))
+	return list(dict.fromkeys(paths))
+
+
+def get_template_paths(nextcloud_config, opportunity_name, root_path, year=None):
+	"""
+	Get the full paths of the template subfolders of an Opportunity folder
+	
+	Only the Opportunity fields used in the template are loaded (no query at all
+	when the template has no field placeholders).
+	
+	Returns:
+		list: Full subfolder paths below root_path, parents before children
+	"""
+	from datetime import datetime
+	
+	template = getattr(nextcloud_config, "folder_template", None)
+	if not parse_template(template):
+		return []
+	
+	values = {"name": opportunity_name, "year": year or datetime.now().year}
+	fields = get_template_fields(template)
+	if fields:
+		meta = frappe.get_meta("Opportunity")
+		fields = [f for f in fields if meta.has_field(f)]
+	if fields:
+		values.update(frappe.db.get_value("Opportunity", opportunity_name, fields, as_dict=True) or {})
+	
+	paths = set()
+	for relative in render_template(template, values):
+		parts = relative.split("/")
+		# Intermediate folders are nodes of the tree as well (Shipping for Shipping/Customs)
+		for i in range(1, len(parts) + 1):
+			paths.add(f"{root_path}/{'/'.join(parts[:i])}")
+	return sorted(paths, key=lambda p: (p.count("/"), p))
+
+
+def combine_tree_results(root_path, subfolder_paths, results):
+	"""
+	Build the result of one Opportunity folder tree from per-node results
+	
+	The tree only counts as created when every node was created (or existed), so a
+	retry recreates the missing nodes; existing nodes are no-ops.
+	
+	Returns:
+		dict: Result of the root folder with "subfolders": {path: {"success", "error"}}
+	"""
+	root_result = dict(results.get(root_path) or {"success": False, "error": "No result for folder"})
+	if not subfolder_paths:
+		return root_result
+	
+	subfolders = {}
+	for path in subfolder_paths:
+		node = results.get(path) or {"success": False, "error": "No result for folder"}
+		subfolders[path] = {"success": bool(node.get("success")), "error": node.get("error")}
+	root_result["subfolders"] = subfolders
+	
+	failed = [path for path, node in subfolders.items() if not node["success"]]
+	if root_result.get("success") and failed:
+		root_result["success"] = False
+		root_result["error"] = f"{len(failed)} of {len(subfolders)} template subfolders failed: " + "; ".join(
+			f"{path}: {subfolders[path]['error']}" for path in failed
+		)
+	return root_result
+
+
+def create_folder_paths(nextcloud_config, folder_paths):
+	"""
+	Create many folders (e.g. whole trees) in as few operations as possible
+	
+	SSH + OCC: one batched OCC invocation for all paths (missing parents are created
+	on the way). WebDAV: the async client over one pooled connection, one concurrent
+	round of MKCOLs per tree level. Paths the batch could not create fail over to WebDAV.
+	
+	Returns:
+		dict: {folder_path: result dict}
+	"""
+	from nextcloud_integration.hooks import _get_ssh_kwargs
+	from nextcloud_integration.nextcloud_integration.async_client import create_tree
+	from nextcloud_integration.nextcloud_integration.backend_router import BACKEND_SSH, BACKEND_WEBDAV, get_preferred_backend, record_outcome
+	from nextcloud_integration.nextcloud_integration.metrics import observe
+	from nextcloud_integration.nextcloud_integration.nextcloud_api import _create_via_ssh_occ_batch, ensure_folder_tree
+	from nextcloud_integration.nextcloud_integration.settings_cache import get_secret
+	
+	folder_paths = list(dict.fromkeys(folder_paths))
+	results = {}
+	
+	if get_preferred_backend(nextcloud_config) == BACKEND_SSH:
+		start_time = time.time()
+		batch_result = _create_via_ssh_occ_batch(folder_paths=folder_paths, **_get_ssh_kwargs(nextcloud_config))
+		record_outcome(BACKEND_SSH, batch_result["success"], (time.time() - start_time) / len(folder_paths), nextcloud_config)
+		results = batch_result["results"]
+	
+	pending = [path for path in folder_paths if not (results.get(path) or {}).get("success")]
+	if pending:
+		start_time = time.time()
+		password = get_secret(nextcloud_config, "password")
+		
+		# Parents outside the tree (e.g. the year folder): served from the folder registry once known
+		pending_set = set(pending)
+		parents = {path.rsplit("/", 1)[0] for path in pending if "/" in path.strip("/") and path.rsplit("/", 1)[0] not in pending_set}
+		for parent in sorted(parents):
+			ensure_folder_tree(nextcloud_config.nextcloud_url, nextcloud_config.username, password, parent)
+		
+		webdav_results = create_tree(
+			nextcloud_config.nextcloud_url,
+			nextcloud_config.username,
+			password,
+			pending
+		)
+		elapsed = time.time() - start_time
+		observe("remote", elapsed, "WebDAV tree")
+		record_outcome(BACKEND_WEBDAV, all(r.get("success") for r in webdav_results.values()), elapsed / len(pending), nextcloud_config)
+		for path, result in webdav_results.items():
+			if result.get("success") or path not in results:
+				results[path] = result
+	
+	return results
+
+
+def create_folder_tree(nextcloud_config, root_path, subfolder_paths):
+	"""
+	Create an Opportunity folder and its template subfolders in one operation
+	
+	Returns:
+		dict: Result of the root folder with per-node "subfolders" results
+	"""
+	start_time = time.time()
+	results = create_folder_paths(nextcloud_config, [root_path] + list(subfolder_paths))
+	frappe.logger().info(f"Created folder tree {root_path} ({len(subfolder_paths) + 1} folders) in {time.time() - start_time:.2f}s")
+	return combine_tree_results(root_path, subfolder_paths, results)
@@ -0,0 +1,251 @@
+import frappe
+import time
+
+from nextcloud_integration.nextcloud_integration.backend_router import BACKEND_OCS, BACKEND_SSH, get_available_backends
+from nextcloud_integration.nextcloud_integration.targets import DEFAULT_TARGET, get_target_name, get_targets
+
+# Latest probe result per target and backend (hash field = backend, "target:backend" for additional targets)
+HEALTH_KEY = "nextcloud_integration:health"
+
+# Recent probe results per target and backend, newest first, as "status:latency:timestamp"
+HISTORY_KEY = "nextcloud_integration:health_history"
+
+# Probe results kept per backend (one per minute)
+HISTORY_SIZE = 60
+
+# A status older than this is not trusted for fast-failing (seconds)
+STATUS_MAX_AGE = 180
+
+# How long jobs are deferred while all backends are down (seconds)
+DOWN_RETRY_DELAY = 60
+
+STATUS_UP = "up"
+STATUS_DOWN = "down"
+STATUS_AUTH_FAILED = "auth_failed"
+
+
+def _probe_ssh(nextcloud_config):
+	from nextcloud_integration.hooks import _get_ssh_kwargs
+	from nextcloud_integration.nextcloud_integration.nextcloud_api import SSH_COMMAND_TIMEOUT, _get_ssh_connection, _get_ssh_reconnect
+	from nextcloud_integration.nextcloud_integration.ssh_pool import run_ssh_command
+	
+	ssh_kwargs = _get_ssh_kwargs(nextcloud_config)
+	connection_args = (
+		ssh_kwargs["ssh_host"], ssh_kwargs["ssh_user"], ssh_kwargs["nextcloud_user"],
+		ssh_kwargs["ssh_key_path"], ssh_kwargs["use_service_token"],
+		ssh_kwargs["cf_client_id"], ssh_kwargs["cf_client_secret"]
+	)
+	ssh_target, ssh_options, error = _get_ssh_connection(*connection_args)
+	if error:
+		return STATUS_DOWN, error
+	
+	result = run_ssh_command(ssh_target, "true", ssh_options, timeout=SSH_COMMAND_TIMEOUT, reconnect=_get_ssh_reconnect(*connection_args))
+	if result.returncode == 0:
+		return STATUS_UP, None
+	if "Permission denied" in (result.stderr or ""):
+		return STATUS_AUTH_FAILED, result.stderr.strip()
+	return STATUS_DOWN, (result.stderr or "").strip() or f"ssh exited with code {result.returncode}"
+
+
+def _probe_webdav(nextcloud_config, password):
+	from nextcloud_integration.nextcloud_integration.nextcloud_api import test_nextcloud_connection
+	
+	result = test_nextcloud_connection(nextcloud_config.nextcloud_url, nextcloud_config.username, password)
+	if result.get("success"):
+		return STATUS_UP, None
+	if result.get("status_code") in (401, 403):
+		return STATUS_AUTH_FAILED, result.get("error")
+	return STATUS_DOWN, result.get("error")
+
+
+def _probe_ocs(nextcloud_config, password):
+	from nextcloud_integration.nextcloud_integration.nextcloud_api import OCS_TIMEOUT, get_webdav_session
+	
+	session = get_webdav_session(nextcloud_config.nextcloud_url, nextcloud_config.username, password)
+	response = session.get(
+		f"{nextcloud_config.nextcloud_url.rstrip('/')}/ocs/v2.php/cloud/user",
+		params={"format": "json"},
+		headers={"OCS-APIRequest": "true"},
+		timeout=OCS_TIMEOUT
+	)
+	if response.status_code == 200:
+		return STATUS_UP, None
+	if response.status_code in (401, 403):
+		return STATUS_AUTH_FAILED, f"HTTP {response.status_code}"
+	return STATUS_DOWN, f"HTTP {response.status_code}"
+
+
+def probe_backend(nextcloud_config, backend, password):
+	"""
+	Check reachability and credentials of one backend (cheap request, no folder created)
+	
+	Returns:
+		dict: {"status": "up"|"down"|"auth_failed", "latency": float, "checked_at": float, "error": str}
+	"""
+	start_time = time.time()
+	try:
+		if backend == BACKEND_SSH:
+			status, error = _probe_ssh(nextcloud_config)
+		elif backend == BACKEND_OCS:
+			status, error = _probe_ocs(nextcloud_config, password)
+		else:
+			status, error = _probe_webdav(nextcloud_config, password)
+	except Exception as e:
+		status, error = STATUS_DOWN, str(e)
+	
+	return {
+		"status": status,
+		"latency": round(time.time() - start_time, 4),
+		"checked_at": time.time(),
+		"error": error
+	}
+
+
+def _status_field(nextcloud_config, backend):
+	# The default target keeps the plain backend name
+	target = get_target_name(nextcloud_config)
+	return backend if target == DEFAULT_TARGET else f"{target}:{backend}"
+
+
+def _save_status(nextcloud_config, backend, status):
+	cache = frappe.cache()
+	field = _status_field(nextcloud_config, backend)
+	cache.hset(HEALTH_KEY, field, status)
+	
+	history_key = cache.make_key(f"{HISTORY_KEY}:{field}")
+	pipe = cache.pipeline()
+	pipe.lpush(history_key, f"{status['status']}:{status['latency']:.4f}:{status['checked_at']:.0f}")
+	pipe.ltrim(history_key, 0, HISTORY_SIZE - 1)
+	pipe.execute()
+
+
+def run_health_checks():
+	"""
+	Scheduler job (every minute): probe every configured backend of every target and cache the results
+	
+	Jobs and the manual button read the cached status instead of finding out about an
+	outage by waiting for their own timeouts.
+	"""
+	from nextcloud_integration.hooks import _get_settings_name
+	from nextcloud_integration.nextcloud_integration.settings_cache import get_secret
+	
+	settings_name = _get_settings_name()
+	if not settings_name:
+		return
+	
+	settings = frappe.get_cached_doc("Nextcloud Settings", settings_name)
+	if not settings.enabled:
+		return
+	
+	for nextcloud_config in get_targets(settings):
+		password = get_secret(nextcloud_config, "password")
+		for backend in get_available_backends(nextcloud_config):
+			# Probe timings are not folder operations: keep them out of the latency histograms
+			frappe.local.nextcloud_trace = []
+			try:
+				status = probe_backend(nextcloud_config, backend, password)
+			finally:
+				frappe.local.nextcloud_trace = None
+			
+			_save_status(nextcloud_config, backend, status)
+			if status["status"] != STATUS_UP:
+				frappe.logger().warning(
+					f"Nextcloud health check: {backend} of {get_target_name(nextcloud_config)} is {status['status']}: {status['error']}"
+				)
+
+
+def get_health_status(nextcloud_config, backends=None):
+	"""
+	Get the latest cached probe result per backend of the config's target
+	
+	Returns:
+		dict: {backend: status dict} (only backends that were probed)
+	"""
+	# RedisWrapper.hgetall returns the field names as bytes
+	statuses = {
+		k.decode() if isinstance(k, bytes) else k: v
+		for k, v in (frappe.cache().hgetall(HEALTH_KEY) or {}).items()
+	}
+	backends = backends or get_available_backends(nextcloud_config)
+	return {
+		backend: statuses[_status_field(nextcloud_config, backend)] for backend in backends
+		if _status_field(nextcloud_config, backend) in statuses
+	}
+
+
+def get_down_backends(nextcloud_config, backends=None):
+	"""Configured backends whose recent probe failed (stale or missing statuses count as up)"""
+	backends = backends or get_available_backends(nextcloud_config)
+	try:
+		statuses = get_health_status(nextcloud_config, backends)
+	except Exception as e:
+		frappe.logger().warning(f"Could not load Nextcloud health status: {str(e)}")
+		return []
+	
+	now = time.time()
+	return [
+		backend for backend in backends
+		if backend in statuses
+		and statuses[backend]["status"] != STATUS_UP
+		and now - statuses[backend]["checked_at"] <= STATUS_MAX_AGE
+	]
+
+
+def get_outage(nextcloud_config):
+	"""
+	Check if the config's target is known to be unusable on every configured backend
+	
+	Returns:
+		str: Description of the outage, or None if at least one backend may work
+	"""
+	backends = get_available_backends(nextcloud_config)
+	down = get_down_backends(nextcloud_config, backends)
+	if len(down) < len(backends):
+		return None
+	
+	statuses = get_health_status(nextcloud_config, backends)
+	return "; ".join(
+		f"{backend} {statuses[backend]['status']} ({statuses[backend]['error']})" for backend in backends
+	)
+
+
+@frappe.whitelist()
+def get_nextcloud_health():
+	"""Latest status and recent history of every configured backend, per target (for diagnostics)"""
+	frappe.only_for("System Manager")
+	
+	from nextcloud_integration.hooks import _get_settings_name
+	
+	settings_name = _get_settings_name()
+	if not settings_name:
+		return {"success": False, "error": "Nextcloud Settings not configured."}
+	
+	settings = frappe.get_cached_doc("Nextcloud Settings", settings_name)
+	configs = [(nextcloud_config, get_available_backends(nextcloud_config)) for nextcloud_config in get_targets(settings)]
+	
+	cache = frappe.cache()
+	pipe = cache.pipeline()
+	for nextcloud_config, backends in configs:
+		for backend in backends:
+			pipe.lrange(cache.make_key(f"{HISTORY_KEY}:{_status_field(nextcloud_config, backend)}"), 0, HISTORY_SIZE - 1)
+	raw_histories = iter(pipe.execute())
+	
+	targets = {}
+	for nextcloud_config, backends in configs:
+		history = {}
+		for backend in backends:
+			history[backend] = []
+			for raw in next(raw_histories):
+				status, latency, timestamp = (raw.decode() if isinstance(raw, bytes) else raw).split(":")
+				history[backend].append({"status": status, "latency": float(latency), "checked_at": float(timestamp)})
+		
+		targets[get_target_name(nextcloud_config)] = {
+			"status": get_health_status(nextcloud_config, backends),
+			"history": history,
+			"down": get_down_backends(nextcloud_config, backends)
+		}
+	
+	return {
+		"success": True,
+		"targets": targets
+	}
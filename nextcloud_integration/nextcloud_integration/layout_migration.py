@@ -0,0 +1,234 @@
+import frappe
+import os
+import time
+from frappe.utils import cint
+from urllib.parse import quote
+
+from nextcloud_integration.nextcloud_integration.folder_links import FOLDER_DOCTYPE
+
+# Set while a migration runs, so two runs never move the same folders
+MIGRATION_RUNNING_KEY = "nextcloud_integration:layout_migration_running"
+
+# Expiry of the running flag, refreshed after every batch (seconds)
+MIGRATION_RUNNING_TTL = 900
+
+DEFAULT_BATCH_SIZE = 100
+
+# MOVEs in flight - each one rewrites the file cache of the whole folder on the server
+DEFAULT_CONCURRENCY = 4
+
+
+def get_folders_page(after=None, limit=DEFAULT_BATCH_SIZE):
+	"""
+	Get the next page of stored folders with the creation date of their Opportunity
+	
+	Keyset pagination on name; folders of deleted Opportunities are left out.
+	
+	Returns:
+		list: frappe._dict rows with name, folder_path, target and creation
+	"""
+	return frappe.db.sql("""
+		select f.name, f.folder_path, f.target, opp.creation
+		from `tabNextcloud Folder` f
+		inner join `tabOpportunity` opp on opp.name = f.name
+		where f.name > %(after)s
+		order by f.name
+		limit %(limit)s
+	""", {
+		"after": after or "",
+		"limit": limit
+	}, as_dict=True)
+
+
+def _normalize(folder_path):
+	return "/".join(p for p in (folder_path or "").split("/") if p)
+
+
+def plan_moves(settings, rows):
+	"""
+	Get the folders of a page that are not where the Folder Layout puts them
+	
+	Returns:
+		list: (row, new folder path) pairs
+	"""
+	from nextcloud_integration.nextcloud_integration.folder_layout import get_folder_path
+	
+	moves = []
+	for row in rows:
+		new_path = get_folder_path(settings, row.name, created=row.creation)
+		if row.folder_path and _normalize(row.folder_path) != new_path:
+			moves.append((row, new_path))
+	return moves
+
+
+def _destination_exists(nextcloud_config, password, folder_path):
+	from nextcloud_integration.nextcloud_integration.nextcloud_api import _get_webdav_url, _propfind, get_webdav_session
+	
+	session = get_webdav_session(nextcloud_config.nextcloud_url, nextcloud_config.username, password)
+	webdav_url = _get_webdav_url(nextcloud_config.nextcloud_url, nextcloud_config.username, folder_path.split("/"))
+	return _propfind(session, webdav_url, 0).status_code == 207
+
+
+def _update_folder_record(nextcloud_config, row, new_path):
+	"""Point the Nextcloud Folder record at the moved folder and drop the caches of the old path"""
+	from nextcloud_integration.nextcloud_integration.folder_listing import invalidate_folder_listing
+	from nextcloud_integration.nextcloud_integration.folder_registry import forget_known_folders, mark_known_folders
+	
+	display_path = f"/{new_path}"
+	frappe.db.set_value(FOLDER_DOCTYPE, row.name, {
+		"folder_path": display_path,
+		"folder_url": f"{nextcloud_config.nextcloud_url.rstrip('/')}/apps/files/?dir={quote(display_path, safe='')}"
+	})
+	invalidate_folder_listing(row.folder_path, row.target)
+	forget_known_folders(nextcloud_config.nextcloud_url, nextcloud_config.username, row.folder_path)
+	mark_known_folders(nextcloud_config.nextcloud_url, nextcloud_config.username, new_path)
+
+
+def migrate_target_folders(nextcloud_config, moves, concurrency=DEFAULT_CONCURRENCY):
+	"""
+	Move folders of one target to their new paths with server-side MOVE
+	
+	The destination parents are created first (one concurrent round per level), then the
+	folders are moved concurrently; no file content passes through this server. A folder
+	whose source is gone but whose destination exists was moved by an interrupted run and
+	only gets its record updated.
+	
+	Args:
+		moves: (row, new folder path) pairs from plan_moves
+	
+	Returns:
+		dict: {opportunity_name: {"success": bool, "error": str}}
+	"""
+	from nextcloud_integration.nextcloud_integration.async_client import move_folders
+	from nextcloud_integration.nextcloud_integration.folder_layout import ensure_parent_paths
+	from nextcloud_integration.nextcloud_integration.settings_cache import get_secret
+	
+	password = get_secret(nextcloud_config, "password")
+	parents = list(dict.fromkeys(os.path.dirname(new_path) for _, new_path in moves if "/" in new_path))
+	parent_result = ensure_parent_paths(nextcloud_config, parents)
+	if not parent_result.get("success"):
+		return {row.name: {"success": False, "error": f"Could not create parent folders: {parent_result.get('error')}"} for row, _ in moves}
+	
+	move_results = move_folders(
+		nextcloud_config.nextcloud_url,
+		nextcloud_config.username,
+		password,
+		[(_normalize(row.folder_path), new_path) for row, new_path in moves],
+		concurrency=concurrency
+	)
+	
+	results = {}
+	for row, new_path in moves:
+		result = move_results.get(_normalize(row.folder_path)) or {"success": False, "error": "No result for folder"}
+		if not result.get("success") and result.get("status_code") == 404 and _destination_exists(nextcloud_config, password, new_path):
+			result = {"success": True}
+		
+		if result.get("success"):
+			_update_folder_record(nextcloud_config, row, new_path)
+			results[row.name] = {"success": True}
+		else:
+			# 412: a different folder already exists at the destination (MOVE never overwrites)
+			results[row.name] = {"success": False, "error": result.get("error")}
+	return results
+
+
+def run_layout_migration(batch_size=DEFAULT_BATCH_SIZE, concurrency=DEFAULT_CONCURRENCY, dry_run=False, progress_callback=None):
+	"""
+	Move existing Opportunity folders to the paths of the current Folder Layout
+	
+	Stored folders are read in pages; folders already at their layout path are skipped, so
+	the migration can be stopped and run again at any time. Each page is moved per target
+	and committed before the next one. Old parent folders are left in place, even when empty.
+	Only one migration moves folders at a time; dry runs do not take the running flag.
+	
+	Args:
+		batch_size: Folders read (and at most moved) per page
+		concurrency: Maximum MOVEs in flight (lowered to a target's max_concurrency)
+		dry_run: Only report the moves that would be made
+		progress_callback: Optional callable receiving the progress dict after each page
+	
+	Returns:
+		dict: Summary with scanned, moved, failed, elapsed and (for dry runs) planned moves
+	"""
+	from nextcloud_integration.hooks import _get_settings_name
+	
+	settings_name = _get_settings_name()
+	if not settings_name:
+		return {"success": False, "error": "Nextcloud Settings not configured."}
+	
+	settings = frappe.get_cached_doc("Nextcloud Settings", settings_name)
+	if not settings.enabled:
+		return {"success": False, "error": "Nextcloud integration is disabled."}
+	
+	cache = frappe.cache()
+	if not dry_run and not cache.set(cache.make_key(MIGRATION_RUNNING_KEY), 1, nx=True, ex=MIGRATION_RUNNING_TTL):
+		return {"success": False, "error": "A Nextcloud layout migration is already running for this site."}
+	
+	try:
+		return _migrate(settings, batch_size, concurrency, dry_run, progress_callback)
+	finally:
+		if not dry_run:
+			cache.delete(cache.make_key(MIGRATION_RUNNING_KEY))
+
+
+def _migrate(settings, batch_size, concurrency, dry_run, progress_callback):
+	from nextcloud_integration.nextcloud_integration.targets import get_target_config
+	
+	scanned = moved = failed = 0
+	planned = []
+	after = None
+	start_time = time.time()
+	cache = frappe.cache()
+	
+	while True:
+		rows = get_folders_page(after, batch_size)
+		if not rows:
+			break
+		
+		moves = plan_moves(settings, rows)
+		if dry_run:
+			planned.extend((row.name, row.folder_path, f"/{new_path}") for row, new_path in moves)
+		else:
+			groups = {}
+			for row, new_path in moves:
+				groups.setdefault(row.target or None, []).append((row, new_path))
+			
+			for target, target_moves in groups.items():
+				try:
+					target_config = get_target_config(settings, target)
+					target_concurrency = min(int(concurrency), cint(target_config.max_concurrency) or int(concurrency))
+					results = migrate_target_folders(target_config, target_moves, concurrency=target_concurrency)
+				except Exception as e:
+					results = {row.name: {"success": False, "error": str(e)} for row, _ in target_moves}
+				
+				for name, result in results.items():
+					if result.get("success"):
+						moved += 1
+					else:
+						failed += 1
+						frappe.logger().error(f"Nextcloud layout migration failed for {name}: {result.get('error')}")
+			frappe.db.commit()
+		
+		scanned += len(rows)
+		after = rows[-1].name
+		progress = {
+			"scanned": scanned,
+			"moved": moved,
+			"failed": failed,
+			"planned": len(planned),
+			"checkpoint": after
+		}
+		if not dry_run:
+			cache.set(cache.make_key(MIGRATION_RUNNING_KEY), 1, ex=MIGRATION_RUNNING_TTL)
+		frappe.logger().info(f"Nextcloud layout migration progress: {progress}")
+		if progress_callback:
+			progress_callback(progress)
+	
+	return {
+		"success": True,
+		"scanned": scanned,
+		"moved": moved,
+		"failed": failed,
+		"planned": planned,
+		"elapsed": round(time.time() - start_time, 2)
+	}
@@ -0,0 +1,228 @@
+import frappe
+import time
+from contextlib import contextmanager
+from datetime import timezone
+
+# Redis hash per (stage, backend) series holding bucket counts, sum and count
+METRICS_KEY = "nextcloud_integration:metrics"
+
+# Redis set of all series seen, as "stage|backend"
+SERIES_KEY = "nextcloud_integration:metrics_series"
+
+# Upper bounds of the histogram buckets (seconds), +Inf is implicit
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Stages of a folder job, in order
+STAGES = ("queued", "settings_load", "secret_decrypt", "connect", "remote", "comment", "publish", "total")
+
+
+def _series_key(stage, backend):
+	return frappe.cache().make_key(f"{METRICS_KEY}:{stage}:{backend or ''}")
+
+
+def _bucket_index(seconds):
+	for i, upper in enumerate(BUCKETS):
+		if seconds <= upper:
+			return i
+	return len(BUCKETS)
+
+
+def _write(observations):
+	"""Add observations [(stage, backend, seconds)] to the histograms in one round trip"""
+	if not observations:
+		return
+	
+	cache = frappe.cache()
+	pipe = cache.pipeline()
+	for stage, backend, seconds in observations:
+		key = _series_key(stage, backend)
+		pipe.hincrby(key, f"b{_bucket_index(seconds)}", 1)
+		pipe.hincrbyfloat(key, "sum", seconds)
+		pipe.hincrby(key, "count", 1)
+	pipe.execute()
+	cache.sadd(SERIES_KEY, *{f"{stage}|{backend or ''}" for stage, backend, _ in observations})
+
+
+def observe(stage, seconds, backend=None):
+	"""
+	Record the duration of a stage
+	
+	Inside a trace (see start_trace) the observation is buffered and written with the
+	rest of the job's stages; otherwise it is written immediately.
+	"""
+	trace = getattr(frappe.local, "nextcloud_trace", None)
+	if trace is not None:
+		trace.append((stage, backend, seconds))
+	else:
+		try:
+			_write([(stage, backend, seconds)])
+		except Exception as e:
+			frappe.logger().warning(f"Could not record Nextcloud metric {stage}: {str(e)}")
+
+
+@contextmanager
+def stage_timer(stage, backend=None):
+	"""Time the wrapped block as one stage"""
+	start_time = time.time()
+	try:
+		yield
+	finally:
+		observe(stage, time.time() - start_time, backend)
+
+
+def start_trace():
+	"""Start buffering the stages of the current job and record the time it spent queued"""
+	frappe.local.nextcloud_trace = []
+	frappe.local.nextcloud_trace_start = time.time()
+	
+	try:
+		from rq import get_current_job
+		job = get_current_job()
+	except Exception:
+		job = None
+	
+	if job and job.enqueued_at:
+		enqueued_at = job.enqueued_at
+		if enqueued_at.tzinfo is None:
+			enqueued_at = enqueued_at.replace(tzinfo=timezone.utc)  # RQ stores naive UTC
+		observe("queued", max(frappe.local.nextcloud_trace_start - enqueued_at.timestamp(), 0))
+
+
+def finish_trace(backend=None):
+	"""
+	Write all buffered stages of the current job
+	
+	Args:
+		backend: Backend the job used; the total job time is only recorded when given
+	"""
+	trace = getattr(frappe.local, "nextcloud_trace", None)
+	if trace is None:
+		return
+	
+	if backend:
+		trace.append(("total", backend, time.time() - frappe.local.nextcloud_trace_start))
+	frappe.local.nextcloud_trace = None
+	try:
+		_write(trace)
+	except Exception as e:
+		frappe.logger().warning(f"Could not record Nextcloud metrics: {str(e)}")
+
+
+def get_histograms():
+	"""
+	Load all histograms
+	
+	Returns:
+		list: dicts with stage, backend, buckets (cumulative counts per upper bound), sum and count
+	"""
+	cache = frappe.cache()
+	series = sorted(s.decode() if isinstance(s, bytes) else s for s in cache.smembers(SERIES_KEY))
+	if not series:
+		return []
+	
+	pipe = cache.pipeline()
+	for name in series:
+		stage, backend = name.split("|", 1)
+		pipe.hgetall(_series_key(stage, backend))
+	
+	histograms = []
+	for name, data in zip(series, pipe.execute()):
+		stage, backend = name.split("|", 1)
+		data = {k.decode() if isinstance(k, bytes) else k: v for k, v in data.items()}
+		cumulative = 0
+		buckets = []
+		for i, upper in enumerate(BUCKETS + (float("inf"),)):
+			cumulative += int(data.get(f"b{i}", 0))
+			buckets.append((upper, cumulative))
+		histograms.append({
+			"stage": stage,
+			"backend": backend,
+			"buckets": buckets,
+			"sum": float(data.get("sum", 0)),
+			"count": int(data.get("count", 0))
+		})
+	
+	histograms.sort(key=lambda h: (STAGES.index(h["stage"]) if h["stage"] in STAGES else len(STAGES), h["backend"]))
+	return histograms
+
+
+def _quantile(buckets, count, q):
+	"""Estimate a quantile from cumulative buckets (linear interpolation inside the bucket)"""
+	if not count:
+		return None
+	
+	rank = q * count
+	lower, previous = 0.0, 0
+	for upper, cumulative in buckets:
+		if cumulative >= rank:
+			if upper == float("inf"):
+				return lower  # Only known to be above the largest bound
+			in_bucket = cumulative - previous
+			return lower + (upper - lower) * ((rank - previous) / in_bucket if in_bucket else 0)
+		lower, previous = upper, cumulative
+	return lower
+
+
+def render_prometheus():
+	"""Render all histograms in the Prometheus text exposition format"""
+	lines = [
+		"# HELP nextcloud_folder_stage_seconds Duration of the stages of Nextcloud folder jobs",
+		"# TYPE nextcloud_folder_stage_seconds histogram"
+	]
+	for histogram in get_histograms():
+		labels = f'stage="{histogram["stage"]}",backend="{histogram["backend"]}"'
+		for upper, cumulative in histogram["buckets"]:
+			le = "+Inf" if upper == float("inf") else f"{upper:g}"
+			lines.append(f'nextcloud_folder_stage_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+		lines.append(f'nextcloud_folder_stage_seconds_sum{{{labels}}} {histogram["sum"]:.6f}')
+		lines.append(f'nextcloud_folder_stage_seconds_count{{{labels}}} {histogram["count"]}')
+	return "\n".join(lines) + "\n"
+
+
+def get_summary():
+	"""
+	Get count, mean and estimated p50/p95/p99 per stage and backend
+	
+	Returns:
+		list: dicts with stage, backend, count, mean, p50, p95, p99 (seconds)
+	"""
+	summary = []
+	for histogram in get_histograms():
+		count = histogram["count"]
+		row = {
+			"stage": histogram["stage"],
+			"backend": histogram["backend"],
+			"count": count,
+			"mean": round(histogram["sum"] / count, 4) if count else None
+		}
+		for q in (0.5, 0.95, 0.99):
+			value = _quantile(histogram["buckets"], count, q)
+			row[f"p{int(q * 100)}"] = round(value, 4) if value is not None else None
+		summary.append(row)
+	return summary
+
+
+def reset_metrics():
+	"""Drop all recorded histograms"""
+	cache = frappe.cache()
+	series = [s.decode() if isinstance(s, bytes) else s for s in cache.smembers(SERIES_KEY)]
+	keys = [_series_key(*name.split("|", 1)) for name in series]
+	if keys:
+		cache.delete(*keys)
+	cache.delete(cache.make_key(SERIES_KEY))
+
+
+@frappe.whitelist()
+def metrics():
+	"""Prometheus scrape endpoint for the folder job histograms"""
+	frappe.only_for("System Manager")
+	
+	from werkzeug.wrappers import Response
+	return Response(render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+
+@frappe.whitelist()
+def get_metrics_summary():
+	"""Latency report per stage and backend"""
+	frappe.only_for("System Manager")
+	return get_summary()
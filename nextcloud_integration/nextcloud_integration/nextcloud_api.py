@@ -1,25 +1,151 @@
 import requests
 import frappe
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
-from urllib.parse import quote, urljoin
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib.parse import quote, unquote, urljoin, urlparse
 import subprocess
-import os
+import xml.etree.ElementTree as ET
+import threading
+import time
 
-def create_nextcloud_folder(nextcloud_url, username, password, folder_path, use_rest_api=True, ssh_host=None, ssh_user=None, use_service_token=False, cf_client_id=None, cf_client_secret=None):
+from nextcloud_integration.nextcloud_integration.folder_registry import (
+	forget_known_folders,
+	get_ancestor_paths,
+	is_known_folder,
+	mark_known_folders
+)
+from nextcloud_integration.nextcloud_integration.cloudflare_tunnel import TUNNEL_HOST, ensure_tunnel
+from nextcloud_integration.nextcloud_integration.ssh_pool import get_ssh_options, run_ssh_command
+from nextcloud_integration.nextcloud_integration.metrics import observe
+
+# Size of the per-host connection pool kept by each pooled WebDAV session
+WEBDAV_POOL_SIZE = 10
+
+# Timeout of a single WebDAV request (seconds)
+WEBDAV_TIMEOUT = 30
+
+# Timeout of a single OCS REST API request (seconds)
+OCS_TIMEOUT = 10
+
+# Timeout of a single remote OCC command once the SSH connection is open (seconds)
+SSH_COMMAND_TIMEOUT = 10
+
+# Timeout of a batched OCC call (seconds)
+SSH_BATCH_TIMEOUT = 60
+
+# Namespace of WebDAV elements in PROPFIND responses
+DAV_NS = "{DAV:}"
+
+# Process-wide WebDAV sessions keyed by (nextcloud_url, username)
+_webdav_sessions = {}
+_webdav_sessions_lock = threading.Lock()
+
+
+def _observe_connect(start_time):
+	# Connections may be opened in threads without a site context: never fail the request over a metric
+	try:
+		observe("connect", time.time() - start_time, "WebDAV")
+	except Exception:
+		pass
+
+
+class _TimedHTTPConnection(HTTPConnection):
+	def connect(self):
+		start_time = time.time()
+		super().connect()
+		_observe_connect(start_time)
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+	def connect(self):
+		start_time = time.time()
+		super().connect()
+		_observe_connect(start_time)
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+	ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+	ConnectionCls = _TimedHTTPSConnection
+
+
+class _TimedHTTPAdapter(HTTPAdapter):
+	"""HTTPAdapter recording the TCP/TLS setup of every new pooled connection as the "connect" stage"""
+	
+	def init_poolmanager(self, *args, **kwargs):
+		super().init_poolmanager(*args, **kwargs)
+		self.poolmanager.pool_classes_by_scheme = {
+			"http": _TimedHTTPConnectionPool,
+			"https": _TimedHTTPSConnectionPool
+		}
+
+
+def get_webdav_session(nextcloud_url, username, password):
+	"""
+	Get the process-wide pooled session for a Nextcloud account
+	
+	The session lives for the whole worker process so consecutive requests reuse
+	the same keep-alive TCP/TLS connections instead of paying a new handshake per folder.
+	
+	Args:
+		nextcloud_url: Base URL of Nextcloud (e.g., https://cloud.alkhora.com)
+		username: Nextcloud username
+		password: Nextcloud password or app password
+	
+	Returns:
+		requests.Session: Shared session with basic auth and a sized connection pool
+	"""
+	key = (nextcloud_url.rstrip('/'), username)
+	
+	with _webdav_sessions_lock:
+		session = _webdav_sessions.get(key)
+		if session is None:
+			session = requests.Session()
+			adapter = _TimedHTTPAdapter(
+				pool_connections=1,  # Only one host per session
+				pool_maxsize=WEBDAV_POOL_SIZE,
+				pool_block=False,  # Open extra (non-pooled) connections under burst instead of waiting
+				max_retries=0
+			)
+			session.mount("https://", adapter)
+			session.mount("http://", adapter)
+			session.headers.update({"Connection": "keep-alive"})
+			_webdav_sessions[key] = session
+		
+		# Password may have been changed in Nextcloud Settings since the session was created
+		session.auth = HTTPBasicAuth(username, password)
+	
+	return session
+
+
+def close_webdav_sessions():
+	"""Close all pooled WebDAV sessions (e.g. after credentials were changed)"""
+	with _webdav_sessions_lock:
+		for session in _webdav_sessions.values():
+			session.close()
+		_webdav_sessions.clear()
+
+
+def create_nextcloud_folder(nextcloud_url, username, password, folder_path, use_rest_api=False, ssh_host=None, ssh_user=None, use_service_token=False, cf_client_id=None, cf_client_secret=None):
 	"""
 	Create a folder in Nextcloud using the fastest available method
 	
 	Priority:
 	1. SSH + OCC command (fastest, if SSH access available)
-	2. REST API (faster than WebDAV)
-	3. WebDAV (fallback)
+	2. REST API (only if use_rest_api, i.e. the settings' "Use OCS REST API")
+	3. WebDAV
 	
 	Args:
 		nextcloud_url: Base URL of Nextcloud (e.g., https://cloud.alkhora.com)
 		username: Nextcloud username
 		password: Nextcloud password or app password
 		folder_path: Full path of the folder to create (e.g., "ALKHORA/استيرادية 2026/Opportunity-OPP-00001")
-		use_rest_api: Use REST API instead of WebDAV (default: True, faster)
+		use_rest_api: Try the OCS REST API before WebDAV (default: False, as most servers
+			do not offer it and every call would pay a failing round trip first)
 		ssh_host: SSH host for direct server access (optional, fastest method)
 		ssh_user: SSH username (optional)
 		use_service_token: Use Cloudflare Service Token for authentication (optional)
@@ -33,12 +159,66 @@ def create_nextcloud_folder(nextcloud_url, username, password, folder_path, use_
 	if ssh_host:
 		return _create_via_ssh_occ(ssh_host, ssh_user, username, folder_path, nextcloud_url, None, None, "www-data", use_service_token, cf_client_id, cf_client_secret)
 	
-	# Note: Nextcloud doesn't have a direct REST API for file operations
-	# File operations are done via WebDAV, but we can optimize it
-	# Try optimized WebDAV with connection pooling (faster than standard WebDAV)
+	# Try the OCS REST API if requested, falling back to WebDAV when it fails
+	if use_rest_api:
+		result = _create_via_rest_api(nextcloud_url, username, password, folder_path)
+		if result.get("success"):
+			return result
+		frappe.logger().info(f"REST API failed, falling back to WebDAV: {result.get('error')}")
+	
+	# Optimized WebDAV with connection pooling (faster than standard WebDAV)
 	return _create_via_webdav_optimized(nextcloud_url, username, password, folder_path)
 
 
+def _get_ssh_connection(ssh_host, ssh_user, nextcloud_user, ssh_key_path=None, use_service_token=False, cf_client_id=None, cf_client_secret=None, verify_tunnel=False):
+	"""
+	Build the SSH target and options for the SSH + OCC backend
+	
+	Args:
+		verify_tunnel: Fully check the Cloudflare tunnel (local connect) instead of trusting a running cloudflared
+	
+	Returns:
+		tuple: (ssh_target, ssh_options, error) - error is None on success
+	"""
+	ssh_user = ssh_user or nextcloud_user
+	
+	# With a Cloudflare Service Token, connect through the persistent local tunnel of this host
+	if use_service_token and cf_client_id and cf_client_secret:
+		port, error = ensure_tunnel(ssh_host, cf_client_id, cf_client_secret, verify=verify_tunnel)
+		if error:
+			return None, None, error
+		
+		ssh_options = get_ssh_options(ssh_key_path=ssh_key_path, port=port, host_key_alias=ssh_host)
+		return f"{ssh_user}@{TUNNEL_HOST}", ssh_options, None
+	
+	ssh_options = get_ssh_options(ssh_key_path=ssh_key_path)
+	ssh_target = f"{ssh_user}@{ssh_host}"
+	
+	return ssh_target, ssh_options, None
+
+
+def _get_ssh_reconnect(ssh_host, ssh_user, nextcloud_user, ssh_key_path=None, use_service_token=False, cf_client_id=None, cf_client_secret=None):
+	"""
+	Reconnect callable for run_ssh_command (same arguments as _get_ssh_connection)
+	
+	Only connections through a Cloudflare tunnel need one: after an SSH connection error
+	the tunnel is checked with a local connect and restarted if it is broken.
+	
+	Returns:
+		callable: Returns (ssh_target, ssh_options), or None if the tunnel cannot be used - None for direct SSH
+	"""
+	if not (use_service_token and cf_client_id and cf_client_secret):
+		return None
+	
+	def reconnect():
+		ssh_target, ssh_options, error = _get_ssh_connection(
+			ssh_host, ssh_user, nextcloud_user, ssh_key_path,
+			use_service_token, cf_client_id, cf_client_secret, verify_tunnel=True
+		)
+		return None if error else (ssh_target, ssh_options)
+	return reconnect
+
+
 def _create_via_ssh_occ(ssh_host, ssh_user, nextcloud_user, folder_path, nextcloud_url, nextcloud_path=None, ssh_key_path=None, occ_user="www-data", use_service_token=False, cf_client_id=None, cf_client_secret=None):
 	"""
 	Create folder using SSH + Nextcloud OCC command (FASTEST method)
@@ -67,62 +247,27 @@ def _create_via_ssh_occ(ssh_host, ssh_user, nextcloud_user, folder_path, nextclo
 		
 		frappe.logger().info(f"Creating folder via SSH+OCC: {full_path} on {ssh_host}")
 		
-		# Build SSH command
-		ssh_options = []
-		
-		# Add SSH key if provided
-		if ssh_key_path and os.path.exists(ssh_key_path):
-			ssh_options.extend(['-i', ssh_key_path])
+		ssh_target, ssh_options, error = _get_ssh_connection(
+			ssh_host, ssh_user, nextcloud_user, ssh_key_path,
+			use_service_token, cf_client_id, cf_client_secret
+		)
+		if error:
+			return {
+				"success": False,
+				"error": error
+			}
 		
-		# Add Cloudflare Service Token ProxyCommand if enabled
-		if use_service_token and cf_client_id and cf_client_secret:
-			# Check if cloudflared is available
-			try:
-				cloudflared_check = subprocess.run(
-					['which', 'cloudflared'],
-					capture_output=True,
-					text=True,
-					timeout=2
-				)
-				if cloudflared_check.returncode != 0:
-					frappe.logger().error("cloudflared not found in PATH. Service Token authentication requires cloudflared to be installed.")
-					return {
-						"success": False,
-						"error": "cloudflared is not installed. Please install cloudflared or use IP-based bypass instead."
-					}
-			except Exception as e:
-				frappe.logger().warning(f"Could not check for cloudflared: {str(e)}. Proceeding anyway...")
-			
-			# Use cloudflared as ProxyCommand for Service Token authentication
-			proxy_cmd = (
-				f"cloudflared access ssh "
-				f"--hostname {ssh_host} "
-				f"--id {cf_client_id} "
-				f"--secret {cf_client_secret}"
-			)
-			ssh_options.extend(['-o', f'ProxyCommand={proxy_cmd}'])
-			frappe.logger().info(f"Using Cloudflare Service Token for SSH connection via cloudflared")
-		else:
-			# Standard SSH options (for IP-based bypass or direct connection)
-			ssh_options.extend([
-				'-o', 'StrictHostKeyChecking=no',  # Accept new host keys
-				'-o', 'UserKnownHostsFile=/dev/null',  # Don't save host keys
-				'-o', 'ConnectTimeout=10',  # 10 second connection timeout
-				'-o', 'BatchMode=yes'  # Don't prompt for password
-			])
-		
-		# Build full SSH command
-		ssh_target = f"{ssh_user}@{ssh_host}" if ssh_user else f"{nextcloud_user}@{ssh_host}"
-		ssh_cmd = ['ssh'] + ssh_options + [ssh_target, occ_cmd]
-		
-		# Execute SSH command
+		# Execute over the pooled SSH connection (handshake only paid when no master is open)
 		try:
-			result = subprocess.run(
-				ssh_cmd,
-				capture_output=True,
-				text=True,
-				timeout=10,  # 10 second timeout for the whole operation
-				check=False  # Don't raise exception on non-zero exit
+			result = run_ssh_command(
+				ssh_target,
+				occ_cmd,
+				ssh_options,
+				timeout=SSH_COMMAND_TIMEOUT,  # Timeout for the command itself
+				reconnect=_get_ssh_reconnect(
+					ssh_host, ssh_user, nextcloud_user, ssh_key_path,
+					use_service_token, cf_client_id, cf_client_secret
+				)
 			)
 			
 			elapsed = time.time() - start_time
@@ -138,7 +283,8 @@ def _create_via_ssh_occ(ssh_host, ssh_user, nextcloud_user, folder_path, nextclo
 					"success": True,
 					"folder_path": f"{nextcloud_url}/apps/files/?dir={encoded_display_path}",
 					"webdav_path": display_path,
-					"message": f"Folder created successfully via SSH+OCC in {elapsed:.2f}s"
+					"message": f"Folder created successfully via SSH+OCC in {elapsed:.2f}s",
+					"backend": "SSH+OCC"
 				}
 			else:
 				error_output = result.stderr or result.stdout
@@ -147,12 +293,12 @@ def _create_via_ssh_occ(ssh_host, ssh_user, nextcloud_user, folder_path, nextclo
 					"success": False,
 					"error": f"SSH+OCC command failed: {error_output}"
 				}
-				
+		
 		except subprocess.TimeoutExpired:
 			frappe.logger().error("SSH+OCC command timed out")
 			return {
 				"success": False,
-				"error": "SSH+OCC command timed out after 10 seconds"
+				"error": f"SSH+OCC command timed out after {SSH_COMMAND_TIMEOUT} seconds"
 			}
 		except Exception as e:
 			frappe.logger().error(f"SSH execution error: {str(e)}")
@@ -160,7 +306,7 @@ def _create_via_ssh_occ(ssh_host, ssh_user, nextcloud_user, folder_path, nextclo
 				"success": False,
 				"error": f"SSH execution error: {str(e)}"
 			}
-		
+	
 	except Exception as e:
 		frappe.logger().error(f"SSH+OCC error: {str(e)}")
 		return {
@@ -169,6 +315,139 @@ def _create_via_ssh_occ(ssh_host, ssh_user, nextcloud_user, folder_path, nextclo
 		}
 
 
+# PHP run on the Nextcloud server to create many folders with a single bootstrap.
+# Paths are passed base64-encoded JSON, one JSON result line is printed per path.
+_OCC_BATCH_SCRIPT = r"""<?php
+require_once 'lib/base.php';
+$user = base64_decode('%(user)s');
+$paths = json_decode(base64_decode('%(paths)s'), true);
+\OC_Util::setupFS($user);
+$userFolder = \OC::$server->getRootFolder()->getUserFolder($user);
+foreach ($paths as $path) {
+	try {
+		$folder = $userFolder;
+		foreach (array_filter(explode('/', $path), 'strlen') as $segment) {
+			$folder = $folder->nodeExists($segment) ? $folder->get($segment) : $folder->newFolder($segment);
+		}
+		echo json_encode(array('path' => $path, 'ok' => true, 'id' => $folder->getId())), "\n";
+	} catch (\Throwable $e) {
+		echo json_encode(array('path' => $path, 'ok' => false, 'error' => $e->getMessage())), "\n";
+	}
+}
+"""
+
+
+def _create_via_ssh_occ_batch(ssh_host, ssh_user, nextcloud_user, folder_paths, nextcloud_url, nextcloud_path=None, ssh_key_path=None, occ_user="www-data", use_service_token=False, cf_client_id=None, cf_client_secret=None, timeout=SSH_BATCH_TIMEOUT):
+	"""
+	Create many folders in one SSH round trip and one Nextcloud PHP bootstrap
+	Missing parent folders are created along the way
+	
+	Args:
+		folder_paths: List of folder paths relative to the user's root
+		timeout: Timeout for the whole batch in seconds
+	
+	Returns:
+		dict: {"success": bool, "results": {folder_path: result dict}, "error": str}
+	"""
+	import base64
+	import json
+	import time
+	start_time = time.time()
+	
+	def _error_for_all(error):
+		return {
+			"success": False,
+			"error": error,
+			"results": {path: {"success": False, "error": error} for path in folder_paths}
+		}
+	
+	try:
+		ssh_target, ssh_options, error = _get_ssh_connection(
+			ssh_host, ssh_user, nextcloud_user, ssh_key_path,
+			use_service_token, cf_client_id, cf_client_secret
+		)
+		if error:
+			return _error_for_all(error)
+		
+		script = _OCC_BATCH_SCRIPT % {
+			"user": base64.b64encode(nextcloud_user.encode("utf-8")).decode("ascii"),
+			"paths": base64.b64encode(json.dumps(folder_paths).encode("utf-8")).decode("ascii")
+		}
+		
+		# The script is read from stdin, so it must run from the Nextcloud directory
+		if nextcloud_path:
+			php_cmd = f"cd {nextcloud_path} && sudo -u {occ_user} php"
+		else:
+			php_cmd = f"sudo -u {occ_user} php"
+		
+		frappe.logger().info(f"Creating {len(folder_paths)} folders via batched SSH+OCC on {ssh_host}")
+		
+		try:
+			result = run_ssh_command(
+				ssh_target, php_cmd, ssh_options, timeout=timeout, input=script,
+				reconnect=_get_ssh_reconnect(
+					ssh_host, ssh_user, nextcloud_user, ssh_key_path,
+					use_service_token, cf_client_id, cf_client_secret
+				)
+			)
+		except subprocess.TimeoutExpired:
+			frappe.logger().error("Batched SSH+OCC command timed out")
+			return _error_for_all(f"Batched SSH+OCC command timed out after {timeout} seconds")
+		
+		elapsed = time.time() - start_time
+		
+		# Collect per-path results (whatever was printed before a possible fatal error)
+		results = {}
+		for line in (result.stdout or "").splitlines():
+			try:
+				entry = json.loads(line)
+			except ValueError:
+				continue
+			
+			path = entry.get("path")
+			if entry.get("ok"):
+				path_parts = [p for p in path.split('/') if p]
+				display_path = "/" + "/".join(path_parts)
+				encoded_display_path = quote(display_path, safe='')
+				results[path] = {
+					"success": True,
+					"folder_path": f"{nextcloud_url}/apps/files/?dir={encoded_display_path}",
+					"webdav_path": display_path,
+					"file_id": entry.get("id"),
+					"message": f"Folder created successfully via batched SSH+OCC in {elapsed:.2f}s",
+					"backend": "SSH+OCC"
+				}
+			else:
+				results[path] = {
+					"success": False,
+					"error": f"SSH+OCC batch error: {entry.get('error')}"
+				}
+		
+		error_output = None
+		if result.returncode != 0:
+			error_output = (result.stderr or result.stdout or "").strip()
+			frappe.logger().error(f"Batched SSH+OCC failed: {error_output}")
+		
+		for path in folder_paths:
+			if path not in results:
+				results[path] = {
+					"success": False,
+					"error": f"SSH+OCC command failed: {error_output or 'no result returned'}"
+				}
+		
+		frappe.logger().info(f"Batched SSH+OCC finished {len(folder_paths)} folders in {elapsed:.2f}s")
+		
+		return {
+			"success": all(r["success"] for r in results.values()),
+			"results": results,
+			"error": error_output
+		}
+	
+	except Exception as e:
+		frappe.logger().error(f"Batched SSH+OCC error: {str(e)}")
+		return _error_for_all(f"SSH+OCC error: {str(e)}")
+
+
 def _create_via_rest_api(nextcloud_url, username, password, folder_path):
 	"""
 	Create folder using Nextcloud REST API (FASTER than WebDAV)
@@ -192,19 +471,20 @@ def _create_via_rest_api(nextcloud_url, username, password, folder_path):
 		
 		frappe.logger().info(f"Creating folder via REST API: {api_url}")
 		
-		# Make POST request to create folder
-		response = requests.post(
+		# Make POST request to create folder (over the shared pooled session)
+		session = get_webdav_session(nextcloud_url, username, password)
+		response = session.post(
 			api_url,
-			auth=HTTPBasicAuth(username, password),
 			headers={
 				"OCS-APIRequest": "true",
 				"Content-Type": "application/json"
 			},
 			json={},  # Empty body for folder creation
-			timeout=10  # Much shorter timeout - REST API is faster
+			timeout=OCS_TIMEOUT  # Much shorter timeout - REST API is faster
 		)
 		
 		elapsed = time.time() - start_time
+		observe("remote", elapsed, "OCS")
 		frappe.logger().info(f"REST API response: {response.status_code} ({elapsed:.2f}s)")
 		
 		# REST API returns 201 for created, 200 for success
@@ -216,7 +496,8 @@ def _create_via_rest_api(nextcloud_url, username, password, folder_path):
 				"success": True,
 				"folder_path": f"{nextcloud_url}/apps/files/?dir={encoded_display_path}",
 				"webdav_path": display_path,
-				"message": "Folder created successfully via REST API"
+				"message": "Folder created successfully via REST API",
+				"backend": "OCS"
 			}
 		else:
 			# If REST API doesn't work, return error to try WebDAV
@@ -230,7 +511,7 @@ def _create_via_rest_api(nextcloud_url, username, password, folder_path):
 				"success": False,
 				"error": f"REST API HTTP {response.status_code}: {error_msg}"
 			}
-			
+	
 	except requests.exceptions.Timeout:
 		return {
 			"success": False,
@@ -244,10 +525,160 @@ def _create_via_rest_api(nextcloud_url, username, password, folder_path):
 		}
 
 
+def _get_webdav_url(nextcloud_url, username, path_parts):
+	"""Build the WebDAV collection URL for a folder (path parts are URL-encoded)"""
+	encoded_path = "/".join(quote(part, safe='') for part in path_parts)
+	return f"{nextcloud_url.rstrip('/')}/remote.php/dav/files/{username}/{encoded_path}/"
+
+
+def _mkcol(session, webdav_url, timeout=WEBDAV_TIMEOUT):
+	"""Send a single MKCOL request"""
+	return session.request(
+		"MKCOL",
+		webdav_url,
+		headers={
+			"Content-Type": "application/xml"
+		},
+		timeout=timeout,  # Reduced timeout - should be faster
+		stream=False,
+		verify=True
+	)
+
+
+def _propfind(session, webdav_url, depth=0, props=("getetag",), timeout=WEBDAV_TIMEOUT, headers=None, stream=False):
+	"""
+	Send a PROPFIND request for the given DAV: properties (oc:fileid and oc:size are also understood)
+	
+	Args:
+		stream: Leave the body unread, for iter_propfind
+	
+	Returns:
+		requests.Response: 207 Multi-Status on success
+	"""
+	prop_xml = "".join(f"<oc:{p}/>" if p in ("fileid", "size") else f"<d:{p}/>" for p in props)
+	return session.request(
+		"PROPFIND",
+		webdav_url,
+		headers=dict(headers or {}, **{"Depth": str(depth), "Content-Type": "application/xml"}),
+		data=(
+			'<?xml version="1.0"?><d:propfind xmlns:d="DAV:" xmlns:oc="http://owncloud.org/ns">'
+			f"<d:prop>{prop_xml}</d:prop></d:propfind>"
+		),
+		timeout=timeout,
+		stream=stream
+	)
+
+
+def parse_propfind(content, webdav_url):
+	"""
+	Parse a PROPFIND Multi-Status response
+	
+	Returns:
+		dict: {relative name: {property: text, "is_folder": bool}}, "" being the requested resource itself
+	"""
+	base = unquote(urlparse(webdav_url).path).rstrip("/")
+	return dict(_parse_response(item, base) for item in ET.fromstring(content).iter(f"{DAV_NS}response"))
+
+
+def _parse_response(item, base):
+	"""Name (relative to base) and properties of one <d:response> element"""
+	href = unquote(urlparse(item.findtext(f"{DAV_NS}href") or "").path).rstrip("/")
+	name = href[len(base):].lstrip("/") if href.startswith(base) else href.rsplit("/", 1)[-1]
+	
+	entry = {"is_folder": item.find(f".//{DAV_NS}resourcetype/{DAV_NS}collection") is not None}
+	for prop in item.iterfind(f"{DAV_NS}propstat/{DAV_NS}prop/*"):
+		if len(prop) == 0 and prop.text is not None:
+			entry[prop.tag.split("}", 1)[1]] = prop.text
+	return name, entry
+
+
+def iter_propfind(response, webdav_url, chunk_size=64 * 1024):
+	"""
+	Parse a streamed PROPFIND Multi-Status response entry by entry
+	
+	The body is fed to an incremental parser as it arrives and every <d:response> is
+	dropped once yielded, so a listing of tens of thousands of entries never sits in
+	memory as a whole (neither as text nor as a tree).
+	
+	Yields:
+		tuple: (relative name, {property: text, "is_folder": bool}), "" being the requested resource itself
+	"""
+	base = unquote(urlparse(webdav_url).path).rstrip("/")
+	parser = ET.XMLPullParser(events=("start", "end"))
+	root = None
+	for chunk in response.iter_content(chunk_size):
+		parser.feed(chunk)
+		for event, element in parser.read_events():
+			if event == "start":
+				if root is None:
+					root = element
+				continue
+			if element.tag == f"{DAV_NS}response":
+				yield _parse_response(element, base)
+				root.remove(element)
+	parser.close()
+
+
+def ensure_folder_tree(nextcloud_url, username, password, folder_path, force=False):
+	"""
+	Create a folder and all its ancestors that are not known to exist
+	
+	Folders are created top-down and remembered in the folder registry, so a
+	folder that was created (or verified) once never costs a request again.
+	
+	Args:
+		folder_path: Folder to create, including ancestors (e.g. "ALKHORA/استيرادية 2027")
+		force: Ignore the registry and verify every level (used after a 409 from Nextcloud)
+	
+	Returns:
+		dict: {"success": bool, "created": list, "error": str}
+	"""
+	path_parts = [p for p in folder_path.split('/') if p]
+	levels = get_ancestor_paths(folder_path) + ["/".join(path_parts)]
+	
+	if force:
+		forget_known_folders(nextcloud_url, username, *levels)
+	
+	session = get_webdav_session(nextcloud_url, username, password)
+	created = []
+	
+	try:
+		for level in levels:
+			if is_known_folder(nextcloud_url, username, level):
+				continue
+			
+			response = _mkcol(session, _get_webdav_url(nextcloud_url, username, level.split('/')))
+			
+			# 201 = created, 405 = already exists
+			if response.status_code not in [201, 405]:
+				return {
+					"success": False,
+					"error": f"HTTP {response.status_code} while creating {level}",
+					"status_code": response.status_code,
+					"created": created
+				}
+			
+			if response.status_code == 201:
+				created.append(level)
+			mark_known_folders(nextcloud_url, username, level)
+		
+		return {
+			"success": True,
+			"created": created
+		}
+	
+	except requests.exceptions.RequestException as e:
+		return {
+			"success": False,
+			"error": f"Network error: {str(e)}",
+			"created": created
+		}
+
+
 def _create_via_webdav_optimized(nextcloud_url, username, password, folder_path):
 	"""
 	Create folder using optimized WebDAV with connection pooling (FASTER)
-	Uses requests.Session for connection reuse and better performance
+	Uses the process-wide pooled session so the TCP/TLS handshake is paid once per worker
 	"""
 	try:
 		import time
@@ -259,34 +690,32 @@ def _create_via_webdav_optimized(nextcloud_url, username, password, folder_path)
 		# Split path into components
 		path_parts = [p for p in folder_path.split('/') if p]
 		
-		# OPTIMIZED: Parent folders already exist, so only create the final folder
-		encoded_parts = [quote(part, safe='') for part in path_parts]
-		encoded_path = "/".join(encoded_parts)
-		webdav_url = f"{nextcloud_url}/remote.php/dav/files/{username}/{encoded_path}/"
+		# OPTIMIZED: Parent folders normally exist, so only create the final folder
+		webdav_url = _get_webdav_url(nextcloud_url, username, path_parts)
 		
 		frappe.logger().info(f"Creating Nextcloud folder via optimized WebDAV: {webdav_url}")
 		
-		# Use Session for connection pooling (faster)
-		session = requests.Session()
-		session.auth = HTTPBasicAuth(username, password)
+		# Use the shared pooled session (keep-alive connection is reused across folders)
+		session = get_webdav_session(nextcloud_url, username, password)
 		
 		try:
 			# Single request to create the final folder
-			response = session.request(
-				"MKCOL",
-				webdav_url,
-				headers={
-					"Content-Type": "application/xml",
-					"Connection": "keep-alive"  # Keep connection alive for faster subsequent requests
-				},
-				timeout=30,  # Reduced timeout - should be faster
-				stream=False,
-				verify=True
-			)
+			response = _mkcol(session, webdav_url)
 			
 			create_time = time.time() - start_time
 			frappe.logger().info(f"MKCOL response: {response.status_code} ({create_time:.2f}s)")
 			
+			# Parent missing (e.g. first folder of a new year): create the ancestors once and retry
+			if response.status_code == 409 and len(path_parts) > 1:
+				parent_path = "/".join(path_parts[:-1])
+				frappe.logger().info(f"Parent folder missing, creating ancestors of {folder_path}")
+				tree_result = ensure_folder_tree(nextcloud_url, username, password, parent_path, force=True)
+				if tree_result.get("success"):
+					response = _mkcol(session, webdav_url)
+			
+			# Includes the TCP/TLS handshake when the pooled session had no idle connection
+			observe("remote", time.time() - start_time, "WebDAV")
+			
 			# Check if folder was created successfully or already exists
 			if response.status_code not in [201, 405, 207]:
 				error_msg = response.text
@@ -305,6 +734,10 @@ def _create_via_webdav_optimized(nextcloud_url, username, password, folder_path)
 					"status_code": response.status_code
 				}
 			
+			# The parent obviously exists now
+			if len(path_parts) > 1:
+				mark_known_folders(nextcloud_url, username, "/".join(path_parts[:-1]))
+			
 			total_time = time.time() - start_time
 			frappe.logger().info(f"Folder created via optimized WebDAV in {total_time:.2f}s")
 			
@@ -316,9 +749,11 @@ def _create_via_webdav_optimized(nextcloud_url, username, password, folder_path)
 				"success": True,
 				"folder_path": f"{nextcloud_url}/apps/files/?dir={encoded_display_path}",
 				"webdav_path": display_path,
-				"message": "Folder created successfully via optimized WebDAV"
+				"message": "Folder created successfully via optimized WebDAV",
+				"file_id": response.headers.get("OC-FileId"),
+				"backend": "WebDAV"
 			}
-			
+		
 		except requests.exceptions.Timeout:
 			frappe.logger().error(f"Timeout creating folder: {webdav_url}")
 			return {
@@ -331,9 +766,7 @@ def _create_via_webdav_optimized(nextcloud_url, username, password, folder_path)
 				"success": False,
 				"error": f"Connection error: Unable to reach Nextcloud server. Error: {str(e)}"
 			}
-		finally:
-			session.close()
-			
+	
 	except requests.exceptions.RequestException as e:
 		return {
 			"success": False,
@@ -368,10 +801,10 @@ def test_nextcloud_connection(nextcloud_url, username, password):
 		frappe.logger().info(f"Testing Nextcloud connection: {webdav_url}")
 		
 		try:
-			response = requests.request(
+			session = get_webdav_session(nextcloud_url, username, password)
+			response = session.request(
 				"PROPFIND",
 				webdav_url,
-				auth=HTTPBasicAuth(username, password),
 				headers={
 					"Depth": "0"  # Only get info about the root directory
 				},
@@ -410,7 +843,7 @@ def test_nextcloud_connection(nextcloud_url, username, password):
 					"error": f"Unexpected response from Nextcloud server: HTTP {response.status_code} - {response.text[:200]}",
 					"status_code": response.status_code
 				}
-				
+		
 		except requests.exceptions.Timeout:
 			return {
 				"success": False,
@@ -426,7 +859,7 @@ def test_nextcloud_connection(nextcloud_url, username, password):
 				"success": False,
 				"error": f"SSL/TLS error: {str(e)}. Check if the Nextcloud URL uses HTTPS correctly."
 			}
-			
+	
 	except requests.exceptions.RequestException as e:
 		return {
 			"success": False,
@@ -1,32 +1,175 @@
 // Add button to Opportunity form for manual Nextcloud folder creation
 frappe.ui.form.on('Opportunity', {
 	refresh: function(frm) {
-		// Only show button if opportunity is saved (has a name)
+		// Only show buttons if opportunity is saved (has a name)
 		if (frm.doc.name && !frm.doc.__islocal) {
-			// Add custom button
-			frm.add_custom_button(__('Create Nextcloud Folder'), function() {
-				create_nextcloud_folder(frm);
-			}, __('Actions'));
+			render_nextcloud_folder(frm);
+		}
+	}
+});
+
+// Listen for realtime notifications - registered once per page, not on every refresh.
+// The server sends them to the Opportunity's document room, so only forms showing
+// that Opportunity receive them.
+if (!window.nextcloud_folder_listener) {
+	window.nextcloud_folder_listener = true;
+	frappe.realtime.on('nextcloud_folder_created', function(data) {
+		var frm = get_open_opportunity_form(data.opportunity);
+		if (!frm) {
+			return;
 		}
 		
-		// Listen for realtime notifications
-		frappe.realtime.on('nextcloud_folder_created', function(data) {
-			if (data.success) {
-				frappe.show_alert({
-					message: __('Nextcloud folder created successfully'),
-					indicator: 'green'
-				}, 5);
-				// Reload the form to show the new comment
-				frm.reload_doc();
+		if (data.success) {
+			frappe.show_alert({
+				message: __('Nextcloud folder created successfully'),
+				indicator: 'green'
+			}, 5);
+			// Patch the link into the form; the comment reaches the timeline by itself
+			set_nextcloud_folder(frm, data.folder_path);
+		} else {
+			frappe.show_alert({
+				message: data.error || __('Failed to create folder'),
+				indicator: 'red'
+			}, 10);
+		}
+	});
+}
+
+function get_open_opportunity_form(opportunity_name) {
+	var frm = window.cur_frm;
+	if (frm && frm.doctype === 'Opportunity' && frm.docname === opportunity_name) {
+		return frm;
+	}
+	return null;
+}
+
+function set_nextcloud_folder(frm, folder_url) {
+	if (!folder_url) {
+		return;
+	}
+	frm.doc.__onload = frm.doc.__onload || {};
+	frm.doc.__onload.nextcloud_folder = { folder_url: folder_url };
+	render_nextcloud_folder(frm);
+}
+
+function render_nextcloud_folder(frm) {
+	var folder = (frm.doc.__onload || {}).nextcloud_folder;
+	
+	frm.remove_custom_button(__('Create Nextcloud Folder'), __('Actions'));
+	frm.remove_custom_button(__('Open Nextcloud Folder'));
+	frm.remove_custom_button(__('Copy Share Link'), __('Actions'));
+	
+	if (folder && folder.folder_url) {
+		frm.add_custom_button(__('Open Nextcloud Folder'), function() {
+			window.open(folder.folder_url, '_blank');
+		});
+		frm.add_custom_button(__('Copy Share Link'), function() {
+			copy_nextcloud_share_link(frm);
+		}, __('Actions'));
+		load_nextcloud_files(frm, {cached_only: true});
+	} else {
+		frm.add_custom_button(__('Create Nextcloud Folder'), function() {
+			create_nextcloud_folder(frm);
+		}, __('Actions'));
+	}
+}
+
+// Show the files of the folder on the form dashboard. A form load only shows the
+// listing the server has cached (no Nextcloud request); the folder is listed when the
+// user asks for it, and the server revalidates its cache with the folder ETag.
+function load_nextcloud_files(frm, options) {
+	var opportunity_name = frm.doc.name;
+	options = options || {};
+	frappe.call({
+		method: 'nextcloud_integration.nextcloud_integration.folder_listing.get_opportunity_folder_listing',
+		args: {
+			opportunity_name: opportunity_name,
+			refresh: options.refresh ? 1 : 0,
+			cached_only: options.cached_only ? 1 : 0
+		},
+		callback: function(r) {
+			// The user may have moved on to another Opportunity meanwhile
+			if (frm.docname === opportunity_name) {
+				render_nextcloud_files(frm, r.message || {});
+			}
+		}
+	});
+}
+
+function render_nextcloud_files(frm, listing) {
+	if (frm.nextcloud_files_section) {
+		frm.nextcloud_files_section.remove();
+	}
+	
+	var html;
+	if (!listing.success) {
+		html = '<div class="text-muted">' + frappe.utils.escape_html(listing.error || __('Could not load files')) + '</div>';
+	} else if (!listing.files) {
+		// Nothing cached yet: list the folder only when asked to
+		html = '<a class="text-muted nextcloud-files-refresh">' + __('Show files') + '</a>';
+	} else if (!listing.files.length) {
+		html = '<div class="text-muted">' + __('The folder is empty') + '</div>';
+	} else {
+		html = '<table class="table table-condensed"><tbody>' + listing.files.map(function(file) {
+			var name = frappe.utils.escape_html(file.name) + (file.is_folder ? '/' : '');
+			var link = file.url ? '<a href="' + frappe.utils.escape_html(file.url) + '" target="_blank" rel="noopener noreferrer">' + name + '</a>' : name;
+			return '<tr><td>' + link + '</td>'
+				+ '<td class="text-muted text-right">' + (file.is_folder ? '' : format_file_size(file.size)) + '</td>'
+				+ '<td class="text-muted text-right">' + (file.modified ? moment(new Date(file.modified)).fromNow() : '') + '</td></tr>';
+		}).join('') + '</tbody></table>';
+	}
+	if (!listing.success || listing.files) {
+		html += '<a class="text-muted small nextcloud-files-refresh">' + __('Refresh') + '</a>';
+	}
+	
+	frm.nextcloud_files_section = frm.dashboard.add_section(html, __('Nextcloud Files'));
+	frm.nextcloud_files_section.find('.nextcloud-files-refresh').on('click', function() {
+		load_nextcloud_files(frm, {refresh: true});
+	});
+	frm.dashboard.show();
+}
+
+function format_file_size(size) {
+	if (size === null || size === undefined) {
+		return '';
+	}
+	var units = ['B', 'KB', 'MB', 'GB'];
+	var unit = 0;
+	while (size >= 1024 && unit < units.length - 1) {
+		size = size / 1024;
+		unit++;
+	}
+	return (unit ? size.toFixed(1) : size) + ' ' + units[unit];
+}
+
+// The link is sent with the form when it exists; otherwise the server creates it once
+// and stores it, so every later copy is served without contacting Nextcloud
+function copy_nextcloud_share_link(frm) {
+	var folder = (frm.doc.__onload || {}).nextcloud_folder || {};
+	if (folder.share_url) {
+		frappe.utils.copy_to_clipboard(folder.share_url);
+		return;
+	}
+	
+	frappe.call({
+		method: 'nextcloud_integration.nextcloud_integration.share_links.get_opportunity_share_link',
+		args: {
+			opportunity_name: frm.doc.name
+		},
+		callback: function(r) {
+			var result = r.message || {};
+			if (result.success && result.share_url) {
+				folder.share_url = result.share_url;
+				frappe.utils.copy_to_clipboard(result.share_url);
 			} else {
 				frappe.show_alert({
-					message: data.error || __('Failed to create folder'),
+					message: result.error || __('Failed to create share link'),
 					indicator: 'red'
 				}, 10);
 			}
-		});
-	}
-});
+		}
+	});
+}
 
 function create_nextcloud_folder(frm) {
 	// Show immediate feedback - NO loading indicator
@@ -61,6 +204,13 @@ function create_nextcloud_folder(frm) {
 						message: response.message.error || __('Failed to start folder creation'),
 						indicator: 'red'
 					}, 10);
+				} else if (response.message && response.message.folder_path) {
+					// Folder already existed - no job was started
+					frappe.show_alert({
+						message: __('Nextcloud folder already exists'),
+						indicator: 'green'
+					}, 5);
+					set_nextcloud_folder(frm, response.message.folder_path);
 				}
 			} catch(e) {
 				// Ignore parse errors - job might still be queued
@@ -0,0 +1,73 @@
+import frappe
+
+# Dedicated RQ queues for folder work (configured under "workers" in common_site_config.json)
+FOLDER_QUEUE = "nextcloud"
+PRIORITY_FOLDER_QUEUE = "nextcloud_manual"
+
+# Queue used when the dedicated queues are not configured on this bench
+FALLBACK_QUEUE = "default"
+
+# Extra time on top of the backend timeouts for settings, comments and notifications (seconds)
+JOB_TIMEOUT_MARGIN = 30
+
+
+def _queue_configured(queue):
+	return queue in (frappe.conf.get("workers") or {})
+
+
+def get_folder_queue(priority=False):
+	"""
+	Get the queue for folder jobs
+	
+	Manual clicks go to their own priority lane, automatic jobs to the bulk queue,
+	so a burst of imports never delays a user waiting for their folder. Falls back
+	to the default queue when the dedicated queues have no workers configured.
+	"""
+	queue = PRIORITY_FOLDER_QUEUE if priority else FOLDER_QUEUE
+	if _queue_configured(queue):
+		return queue
+	
+	# Priority lane not configured: share the bulk queue if it exists
+	if priority and _queue_configured(FOLDER_QUEUE):
+		return FOLDER_QUEUE
+	return FALLBACK_QUEUE
+
+
+def get_job_timeout(nextcloud_config=None, batch=False):
+	"""
+	Get a real timeout for a folder job, derived from the backends' own timeouts
+	
+	SSH: opening the master connection and running the command, each possibly twice
+	(reconnect). WebDAV: MKCOL, the missing ancestors of the folder and the retried MKCOL.
+	A job fails over through all configured backends, so their budgets add up.
+	"""
+	from nextcloud_integration.hooks import _use_ssh
+	from nextcloud_integration.nextcloud_integration.folder_layout import get_layout_depth
+	from nextcloud_integration.nextcloud_integration.nextcloud_api import OCS_TIMEOUT, SSH_BATCH_TIMEOUT, SSH_COMMAND_TIMEOUT, WEBDAV_TIMEOUT
+	from nextcloud_integration.nextcloud_integration.ssh_pool import SSH_CONNECT_TIMEOUT
+	
+	# Parent levels of the Folder Layout + the folder itself + the retried MKCOL
+	depth = get_layout_depth(nextcloud_config) if nextcloud_config else 3
+	timeout = (depth + 1) * WEBDAV_TIMEOUT + JOB_TIMEOUT_MARGIN
+	
+	if nextcloud_config and _use_ssh(nextcloud_config):
+		command_timeout = SSH_BATCH_TIMEOUT if batch else SSH_COMMAND_TIMEOUT
+		timeout += 2 * (SSH_CONNECT_TIMEOUT + 5) + 2 * command_timeout
+	
+	if nextcloud_config and getattr(nextcloud_config, "use_rest_api", False):
+		timeout += OCS_TIMEOUT
+	
+	return timeout
+
+
+def enqueue_folder_job(method, job_name, nextcloud_config=None, priority=False, batch=False, **kwargs):
+	"""Enqueue a folder job on the dedicated queue with a bounded timeout"""
+	return frappe.enqueue(
+		method=method,
+		queue=get_folder_queue(priority=priority),
+		timeout=get_job_timeout(nextcloud_config, batch=batch),
+		job_name=job_name,
+		is_async=True,
+		at_front=priority,
+		**kwargs
+	)
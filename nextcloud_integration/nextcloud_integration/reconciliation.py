@@ -0,0 +1,245 @@
+import frappe
+import os
+import time
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+# Latest reconciliation report
+REPORT_KEY = "nextcloud_integration:reconciliation_report"
+
+# Set while a reconciliation runs
+RUNNING_KEY = "nextcloud_integration:reconciliation_running"
+RUNNING_TTL = 3600
+
+# Opportunities younger than this may still be waiting in the folder queue (minutes)
+GRACE_MINUTES = 15
+
+# Years of Opportunities checked by the scheduled run (this year and the previous one)
+DEFAULT_YEARS = 2
+
+# Timeout of one listing - a large year folder takes a while to stream (seconds)
+LISTING_TIMEOUT = 120
+
+# Stale folders named in the report and the error log entry of one run
+MAX_LOGGED_STALE = 200
+
+
+def get_opportunities(since, until):
+	"""
+	Get the Opportunities created in a period with their stored folder, if any (one query)
+	
+	Returns:
+		list: frappe._dict rows with name, creation, folder_path and target
+	"""
+	return frappe.db.sql("""
+		select opp.name, opp.creation, f.folder_path, f.target, f.name as folder_record
+		from `tabOpportunity` opp
+		left join `tabNextcloud Folder` f on f.name = opp.name
+		where opp.creation >= %(since)s
+			and opp.creation < %(until)s
+	""", {
+		"since": since,
+		"until": until
+	}, as_dict=True)
+
+
+def list_subfolders(nextcloud_config, password, folder_path):
+	"""
+	List the subfolders of a folder with one streamed Depth:1 PROPFIND
+	
+	Returns:
+		dict: {subfolder name: file id}, or None if the folder does not exist
+	"""
+	from nextcloud_integration.nextcloud_integration.nextcloud_api import _get_webdav_url, _propfind, get_webdav_session, iter_propfind
+	
+	session = get_webdav_session(nextcloud_config.nextcloud_url, nextcloud_config.username, password)
+	webdav_url = _get_webdav_url(nextcloud_config.nextcloud_url, nextcloud_config.username, [p for p in folder_path.split("/") if p])
+	response = _propfind(session, webdav_url, 1, props=("resourcetype", "fileid"), timeout=LISTING_TIMEOUT, stream=True)
+	try:
+		if response.status_code == 404:
+			return None
+		if response.status_code != 207:
+			raise Exception(f"HTTP {response.status_code} while listing {folder_path}")
+		return {
+			name: entry.get("fileid")
+			for name, entry in iter_propfind(response, webdav_url)
+			if name and entry["is_folder"]
+		}
+	finally:
+		response.close()
+
+
+def _plan(settings, rows):
+	"""
+	Group the expected folders by target and parent folder
+	
+	Stored folders are expected at their recorded path, all others where the Folder
+	Layout puts them on the target they are routed to.
+	
+	Returns:
+		dict: {(target name, parent path): (config, {folder name: row})}
+	"""
+	from nextcloud_integration.nextcloud_integration.folder_layout import get_folder_path
+	from nextcloud_integration.nextcloud_integration.targets import get_target_config, get_target_name, resolve_targets
+	
+	routed = resolve_targets(settings, [row.name for row in rows if not row.folder_record])
+	configs = {}
+	groups = {}
+	for row in rows:
+		if row.folder_record:
+			if row.target not in configs:
+				configs[row.target] = get_target_config(settings, row.target)
+			nextcloud_config = configs[row.target]
+			path = "/".join(p for p in (row.folder_path or "").split("/") if p)
+		else:
+			nextcloud_config = routed[row.name]
+			path = get_folder_path(settings, row.name, created=row.creation)
+		if not path:
+			continue
+		
+		parent, folder_name = os.path.dirname(path), os.path.basename(path)
+		key = (get_target_name(nextcloud_config), parent)
+		groups.setdefault(key, (nextcloud_config, {}))[1][folder_name] = row
+	return groups
+
+
+def reconcile_folders(years=DEFAULT_YEARS):
+	"""
+	Find Opportunities whose Nextcloud folder is missing, with one listing per parent folder
+	
+	Every year (or shard) folder is listed once with a streamed Depth:1 PROPFIND and the
+	expected folder names are diffed against it in one set operation. Opportunities
+	without folder are queued for the folder batch; folders that exist without a record
+	(e.g. the job died after creating them) are adopted. Recorded folders that are gone
+	are only reported, as they may have been deleted on purpose.
+	
+	Args:
+		years: Number of years of Opportunities to check, counting back from this year
+	
+	Returns:
+		dict: Report with checked, missing, adopted, stale and failed parent folders
+	"""
+	from nextcloud_integration.hooks import _get_settings_name
+	from nextcloud_integration.nextcloud_integration.folder_batcher import queue_new_opportunities
+	from nextcloud_integration.nextcloud_integration.folder_links import save_folder_link
+	from nextcloud_integration.nextcloud_integration.health_monitor import get_outage
+	from nextcloud_integration.nextcloud_integration.retry_queue import clear_give_up, get_backed_off
+	from nextcloud_integration.nextcloud_integration.settings_cache import get_secret
+	from nextcloud_integration.nextcloud_integration.targets import DEFAULT_TARGET
+	
+	settings_name = _get_settings_name()
+	if not settings_name:
+		return {"success": False, "error": "Nextcloud Settings not configured."}
+	
+	settings = frappe.get_cached_doc("Nextcloud Settings", settings_name)
+	if not settings.enabled:
+		return {"success": False, "error": "Nextcloud integration is disabled."}
+	
+	start_time = time.time()
+	since = datetime(datetime.now().year - max(int(years), 1) + 1, 1, 1)
+	until = datetime.now() - timedelta(minutes=GRACE_MINUTES)
+	rows = get_opportunities(since, until)
+	
+	missing, adopted, stale, failed = [], [], [], {}
+	listed = 0
+	for (target, parent), (nextcloud_config, expected) in _plan(settings, rows).items():
+		outage = get_outage(nextcloud_config)
+		if outage:
+			failed[f"{target}:{parent}"] = f"Nextcloud unreachable: {outage}"
+			continue
+		
+		try:
+			present = list_subfolders(nextcloud_config, get_secret(nextcloud_config, "password"), parent) or {}
+		except Exception as e:
+			failed[f"{target}:{parent}"] = str(e)
+			continue
+		listed += 1
+		
+		for folder_name in expected.keys() - present.keys():
+			row = expected[folder_name]
+			(stale if row.folder_record else missing).append(row.name)
+		
+		for folder_name in expected.keys() & present.keys():
+			row = expected[folder_name]
+			if row.folder_record:
+				continue
+			display_path = f"/{parent}/{folder_name}" if parent else f"/{folder_name}"
+			save_folder_link(row.name, {
+				"webdav_path": display_path,
+				"folder_path": f"{nextcloud_config.nextcloud_url}/apps/files/?dir={quote(display_path, safe='')}",
+				"file_id": present[folder_name]
+			}, target=None if target == DEFAULT_TARGET else target)
+			clear_give_up(row.name)
+			adopted.append(row.name)
+	
+	frappe.db.commit()
+	
+	# Opportunities whose folder job recently gave up are not queued again until their backoff ends
+	backed_off = get_backed_off(missing)
+	queued = [name for name in missing if name not in backed_off]
+	queue_new_opportunities(queued, created={row.name: row.creation for row in rows})
+	
+	report = {
+		"success": True,
+		"checked": len(rows),
+		"folders_listed": listed,
+		"missing": len(missing),
+		"backed_off": len(backed_off),
+		"adopted": len(adopted),
+		"stale": len(stale),
+		"stale_opportunities": stale[:MAX_LOGGED_STALE],
+		"failed": failed,
+		"elapsed": round(time.time() - start_time, 2),
+		"finished_at": time.time()
+	}
+	frappe.cache().set_value(REPORT_KEY, report)
+	frappe.logger().info(
+		f"Nextcloud reconciliation: {len(rows)} Opportunities checked in {listed} folders, "
+		f"{len(missing)} missing ({len(queued)} queued, {len(backed_off)} backed off after giving up), {len(adopted)} adopted, {len(stale)} stale, {len(failed)} folders failed"
+	)
+	if stale or failed:
+		lines = [f"Could not list {key}: {error}" for key, error in failed.items()]
+		lines += [f"Folder missing in Nextcloud for {name}" for name in stale[:MAX_LOGGED_STALE]]
+		if len(stale) > MAX_LOGGED_STALE:
+			lines.append(f"... and {len(stale) - MAX_LOGGED_STALE} more")
+		frappe.log_error(title="Nextcloud Reconciliation", message="\n".join(lines))
+	return report
+
+
+def run_reconciliation():
+	"""Scheduler job (hourly): reconcile the folders of this and last year's Opportunities"""
+	from nextcloud_integration.hooks import _get_settings_name
+	
+	settings_name = _get_settings_name()
+	if not settings_name:
+		return
+	
+	settings = frappe.get_cached_doc("Nextcloud Settings", settings_name)
+	if not settings.enabled or not getattr(settings, "reconcile_folders", False) or not settings.is_feature_enabled("auto_create"):
+		return
+	
+	cache = frappe.cache()
+	if not cache.set(cache.make_key(RUNNING_KEY), 1, nx=True, ex=RUNNING_TTL):
+		return
+	
+	try:
+		reconcile_folders()
+	except Exception as e:
+		frappe.log_error(
+			title="Nextcloud Reconciliation Error",
+			message=f"Error reconciling Nextcloud folders: {str(e)}"
+		)
+	finally:
+		cache.delete(cache.make_key(RUNNING_KEY))
+
+
+@frappe.whitelist()
+def get_reconciliation_report():
+	"""Latest reconciliation report (for diagnostics)"""
+	frappe.only_for("System Manager")
+	
+	cache = frappe.cache()
+	return {
+		"running": bool(cache.get(cache.make_key(RUNNING_KEY))),
+		"report": cache.get_value(REPORT_KEY)
+	}
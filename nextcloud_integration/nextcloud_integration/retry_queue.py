@@ -0,0 +1,154 @@
+import frappe
+import json
+import random
+import time
+
+# Redis sorted set of delayed folder jobs, scored by the time they are due
+DELAYED_JOBS_KEY = "nextcloud_integration:delayed_jobs"
+
+# Backoff: base delay doubled per attempt, capped (seconds)
+RETRY_BASE_DELAY = 30
+RETRY_MAX_DELAY = 1800
+
+# Maximum number of due jobs enqueued per scheduler tick
+MAX_ENQUEUE_PER_TICK = 500
+
+# Opportunities whose folder job failed for good: {name: {"count": give-ups in a row, "at": time}}
+GIVEN_UP_KEY = "nextcloud_integration:given_up"
+
+# Reconciliation leaves a given-up Opportunity alone this long, doubled per give-up in a row (seconds)
+GIVE_UP_BASE_BACKOFF = 3600
+GIVE_UP_MAX_BACKOFF = 7 * 24 * 3600
+
+
+def get_retry_delay(retry_count):
+	"""
+	Exponential backoff with jitter for a retry attempt
+	
+	Half of the delay is fixed and half random, so retries of a burst of failed
+	jobs spread out instead of hitting Nextcloud again at the same moment.
+	"""
+	delay = min(RETRY_BASE_DELAY * 2 ** retry_count, RETRY_MAX_DELAY)
+	return delay / 2 + random.uniform(0, delay / 2)
+
+
+def schedule_retry(opportunity_name, retry_count, delay, created=None):
+	"""Park a folder job until `delay` seconds from now (enqueued by the scheduler tick)"""
+	cache = frappe.cache()
+	member = json.dumps({"opportunity_name": opportunity_name, "retry_count": retry_count, "created": created}, sort_keys=True)
+	cache.zadd(cache.make_key(DELAYED_JOBS_KEY), {member: time.time() + delay})
+	frappe.logger().info(f"Scheduled Nextcloud folder job for {opportunity_name} (attempt {retry_count}) in {delay:.0f}s")
+
+
+def record_give_up(opportunity_name):
+	"""Remember that the folder job of an Opportunity failed with no retry left"""
+	cache = frappe.cache()
+	marker = cache.hget(GIVEN_UP_KEY, opportunity_name) or {}
+	cache.hset(GIVEN_UP_KEY, opportunity_name, {"count": marker.get("count", 0) + 1, "at": time.time()})
+
+
+def clear_give_up(opportunity_name):
+	"""Forget the give-ups of an Opportunity, e.g. once its folder exists"""
+	frappe.cache().hdel(GIVEN_UP_KEY, opportunity_name)
+
+
+def get_backed_off(opportunity_names):
+	"""
+	Opportunities whose folder job gave up recently enough to be left alone
+	
+	The wait starts at GIVE_UP_BASE_BACKOFF and doubles with every give-up in a row,
+	so an Opportunity that can never get a folder (e.g. a name Nextcloud rejects) is
+	not re-queued by every reconciliation run.
+	
+	Returns:
+		set: Names from opportunity_names to skip for now
+	"""
+	if not opportunity_names:
+		return set()
+	
+	# RedisWrapper.hgetall returns the field names as bytes
+	markers = {
+		k.decode() if isinstance(k, bytes) else k: v
+		for k, v in (frappe.cache().hgetall(GIVEN_UP_KEY) or {}).items()
+	}
+	now = time.time()
+	return {
+		name for name in opportunity_names
+		if name in markers
+		and now - markers[name]["at"] < min(GIVE_UP_BASE_BACKOFF * 2 ** (markers[name]["count"] - 1), GIVE_UP_MAX_BACKOFF)
+	}
+
+
+def get_delayed_job_count():
+	cache = frappe.cache()
+	return cache.zcard(cache.make_key(DELAYED_JOBS_KEY))
+
+
+def enqueue_due_retries():
+	"""
+	Scheduler job (every minute): move due delayed folder jobs to the queue
+	
+	Jobs are routed to their target first. Jobs for a target whose circuit breaker is
+	open stay parked; once its open period has elapsed a probe of that target decides
+	whether to resume. Jobs for a target that is down are parked again, so they do not
+	hold up the jobs of the other targets.
+	"""
+	from nextcloud_integration.hooks import _create_nextcloud_folder_background, _get_settings_name
+	from nextcloud_integration.nextcloud_integration.circuit_breaker import get_open_remaining, probe_if_due
+	from nextcloud_integration.nextcloud_integration.health_monitor import DOWN_RETRY_DELAY, get_outage
+	from nextcloud_integration.nextcloud_integration.queues import enqueue_folder_job
+	from nextcloud_integration.nextcloud_integration.targets import get_target_name, resolve_targets
+	
+	cache = frappe.cache()
+	key = cache.make_key(DELAYED_JOBS_KEY)
+	if not cache.zcard(key):
+		return
+	
+	settings_name = _get_settings_name()
+	if not settings_name:
+		return
+	
+	nextcloud_config = frappe.get_cached_doc("Nextcloud Settings", settings_name)
+	if not nextcloud_config.enabled:
+		return
+	
+	members = cache.zrangebyscore(key, 0, time.time(), start=0, num=MAX_ENQUEUE_PER_TICK)
+	if not members:
+		return
+	
+	jobs = [(member, json.loads(member)) for member in members]
+	targets = resolve_targets(nextcloud_config, list({job["opportunity_name"] for _, job in jobs}))
+	
+	# Delay before the next look at a target's jobs, None for a target that can be used
+	# (one probe and one health check per target and tick)
+	target_delays = {}
+	for target_config in targets.values():
+		target = get_target_name(target_config)
+		if target in target_delays:
+			continue
+		if not probe_if_due(target_config):
+			target_delays[target] = get_open_remaining(target_config) + get_retry_delay(0)
+		elif get_outage(target_config):
+			target_delays[target] = DOWN_RETRY_DELAY + get_retry_delay(0)
+		else:
+			target_delays[target] = None
+	
+	for member, job in jobs:
+		delay = target_delays[get_target_name(targets[job["opportunity_name"]])]
+		if delay is not None:
+			# xx: only if no other scheduler process took the job in the meantime
+			cache.zadd(key, {member: time.time() + delay}, xx=True)
+			continue
+		
+		# zrem returns 0 if another scheduler process already took this job
+		if not cache.zrem(key, member):
+			continue
+		
+		enqueue_folder_job(
+			_create_nextcloud_folder_background,
+			job_name=f"create_nextcloud_folder_{job['opportunity_name']}_retry_{job['retry_count']}",
+			nextcloud_config=nextcloud_config,
+			opportunity_name=job["opportunity_name"],
+			retry_count=job["retry_count"],
+			created=job.get("created")
+		)
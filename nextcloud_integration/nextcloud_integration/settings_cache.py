@@ -0,0 +1,71 @@
+import frappe
+
+from nextcloud_integration.nextcloud_integration.metrics import stage_timer
+
+# Site cache key for the resolved settings document name
+SETTINGS_NAME_KEY = "nextcloud_integration:settings_name"
+
+# Decrypted secrets kept in worker memory only, for the current version of the settings:
+# {(site, target): (settings modified, {fieldname: value})}
+_local_secrets = {}
+
+
+def get_settings_name():
+	"""
+	Get the Nextcloud Settings document name
+	
+	Resolved from the database once and then served from the site cache until
+	the settings are saved again.
+	"""
+	settings_name = frappe.cache().get_value(SETTINGS_NAME_KEY)
+	if settings_name:
+		return settings_name
+	
+	# Method 1: Try known document name first (most reliable)
+	if frappe.db.exists("Nextcloud Settings", "ck82qg4l2r"):
+		settings_name = "ck82qg4l2r"
+	# Method 2: Try Single DocType name
+	elif frappe.db.exists("Nextcloud Settings", "Nextcloud Settings"):
+		settings_name = "Nextcloud Settings"
+	# Method 3: Try to get any existing document
+	else:
+		existing = frappe.get_all("Nextcloud Settings", limit=1)
+		if existing:
+			settings_name = existing[0].name
+	
+	if settings_name:
+		frappe.cache().set_value(SETTINGS_NAME_KEY, settings_name)
+	return settings_name
+
+
+def get_secret(nextcloud_config, fieldname):
+	"""
+	Get a decrypted Password field of Nextcloud Settings
+	
+	Decrypted from the database once per worker process and kept in its memory only,
+	never in Redis. Only the version matching the settings' modified timestamp is kept:
+	a saved change drops the old values, even in workers that missed the cache clear.
+	"""
+	# Additional targets have their own password (see targets.TargetConfig)
+	local_key = (getattr(frappe.local, "site", None), getattr(nextcloud_config, "target_name", None) or "")
+	version = str(nextcloud_config.modified)
+	cached_version, values = _local_secrets.get(local_key) or (None, None)
+	if cached_version != version:
+		values = {}
+		_local_secrets[local_key] = (version, values)
+	
+	if fieldname not in values:
+		with stage_timer("secret_decrypt"):
+			values[fieldname] = nextcloud_config.get_password(fieldname, raise_exception=False) or ""
+	return values[fieldname]
+
+
+def clear_settings_cache():
+	"""Invalidate the cached settings name and this worker's secrets (called when Nextcloud Settings are saved)"""
+	# The document may have been cached under a legacy name that a save does not clear
+	settings_name = frappe.cache().get_value(SETTINGS_NAME_KEY)
+	if settings_name and settings_name != "Nextcloud Settings":
+		frappe.clear_document_cache("Nextcloud Settings", settings_name)
+	
+	frappe.cache().delete_value(SETTINGS_NAME_KEY)
+	_local_secrets.clear()
@@ -0,0 +1,328 @@
+import frappe
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from nextcloud_integration.nextcloud_integration.folder_links import FOLDER_DOCTYPE
+from nextcloud_integration.nextcloud_integration.targets import get_target_config
+
+# Share links per Opportunity (hash field = Opportunity name), filled from the Nextcloud Folder records
+SHARE_LINKS_KEY = "nextcloud_integration:share_links"
+
+# Redis list of Opportunities waiting for a share link
+PENDING_SHARES_KEY = "nextcloud_integration:pending_share_links"
+
+# Set while a share link job is queued or running, so only one is scheduled at a time
+SHARE_FLUSH_SCHEDULED_KEY = "nextcloud_integration:share_flush_scheduled"
+SHARE_FLUSH_TTL = 1800
+
+# Opportunities handled per round of the share link job, and OCS requests in flight
+SHARE_BATCH_SIZE = 100
+SHARE_CONCURRENCY = 8
+
+SHARES_API_PATH = "/ocs/v2.php/apps/files_sharing/api/v1/shares"
+SHARE_TYPE_PUBLIC_LINK = 3
+
+# Public link permissions per "Share Link Permissions" option
+SHARE_PERMISSIONS = {
+	"Read Only": 1,
+	"Allow Upload and Editing": 15,
+	"File Drop (Upload Only)": 4
+}
+
+
+def _ocs_data(response):
+	payload = response.json().get("ocs", {})
+	status = payload.get("meta", {}).get("statuscode")
+	if response.status_code != 200 or status not in (100, 200):
+		message = payload.get("meta", {}).get("message") or response.text[:200]
+		raise Exception(f"OCS HTTP {response.status_code}, status {status}: {message}")
+	return payload.get("data")
+
+
+def request_share_link(session, nextcloud_url, folder_path, permissions, expire_date=None):
+	"""
+	Get the public share link of a folder, creating it only if the folder has none yet
+	
+	Makes no frappe calls, so it can run in worker threads.
+	
+	Returns:
+		dict: {"success": bool, "share_id": str, "share_url": str, "file_id": str, "error": str}
+	"""
+	from nextcloud_integration.nextcloud_integration.nextcloud_api import OCS_TIMEOUT
+	
+	api_url = f"{nextcloud_url.rstrip('/')}{SHARES_API_PATH}"
+	headers = {"OCS-APIRequest": "true", "Accept": "application/json"}
+	try:
+		# A link created by hand (or by an earlier, interrupted run) is reused
+		existing = _ocs_data(session.get(
+			api_url,
+			params={"path": folder_path, "reshares": "true", "format": "json"},
+			headers=headers,
+			timeout=OCS_TIMEOUT
+		)) or []
+		share = next((s for s in existing if int(s.get("share_type", -1)) == SHARE_TYPE_PUBLIC_LINK), None)
+		
+		if not share:
+			data = {"path": folder_path, "shareType": SHARE_TYPE_PUBLIC_LINK, "permissions": permissions}
+			if expire_date:
+				data["expireDate"] = expire_date
+			share = _ocs_data(session.post(
+				api_url,
+				params={"format": "json"},
+				data=data,
+				headers=headers,
+				timeout=OCS_TIMEOUT
+			))
+		
+		return {
+			"success": True,
+			"share_id": str(share.get("id")),
+			"share_url": share.get("url"),
+			"file_id": str(share.get("file_source") or share.get("item_source") or "") or None
+		}
+	except Exception as e:
+		return {"success": False, "error": str(e)}
+
+
+def _link_from_record(nextcloud_url, record):
+	return {
+		"share_url": record.share_url,
+		"share_id": record.share_id,
+		"internal_url": f"{nextcloud_url.rstrip('/')}/f/{record.file_id}" if record.file_id else None
+	}
+
+
+def get_share_link(settings, opportunity_name, create=True):
+	"""
+	Get the share link of an Opportunity folder
+	
+	Served from the cache, then from the Nextcloud Folder record; Nextcloud is only
+	contacted when the folder has no link yet (on the target the folder was created on).
+	
+	Returns:
+		dict: {"success": bool, "share_url": str, "internal_url": str, "error": str}
+	"""
+	cache = frappe.cache()
+	link = cache.hget(SHARE_LINKS_KEY, opportunity_name)
+	if link:
+		return dict(link, success=True)
+	
+	record = frappe.db.get_value(FOLDER_DOCTYPE, opportunity_name, ["share_url", "share_id", "file_id", "target"], as_dict=True)
+	if not record:
+		return {"success": False, "error": f"No Nextcloud folder for Opportunity {opportunity_name} yet."}
+	
+	if not record.share_url:
+		if not create:
+			return {"success": False, "error": "No share link yet."}
+		result = create_share_links(settings, [opportunity_name]).get(opportunity_name)
+		if not result or not result.get("success"):
+			return result or {"success": False, "error": "Could not create share link."}
+		return result
+	
+	link = _link_from_record(get_target_config(settings, record.target).nextcloud_url, record)
+	cache.hset(SHARE_LINKS_KEY, opportunity_name, link)
+	return dict(link, success=True)
+
+
+def _get_expire_date(nextcloud_config):
+	days = getattr(nextcloud_config, "share_link_expiry_days", 0) or 0
+	return (date.today() + timedelta(days=days)).isoformat() if days > 0 else None
+
+
+def _create_target_share_links(nextcloud_config, records):
+	"""Create the share links of folders on one target, concurrently"""
+	from nextcloud_integration.nextcloud_integration.nextcloud_api import get_webdav_session
+	from nextcloud_integration.nextcloud_integration.settings_cache import get_secret
+	
+	session = get_webdav_session(nextcloud_config.nextcloud_url, nextcloud_config.username, get_secret(nextcloud_config, "password"))
+	permissions = SHARE_PERMISSIONS.get(getattr(nextcloud_config, "share_link_permissions", None) or "Read Only", 1)
+	expire_date = _get_expire_date(nextcloud_config)
+	
+	with ThreadPoolExecutor(max_workers=min(SHARE_CONCURRENCY, len(records))) as executor:
+		share_results = list(executor.map(
+			lambda record: request_share_link(session, nextcloud_config.nextcloud_url, record.folder_path, permissions, expire_date),
+			records
+		))
+	
+	cache = frappe.cache()
+	results = {}
+	for record, result in zip(records, share_results):
+		if not result.get("success"):
+			results[record.name] = result
+			frappe.logger().warning(f"Could not create share link for {record.name}: {result.get('error')}")
+			continue
+		
+		values = {"share_url": result["share_url"], "share_id": result["share_id"]}
+		if not record.file_id and result.get("file_id"):
+			values["file_id"] = result["file_id"]
+		frappe.db.set_value(FOLDER_DOCTYPE, record.name, values)
+		
+		record.update(values)
+		link = _link_from_record(nextcloud_config.nextcloud_url, record)
+		cache.hset(SHARE_LINKS_KEY, record.name, link)
+		results[record.name] = dict(link, success=True)
+	
+	return results
+
+
+def create_share_links(settings, opportunity_names):
+	"""
+	Create (or look up) the share links of many Opportunity folders at once
+	
+	Folders are loaded in one query, the OCS requests run concurrently over the pooled
+	session of each folder's target, and every link is stored on its Nextcloud Folder
+	record and cached.
+	
+	Returns:
+		dict: {opportunity_name: result dict}
+	"""
+	records = frappe.get_all(
+		FOLDER_DOCTYPE,
+		filters={"name": ["in", list(opportunity_names)]},
+		fields=["name", "folder_path", "file_id", "share_url", "share_id", "target"]
+	)
+	results = {
+		name: {"success": False, "error": f"No Nextcloud folder for Opportunity {name} yet."}
+		for name in opportunity_names
+	}
+	
+	pending = {}
+	for record in records:
+		nextcloud_url = get_target_config(settings, record.target).nextcloud_url
+		if record.share_url:
+			results[record.name] = dict(_link_from_record(nextcloud_url, record), success=True)
+		elif record.folder_path:
+			pending.setdefault(record.target or None, []).append(record)
+	
+	for target, target_records in pending.items():
+		results.update(_create_target_share_links(get_target_config(settings, target), target_records))
+	
+	return results
+
+
+def queue_share_links(opportunity_names):
+	"""Queue Opportunities for the share link job (one job handles all of them, in parallel)"""
+	if not opportunity_names:
+		return
+	
+	cache = frappe.cache()
+	cache.pipeline().rpush(cache.make_key(PENDING_SHARES_KEY), *opportunity_names).execute()
+	_schedule_share_flush()
+
+
+def _schedule_share_flush():
+	"""Enqueue the share link job unless one is already queued or running"""
+	cache = frappe.cache()
+	if not cache.set(cache.make_key(SHARE_FLUSH_SCHEDULED_KEY), 1, nx=True, ex=SHARE_FLUSH_TTL):
+		return
+	
+	frappe.enqueue(
+		method=flush_share_links,
+		queue="long",
+		timeout=SHARE_FLUSH_TTL,
+		job_name="nextcloud_share_links",
+		is_async=True
+	)
+
+
+def _pop_share_batch(max_size):
+	"""Atomically take up to max_size queued Opportunities off the list"""
+	cache = frappe.cache()
+	key = cache.make_key(PENDING_SHARES_KEY)
+	pipe = cache.pipeline()
+	pipe.lrange(key, 0, max_size - 1)
+	pipe.ltrim(key, max_size, -1)
+	items, _ = pipe.execute()
+	return list(dict.fromkeys(item.decode() if isinstance(item, bytes) else item for item in items))
+
+
+def flush_share_links():
+	"""Background job: create the share links of all queued Opportunities"""
+	from nextcloud_integration.hooks import _get_settings_name
+	
+	cache = frappe.cache()
+	try:
+		settings_name = _get_settings_name()
+		if not settings_name:
+			return
+		
+		settings = frappe.get_cached_doc("Nextcloud Settings", settings_name)
+		if not settings.enabled:
+			return
+		
+		while True:
+			names = _pop_share_batch(SHARE_BATCH_SIZE)
+			if not names:
+				break
+			
+			results = create_share_links(settings, names)
+			frappe.db.commit()
+			
+			failed = [name for name, result in results.items() if not result.get("success")]
+			frappe.logger().info(f"Created share links for {len(names) - len(failed)} of {len(names)} Opportunity folders")
+			if failed:
+				frappe.log_error(
+					title="Nextcloud Share Link Error",
+					message="\n".join(f"{name}: {results[name].get('error')}" for name in failed)
+				)
+	finally:
+		cache.delete(cache.make_key(SHARE_FLUSH_SCHEDULED_KEY))
+		
+		# Opportunities queued after the last pop but before the flag was cleared
+		if cache.llen(PENDING_SHARES_KEY):
+			_schedule_share_flush()
+
+
+@frappe.whitelist()
+def get_opportunity_share_link(opportunity_name):
+	"""
+	Get (or create) the share link of an Opportunity folder, for sending to suppliers
+	
+	Existing links can be looked up with read permission. Creating one publishes the
+	folder, so that needs write permission on the Opportunity.
+	
+	Returns:
+		dict: {"success": bool, "share_url": str, "internal_url": str, "error": str}
+	"""
+	from nextcloud_integration.hooks import _get_settings_name
+	
+	frappe.has_permission("Opportunity", "read", opportunity_name, throw=True)
+	
+	settings_name = _get_settings_name()
+	if not settings_name:
+		return {"success": False, "error": "Nextcloud Settings not configured."}
+	
+	settings = frappe.get_cached_doc("Nextcloud Settings", settings_name)
+	if not settings.enabled:
+		return {"success": False, "error": "Nextcloud integration is disabled."}
+	
+	can_create = frappe.has_permission("Opportunity", "write", opportunity_name)
+	result = get_share_link(settings, opportunity_name, create=can_create)
+	if not can_create and not result.get("success") and result.get("error") == "No share link yet.":
+		return {"success": False, "error": "You need write permission on this Opportunity to create a share link."}
+	return result
+
+
+@frappe.whitelist()
+def create_share_links_bulk(opportunity_names=None):
+	"""
+	Queue share link creation for many Opportunity folders
+	
+	Args:
+		opportunity_names: JSON list of Opportunities (default: every folder without a share link)
+	
+	Returns:
+		dict: {"success": bool, "queued": int}
+	"""
+	frappe.only_for("System Manager")
+	
+	if opportunity_names:
+		names = frappe.parse_json(opportunity_names)
+	else:
+		names = frappe.get_all(FOLDER_DOCTYPE, filters={"share_url": ["is", "not set"]}, pluck="name")
+	
+	queue_share_links(names)
+	return {
+		"success": True,
+		"queued": len(names)
+	}
@@ -0,0 +1,201 @@
+import frappe
+import fcntl
+import hashlib
+import os
+import subprocess
+import tempfile
+
+from nextcloud_integration.nextcloud_integration.metrics import stage_timer
+
+# Directory holding the OpenSSH ControlMaster sockets shared by all workers on this host
+SSH_CONTROL_DIR = os.path.join(tempfile.gettempdir(), "nextcloud_integration_ssh")
+
+# How long an idle master connection is kept open after the last command (seconds)
+SSH_CONTROL_PERSIST = 600
+
+# Timeout for establishing a new connection (seconds)
+SSH_CONNECT_TIMEOUT = 10
+
+# ssh exits with 255 when the connection itself failed (not the remote command)
+SSH_CONNECTION_ERROR = 255
+
+
+def get_ssh_options(ssh_key_path=None, proxy_command=None, port=None, host_key_alias=None):
+	"""
+	Build the base SSH options (key, proxy / host key handling)
+	
+	Args:
+		ssh_key_path: Path to SSH private key (optional)
+		proxy_command: ProxyCommand to reach the host (optional)
+		port: Port to connect to, e.g. the local end of a Cloudflare tunnel (optional)
+		host_key_alias: Host name the host key belongs to when connecting through a tunnel (optional)
+	
+	Returns:
+		list: SSH command line options
+	"""
+	ssh_options = []
+	
+	# Add SSH key if provided
+	if ssh_key_path and os.path.exists(ssh_key_path):
+		ssh_options.extend(['-i', ssh_key_path])
+	
+	if port:
+		ssh_options.extend(['-p', str(port)])
+	if host_key_alias:
+		ssh_options.extend(['-o', f'HostKeyAlias={host_key_alias}'])
+	
+	if proxy_command:
+		ssh_options.extend(['-o', f'ProxyCommand={proxy_command}'])
+	else:
+		# Standard SSH options (for IP-based bypass or direct connection)
+		ssh_options.extend([
+			'-o', 'StrictHostKeyChecking=no',  # Accept new host keys
+			'-o', 'UserKnownHostsFile=/dev/null',  # Don't save host keys
+			'-o', f'ConnectTimeout={SSH_CONNECT_TIMEOUT}',
+			'-o', 'BatchMode=yes'  # Don't prompt for password
+		])
+	
+	return ssh_options
+
+
+def get_control_path(ssh_target, ssh_options):
+	"""
+	Get the ControlMaster socket path for a target + option set
+	
+	The name is a short hash so it stays under the unix socket path limit and
+	different keys/proxies for the same host never share a master.
+	"""
+	digest = hashlib.sha1("\0".join([ssh_target] + list(ssh_options)).encode("utf-8")).hexdigest()[:16]
+	return os.path.join(SSH_CONTROL_DIR, f"{digest}.sock")
+
+
+def _ensure_control_dir():
+	os.makedirs(SSH_CONTROL_DIR, mode=0o700, exist_ok=True)
+
+
+def _open_master(ssh_target, ssh_options, control_path):
+	"""
+	Open the master connection for a target if there is none, timed as the "connect" stage
+	
+	Costs nothing while a master is open. Workers racing to open one wait for the first
+	on a lock file. If opening fails, the command connects on its own and reports the error.
+	"""
+	if os.path.exists(control_path):
+		return
+	
+	with open(f"{control_path}.lock", "w") as lock_file:
+		fcntl.flock(lock_file, fcntl.LOCK_EX)
+		try:
+			if os.path.exists(control_path):
+				return
+			
+			# -f -N with ControlPersist: ssh returns once authenticated and leaves the master running
+			with stage_timer("connect", "SSH+OCC"):
+				subprocess.run(
+					['ssh'] + ssh_options + [
+						'-o', 'ControlMaster=yes',
+						'-o', f'ControlPath={control_path}',
+						'-o', f'ControlPersist={SSH_CONTROL_PERSIST}',
+						'-o', 'ServerAliveInterval=30',
+						'-N', '-f',
+						ssh_target
+					],
+					# Not captured: the detached master would keep the pipes open
+					stdin=subprocess.DEVNULL,
+					stdout=subprocess.DEVNULL,
+					stderr=subprocess.DEVNULL,
+					timeout=SSH_CONNECT_TIMEOUT + 5,
+					check=False
+				)
+		except subprocess.TimeoutExpired:
+			frappe.logger().warning(f"Opening the SSH master connection to {ssh_target} timed out")
+		finally:
+			fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def close_ssh_master(ssh_target, ssh_options):
+	"""Ask the master connection for a target to exit (used to force a reconnect)"""
+	control_path = get_control_path(ssh_target, ssh_options)
+	if not os.path.exists(control_path):
+		return
+	
+	try:
+		subprocess.run(
+			['ssh'] + ssh_options + ['-o', f'ControlPath={control_path}', '-O', 'exit', ssh_target],
+			stdin=subprocess.DEVNULL,
+			capture_output=True,
+			timeout=5,
+			check=False
+		)
+	except Exception as e:
+		frappe.logger().warning(f"Could not close SSH master for {ssh_target}: {str(e)}")
+	
+	if os.path.exists(control_path):
+		try:
+			os.unlink(control_path)
+		except OSError:
+			pass
+
+
+def run_ssh_command(ssh_target, remote_cmd, ssh_options, timeout=10, input=None, reconnect=None):
+	"""
+	Run a command on the remote host over the pooled SSH connection
+	
+	One ssh process per command, multiplexed over the master connection for the target.
+	The master is opened first when there is none (kept open for ControlPersist seconds
+	after the last command), so connecting and the command are timed separately. With
+	ControlMaster=auto the command still becomes the master itself if that failed. If the
+	connection turns out to be dead, the master is closed and the command retried once.
+	
+	Args:
+		ssh_target: user@host
+		remote_cmd: Command line to run on the remote host
+		ssh_options: Options from get_ssh_options()
+		timeout: Timeout for the remote command itself (connecting may take SSH_CONNECT_TIMEOUT more)
+		input: Optional text passed to the remote command's stdin
+		reconnect: Optional callable run before the retry, returning the (ssh_target, ssh_options)
+			to retry with, or None to give up (e.g. to re-check a Cloudflare tunnel)
+	
+	Returns:
+		subprocess.CompletedProcess
+	
+	Raises:
+		subprocess.TimeoutExpired: If the command did not finish in time
+	"""
+	_ensure_control_dir()
+	control_path = get_control_path(ssh_target, ssh_options)
+	
+	for attempt in range(2):
+		_open_master(ssh_target, ssh_options, control_path)
+		with stage_timer("remote", "SSH+OCC"):
+			result = subprocess.run(
+				['ssh'] + ssh_options + [
+					'-o', 'ControlMaster=auto',
+					'-o', f'ControlPath={control_path}',
+					'-o', f'ControlPersist={SSH_CONTROL_PERSIST}',
+					'-o', 'ServerAliveInterval=30',
+					ssh_target,
+					remote_cmd
+				],
+				input=input,
+				stdin=None if input is not None else subprocess.DEVNULL,
+				capture_output=True,
+				text=True,
+				timeout=timeout + SSH_CONNECT_TIMEOUT,
+				check=False
+			)
+		
+		if result.returncode != SSH_CONNECTION_ERROR or attempt:
+			return result
+		
+		# Connection dropped (server restart, network blip) - reconnect and try once more
+		frappe.logger().warning(f"SSH connection to {ssh_target} failed, reconnecting: {result.stderr.strip()}")
+		close_ssh_master(ssh_target, ssh_options)
+		if reconnect:
+			connection = reconnect()
+			if not connection:
+				return result
+			ssh_target, ssh_options = connection
+			control_path = get_control_path(ssh_target, ssh_options)
+	
+	return result
@@ -0,0 +1,208 @@
+import frappe
+import hashlib
+import time
+import uuid
+from contextlib import contextmanager
+from frappe.utils import cint
+
+# Name of the Nextcloud configured directly in Nextcloud Settings
+DEFAULT_TARGET = "Default"
+
+# Folder operations in flight per target, across all workers: sorted set of lease tokens scored by expiry
+TARGET_SLOTS_KEY = "nextcloud_integration:target_slots"
+
+# Lifetime of a slot lease, so the slot of a killed worker is freed on its own (seconds)
+SLOT_TTL = 900
+
+# How long a job waits before trying a busy target again (seconds)
+TARGET_BUSY_DELAY = 15
+
+# Fields a target row overrides on top of Nextcloud Settings (everything else is shared)
+TARGET_FIELDS = (
+	"nextcloud_url",
+	"username",
+	"use_rest_api",
+	"use_ssh",
+	"ssh_host",
+	"ssh_user",
+	"ssh_key_path",
+	"nextcloud_path",
+	"occ_user",
+	"max_concurrency",
+	"use_service_token",
+	"cf_client_id",
+	"cf_client_secret"
+)
+
+# Password fields a target row has of its own (decrypted from the row, not from the settings)
+TARGET_PASSWORD_FIELDS = ("password", "cf_client_secret")
+
+# Routing rules matched against Opportunity fields
+RULE_FIELDS = {
+	"Company": "company",
+	"Opportunity Type": "opportunity_type"
+}
+
+
+class TargetConfig:
+	"""
+	Nextcloud Settings as seen by one additional target
+	
+	Connection fields, the password and the Cloudflare service token come from the target row, everything else
+	(features, folder layout, batching) from the settings, so the object can be passed
+	wherever a Nextcloud Settings document is expected.
+	"""
+	
+	def __init__(self, settings, row):
+		self._settings = settings
+		self._row = row
+		self.target_name = row.target_name
+	
+	def __getattr__(self, name):
+		if name in TARGET_FIELDS:
+			return self._row.get(name)
+		return getattr(self._settings, name)
+	
+	def get(self, name, default=None):
+		value = getattr(self, name, None)
+		return default if value is None else value
+	
+	def get_password(self, fieldname="password", raise_exception=True):
+		if fieldname in TARGET_PASSWORD_FIELDS:
+			return self._row.get_password(fieldname, raise_exception=raise_exception)
+		return self._settings.get_password(fieldname, raise_exception=raise_exception)
+
+
+def get_target_name(nextcloud_config):
+	"""Name of the target a config belongs to"""
+	return getattr(nextcloud_config, "target_name", None) or DEFAULT_TARGET
+
+
+def get_targets(settings):
+	"""All enabled targets: the default target first, then the additional ones in table order"""
+	return [settings] + [TargetConfig(settings, row) for row in (settings.get("targets") or []) if row.enabled]
+
+
+def get_target_config(settings, target_name):
+	"""
+	Get the config of a target by name (the default target for an empty name)
+	
+	Folders stay on the target they were created on, so an unknown or disabled
+	target is an error rather than a silent switch to another server.
+	"""
+	if not target_name or target_name == DEFAULT_TARGET:
+		return settings
+	for row in settings.get("targets") or []:
+		if row.target_name == target_name:
+			return TargetConfig(settings, row)
+	frappe.throw(f"Nextcloud target {target_name} is not configured in Nextcloud Settings")
+
+
+def _hash_target(opportunity_name, pool):
+	"""
+	Pick a target by rendezvous hashing: every Opportunity keeps its target when targets
+	are added or removed, except the share that moves to a new target
+	"""
+	return max(pool, key=lambda config: hashlib.md5(
+		f"{get_target_name(config)}:{opportunity_name}".encode("utf-8")
+	).hexdigest())
+
+
+def resolve_targets(settings, opportunity_names):
+	"""
+	Route Opportunities to targets: Company / Opportunity Type rules first, then the hash pool
+	
+	Without additional targets nothing is queried; otherwise the rule fields of all
+	Opportunities are loaded in one query.
+	
+	Returns:
+		dict: {opportunity_name: config}
+	"""
+	rows = [row for row in (settings.get("targets") or []) if row.enabled]
+	if not rows:
+		return {name: settings for name in opportunity_names}
+	
+	rules = [row for row in rows if row.routing in RULE_FIELDS and row.routing_value]
+	pool = [TargetConfig(settings, row) for row in rows if row.routing == "Hash Pool"]
+	if pool and cint(getattr(settings, "default_in_hash_pool", 1)):
+		pool.insert(0, settings)
+	
+	values = {}
+	fields = sorted({RULE_FIELDS[row.routing] for row in rules})
+	if fields and opportunity_names:
+		values = {
+			row.name: row for row in frappe.get_all(
+				"Opportunity",
+				filters={"name": ["in", list(opportunity_names)]},
+				fields=["name"] + fields
+			)
+		}
+	
+	targets = {}
+	for name in opportunity_names:
+		opportunity = values.get(name) or {}
+		row = next((r for r in rules if opportunity.get(RULE_FIELDS[r.routing]) == r.routing_value), None)
+		if row:
+			targets[name] = TargetConfig(settings, row)
+		elif pool:
+			targets[name] = _hash_target(name, pool)
+		else:
+			targets[name] = settings
+	return targets
+
+
+def resolve_target(settings, opportunity_name):
+	"""Route one Opportunity to its target (see resolve_targets)"""
+	return resolve_targets(settings, [opportunity_name])[opportunity_name]
+
+
+def _slot_key(nextcloud_config):
+	return frappe.cache().make_key(f"{TARGET_SLOTS_KEY}:{get_target_name(nextcloud_config)}")
+
+
+def acquire_slot(nextcloud_config):
+	"""
+	Take one of the target's concurrent operation slots
+	
+	Each slot is a lease in a sorted set, scored by its expiry: expired leases (of workers
+	that died holding one) are dropped first, then the new lease is kept only if fewer than
+	max_concurrency leases are ahead of it.
+	
+	Returns:
+		str: Lease token to pass to release_slot, or None if the target already runs max_concurrency operations
+	"""
+	token = uuid.uuid4().hex
+	limit = cint(getattr(nextcloud_config, "max_concurrency", 0))
+	if limit <= 0:
+		return token
+	
+	cache = frappe.cache()
+	key = _slot_key(nextcloud_config)
+	now = time.time()
+	pipe = cache.pipeline()
+	pipe.zremrangebyscore(key, 0, now)
+	pipe.zadd(key, {token: now + SLOT_TTL})
+	pipe.zrank(key, token)
+	pipe.expire(key, SLOT_TTL)
+	_, _, rank, _ = pipe.execute()
+	if rank is None or rank >= limit:
+		cache.zrem(key, token)
+		return None
+	return token
+
+
+def release_slot(nextcloud_config, token):
+	"""Give back a slot taken with acquire_slot"""
+	if cint(getattr(nextcloud_config, "max_concurrency", 0)) > 0:
+		frappe.cache().zrem(_slot_key(nextcloud_config), token)
+
+
+@contextmanager
+def target_slot(nextcloud_config):
+	"""Hold a slot of the target for the wrapped block; yields the lease token, or None (and holds nothing) when busy"""
+	token = acquire_slot(nextcloud_config)
+	try:
+		yield token
+	finally:
+		if token:
+			release_slot(nextcloud_config, token)
@@ -0,0 +1,48 @@
+import time
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from nextcloud_integration.nextcloud_integration.backend_router import BACKEND_SSH, BACKEND_WEBDAV
+from nextcloud_integration.nextcloud_integration.health_monitor import (
+	HEALTH_KEY,
+	HISTORY_KEY,
+	STATUS_DOWN,
+	STATUS_UP,
+	_save_status,
+	get_down_backends,
+	get_outage,
+)
+
+
+class TestHealthMonitor(FrappeTestCase):
+	def setUp(self):
+		self.config = frappe._dict(
+			target_name="Health Test",
+			use_ssh=1,
+			ssh_host="nextcloud.example.com",
+			ssh_user="ncadmin"
+		)
+		self.fields = [f"Health Test:{BACKEND_SSH}", f"Health Test:{BACKEND_WEBDAV}"]
+	
+	def tearDown(self):
+		for field in self.fields:
+			frappe.cache().hdel(HEALTH_KEY, field)
+			frappe.cache().delete_value(f"{HISTORY_KEY}:{field}")
+	
+	def _status(self, status):
+		return {"status": status, "latency": 0.01, "checked_at": time.time(), "error": "probe failed" if status != STATUS_UP else None}
+	
+	def test_outage_when_every_backend_is_down(self):
+		_save_status(self.config, BACKEND_SSH, self._status(STATUS_DOWN))
+		_save_status(self.config, BACKEND_WEBDAV, self._status(STATUS_DOWN))
+		
+		self.assertEqual(get_down_backends(self.config), [BACKEND_SSH, BACKEND_WEBDAV])
+		self.assertIn("probe failed", get_outage(self.config))
+	
+	def test_no_outage_while_one_backend_is_up(self):
+		_save_status(self.config, BACKEND_SSH, self._status(STATUS_DOWN))
+		_save_status(self.config, BACKEND_WEBDAV, self._status(STATUS_UP))
+		
+		self.assertEqual(get_down_backends(self.config), [BACKEND_SSH])
+		self.assertIsNone(get_outage(self.config))
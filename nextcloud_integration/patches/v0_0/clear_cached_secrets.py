@@ -0,0 +1,6 @@
+import frappe
+
+
+def execute():
+	"""Remove the decrypted secrets that earlier versions kept in the site cache (now kept in worker memory only)"""
+	frappe.cache().delete_value("nextcloud_integration:secrets")
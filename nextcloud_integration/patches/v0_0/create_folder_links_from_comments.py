@@ -0,0 +1,33 @@
+import frappe
+from urllib.parse import parse_qs, urlparse
+
+
+def execute():
+	"""Create Nextcloud Folder records from the "Nextcloud folder created" comments of existing Opportunities"""
+	frappe.reload_doc("nextcloud_integration", "doctype", "nextcloud_folder")
+	
+	comments = frappe.db.sql("""
+		select c.reference_name, c.content, c.creation
+		from `tabComment` c
+		where c.reference_doctype = 'Opportunity'
+			and c.comment_type = 'Info'
+			and c.content like 'Nextcloud folder created:%%'
+		order by c.creation
+	""", as_dict=True)
+	
+	for comment in comments:
+		if frappe.db.exists("Nextcloud Folder", comment.reference_name):
+			continue
+		if not frappe.db.exists("Opportunity", comment.reference_name):
+			continue
+		
+		folder_url = comment.content.split(":", 1)[1].strip()
+		folder_path = (parse_qs(urlparse(folder_url).query).get("dir") or [None])[0]
+		
+		frappe.get_doc({
+			"doctype": "Nextcloud Folder",
+			"opportunity": comment.reference_name,
+			"folder_path": folder_path,
+			"folder_url": folder_url,
+			"created_on": comment.creation
+		}).insert(ignore_permissions=True)
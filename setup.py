@@ -9,10 +9,11 @@ setup(
 	description="Automatically create Nextcloud folders for new opportunities",
 	author="ALKHORA",
 	author_email="support@alkhora.com",
-	packages=find_packages(exclude=["tests", "tests.*"]),
+	packages=find_packages(exclude=["tests", "tests.*", "benchmarks", "benchmarks.*"]),
 	zip_safe=False,
 	include_package_data=True,
 	install_requires=[
-		"requests>=2.28.0"
+		"requests>=2.28.0",
+		"aiohttp>=3.8.0"
 	]
 )